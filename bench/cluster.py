@@ -0,0 +1,63 @@
+# Broadcast-Durchsatz im Mehrkern-Modus (run_server --workers N) im Vergleich
+# zum Einzelprozess mit asyncio-Engine.
+#
+#   python -m Peer2PeerChatRoom.bench.cluster --workers 1,4
+import argparse
+import json
+import os
+import time
+from .engine import broadcast_load, proc_cpu_seconds, start_server, stop_server
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == pid:
+            found.append(int(entry))
+    return found
+
+
+def run(workers, port, opts):
+    extra = ("--workers", str(workers)) if workers else ()
+    proc = start_server("async", port, extra, pin=False)
+    try:
+        time.sleep(1.0 if workers else 0.2)
+        pids = [proc.pid] + children(proc.pid)
+        cpu_before = sum(proc_cpu_seconds(p) for p in pids)
+        received, elapsed = broadcast_load(port, opts.receivers, opts.messages, opts.size, opts.senders)
+        cpu = sum(proc_cpu_seconds(p) for p in pids) - cpu_before
+    finally:
+        stop_server(proc)
+    return {
+        "workers": workers,
+        "deliveries": received,
+        "deliveries_per_s": round(received / elapsed),
+        "server_cpu_s": round(cpu, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark des Mehrkern-Modus")
+    parser.add_argument("--workers", default="0,1,4", help="0 = Einzelprozess ohne Bus")
+    parser.add_argument("--port", type=int, default=9120)
+    parser.add_argument("--receivers", type=int, default=200)
+    parser.add_argument("--senders", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--size", type=int, default=64)
+    opts = parser.parse_args(argv)
+
+    results = {"cpus": len(os.sched_getaffinity(0)), "runs": []}
+    for i, workers in enumerate(int(w) for w in opts.workers.split(",")):
+        results["runs"].append(run(workers, opts.port + i, opts))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# Prüft den Mehrkern-Modus (run_server --workers 4) auf localhost:
+# Broadcast über Worker-Grenzen, doppelter Nickname auf einem anderen Worker,
+# vollständige USERLIST. Exit-Code 1 bei einem Fehler.
+#
+#   python -m Peer2PeerChatRoom.bench.cluster_check
+#
+# Welcher Worker eine Verbindung angenommen hat, steht in /proc (Linux): der
+# Socket mit Server-Port und Client-Port gehört zu genau einem Worker-Prozess.
+import argparse
+import os
+import time
+from ..network.protocol import Protocol
+from .cluster import children
+from .engine import TextClient, start_server, stop_server
+
+LISTEN = "0A"
+ESTABLISHED = "01"
+
+
+def tcp_sockets():
+    # (lokaler Port, entfernter Port, Zustand, Inode) aller IPv4-TCP-Sockets
+    with open("/proc/net/tcp") as f:
+        next(f)
+        for line in f:
+            fields = line.split()
+            yield (int(fields[1].split(":")[1], 16), int(fields[2].split(":")[1], 16), fields[3], fields[9])
+
+
+def socket_owners(pids):
+    owners = {}
+    for pid in pids:
+        try:
+            fds = os.listdir(f"/proc/{pid}/fd")
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                link = os.readlink(f"/proc/{pid}/fd/{fd}")
+            except OSError:
+                continue
+            if link.startswith("socket:["):
+                owners[link[8:-1]] = pid
+    return owners
+
+
+def listening_workers(pid, port):
+    owners = socket_owners(children(pid))
+    return {owners[inode] for local, _, state, inode in tcp_sockets()
+            if local == port and state == LISTEN and inode in owners}
+
+
+def worker_of(pid, port, client, timeout=2.0):
+    # Worker-Prozess, der die Verbindung von client angenommen hat
+    client_port = client.sock.getsockname()[1]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        owners = socket_owners(children(pid))
+        for local, remote, state, inode in tcp_sockets():
+            if local == port and remote == client_port and state == ESTABLISHED and inode in owners:
+                return owners[inode]
+        time.sleep(0.02)
+    raise SystemExit(f"FEHLER: Verbindung von Port {client_port} keinem Worker zuzuordnen")
+
+
+def check(ok, message):
+    print(("OK     " if ok else "FEHLER ") + message)
+    return ok
+
+
+def run(opts):
+    port, workers = opts.port, opts.workers
+    proc = start_server("async", port, ("--workers", str(workers)), pin=False)
+    clients = []
+    try:
+        deadline = time.monotonic() + 10
+        while len(listening_workers(proc.pid, port)) < workers and time.monotonic() < deadline:
+            time.sleep(0.05)
+        results = [check(len(listening_workers(proc.pid, port)) == workers, f"{workers} Worker lauschen auf {port}")]
+
+        nicks = [f"nutzer{i}" for i in range(opts.clients)]
+        placement = {}
+        for nick in nicks:
+            client = TextClient(port)
+            reply = client.register(nick)
+            if not reply or reply[0] != "WELCOME":
+                raise SystemExit(f"FEHLER: {nick} nicht angemeldet: {reply}")
+            clients.append(client)
+            placement[nick] = worker_of(proc.pid, port, client)
+        used = len(set(placement.values()))
+        results.append(check(used > 1, f"{len(nicks)} Clients auf {used} Worker verteilt"))
+
+        # Presence der anderen Worker kommt über den Bus; kurz nachlaufen lassen
+        time.sleep(0.3)
+        late = TextClient(port)
+        reply = late.register("nachzuegler")
+        listing = late.wait(lambda cmd, args: cmd == "USERLIST")
+        clients.append(late)
+        listed = {entry.split(":")[0] for entry in listing[1]} if listing else set()
+        missing = set(nicks) - listed
+        results.append(check(reply is not None and reply[0] == "WELCOME" and not missing,
+                             f"USERLIST vollständig ({len(listed)} Einträge"
+                             + (f", es fehlen {sorted(missing)})" if missing else ")")))
+
+        clients[0].sock.sendall(Protocol.broadcast(nicks[0], "über alle worker"))
+        receivers = clients[1:]
+        got = [c.wait(lambda cmd, args: cmd == "BROADCAST" and args[:1] == [nicks[0]]) is not None
+               for c in receivers]
+        remote = sum(1 for nick, ok in zip(nicks[1:], got) if ok and placement[nick] != placement[nicks[0]])
+        results.append(check(all(got) and remote > 0,
+                             f"Broadcast bei {sum(got)}/{len(receivers)} Clients, davon {remote} auf anderen Workern"))
+
+        # Verbindungen öffnen, bis eine bei einem anderen Worker als nicks[0] landet
+        owner = placement[nicks[0]]
+        duplicate = None
+        for _ in range(50):
+            candidate = TextClient(port)
+            if worker_of(proc.pid, port, candidate) != owner:
+                duplicate = candidate
+                break
+            candidate.close()
+        if duplicate is None:
+            results.append(check(False, "keine Verbindung auf einem anderen Worker gelandet"))
+        else:
+            reply = duplicate.register(nicks[0])
+            duplicate.close()
+            results.append(check(reply is not None and reply[0] == "ERROR",
+                                 f"doppelter Nickname auf anderem Worker abgelehnt ({reply})"))
+    finally:
+        for client in clients:
+            client.close()
+        stop_server(proc)
+    return all(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Funktionsprüfung des Mehrkern-Modus")
+    parser.add_argument("--port", type=int, default=9180)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=12)
+    opts = parser.parse_args(argv)
+    if not run(opts):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
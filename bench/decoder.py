@@ -0,0 +1,103 @@
+# Mikrobenchmark: pipelined kleine Frames, in recv-großen Stücken gelesen.
+#   legacy  – buffer += data; decode_stream() mit Slices (Stand vor FrameDecoder)
+#   decoder – FrameDecoder.recv_into() + memoryview-Payloads
+#
+#   python -m Peer2PeerChatRoom.bench.decoder
+import argparse
+import json
+import struct
+import time
+from ..network.protocol import FrameDecoder, Protocol
+
+
+def legacy_decode_stream(buffer):
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= 4:
+        msg_len = struct.unpack("!I", buffer[offset:offset + 4])[0]
+        if len(buffer) - offset - 4 < msg_len:
+            break
+        messages.append(buffer[offset + 4:offset + 4 + msg_len])
+        offset += 4 + msg_len
+    return messages, buffer[offset:]
+
+
+class StreamSock:
+    # liefert einen festen Byte-Strom in Stücken von chunk Bytes
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.chunk = chunk
+        self.pos = 0
+
+    def recv(self, bufsize):
+        n = min(bufsize, self.chunk)
+        out = self.data[self.pos:self.pos + n].tobytes()
+        self.pos += len(out)
+        return out
+
+    def recv_into(self, buf):
+        n = min(len(buf), self.chunk, len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def run_legacy(stream, chunk):
+    sock = StreamSock(stream, chunk)
+    buffer = b""
+    count = 0
+    while True:
+        data = sock.recv(chunk)
+        if not data:
+            break
+        buffer += data
+        messages, buffer = legacy_decode_stream(buffer)
+        count += len(messages)
+    return count
+
+
+def run_decoder(stream, chunk):
+    sock = StreamSock(stream, chunk)
+    decoder = FrameDecoder()
+    count = 0
+    while decoder.recv_into(sock):
+        for _ in decoder.frames():
+            count += 1
+    return count
+
+
+def measure(func, stream, chunk, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func(stream, chunk)
+        best = min(best, time.perf_counter() - start)
+    return best, count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FrameDecoder-Mikrobenchmark")
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--chunks", default="4096,65536,1048576",
+                        help="Bytes pro recv-Aufruf")
+    parser.add_argument("--repeat", type=int, default=3)
+    opts = parser.parse_args(argv)
+
+    stream = b"".join(Protocol.broadcast(f"user{i % 50}", "hi 👋") for i in range(opts.frames))
+    results = []
+    for chunk in (int(c) for c in opts.chunks.split(",")):
+        legacy, n1 = measure(run_legacy, stream, chunk, opts.repeat)
+        decoder, n2 = measure(run_decoder, stream, chunk, opts.repeat)
+        assert n1 == n2 == opts.frames
+        results.append({
+            "chunk": chunk,
+            "frames": opts.frames,
+            "legacy_mframes_per_s": round(opts.frames / legacy / 1e6, 3),
+            "decoder_mframes_per_s": round(opts.frames / decoder / 1e6, 3),
+            "speedup": round(legacy / decoder, 2),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# Vergleich der Server-Engines: idle Verbindungen + Broadcast-Last auf einem Kern.
+#
+#   python -m Peer2PeerChatRoom.bench.engine --engine async --idle 10000
+import argparse
+import json
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from ..network.protocol import FrameDecoder, Protocol
+
+PACKAGE = __package__.rsplit(".", 1)[0]
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start_server(engine, port, extra_args=(), pin=True, stdout=subprocess.DEVNULL):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", f"{PACKAGE}.server.run_server",
+         "--engine", engine, "--host", "127.0.0.1", "--port", str(port), *extra_args],
+        cwd=PACKAGE_PARENT, stdin=subprocess.PIPE, stdout=stdout,
+    )
+    if pin:
+        try:
+            os.sched_setaffinity(proc.pid, {min(os.sched_getaffinity(0))})
+        except (AttributeError, OSError):
+            pass
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Server ist nicht gestartet")
+
+
+def stop_server(proc):
+    try:
+        proc.stdin.write(b"exit\n")
+        proc.stdin.flush()
+        proc.wait(timeout=10)
+    except Exception:
+        proc.kill()
+
+
+def proc_status(pid):
+    info = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "Threads"):
+                info[key] = int(value.split()[0])
+    return info
+
+
+def proc_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def open_idle(port, count):
+    socks = []
+    for _ in range(count):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect(("127.0.0.1", port))
+        socks.append(s)
+    return socks
+
+
+def register(port, nick):
+    s = socket.create_connection(("127.0.0.1", port))
+    s.sendall(Protocol.register(nick, "0"))
+    buffer = b""
+    while True:
+        buffer += s.recv(65536)
+        messages, buffer = Protocol.decode_stream(buffer)
+        if any(m.startswith(b"WELCOME") for m in messages):
+            return s
+
+
+class TextClient:
+    # Blockierender Client im Textprotokoll für die Prüfskripte (cluster_check, federation_check)
+    def __init__(self, port, timeout=5.0):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=timeout)
+        self.decoder = FrameDecoder()
+        # Alle empfangenen Nachrichten als (befehl, argumente)
+        self.received = []
+
+    def register(self, nick):
+        # Antwort des Servers: ("WELCOME", …), ("ERROR", …) oder None
+        self.sock.sendall(Protocol.register(nick, "0"))
+        return self.wait(lambda cmd, args: cmd in ("WELCOME", "ERROR"))
+
+    def wait(self, match, timeout=5.0):
+        # Erste Nachricht, für die match(cmd, args) gilt; None nach timeout oder Verbindungsende
+        deadline = time.monotonic() + timeout
+        while True:
+            for payload in self.decoder.frames():
+                message = Protocol.extract_command(payload)
+                self.received.append(message)
+                if match(*message):
+                    return message
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                if not self.decoder.recv_into(self.sock):
+                    return None
+            except socket.timeout:
+                return None
+
+    def count(self, command, *args):
+        return sum(1 for cmd, a in self.received if cmd == command and a[:len(args)] == list(args))
+
+    def close(self):
+        self.sock.close()
+
+
+def pump(sel, timeout):
+    broadcasts = 0
+    for key, _ in sel.select(timeout=timeout):
+        state = key.data
+        try:
+            data = key.fileobj.recv(1 << 20)
+        except BlockingIOError:
+            continue
+        messages, state[0] = Protocol.decode_stream(state[0] + data)
+        broadcasts += sum(1 for m in messages if m.startswith(b"BROADCAST"))
+    return broadcasts
+
+
+def broadcast_load(port, receivers, messages, size, senders=1):
+    socks = [register(port, f"bot{i}") for i in range(receivers)]
+    sel = selectors.DefaultSelector()
+    for s in socks:
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ, [b""])
+    # Beitritts-Events der anderen Bots abarbeiten, bevor gemessen wird
+    while sel.select(timeout=0.5):
+        pump(sel, 0)
+
+    frames = [Protocol.broadcast(f"bot{i}", "x" * size) for i in range(senders)]
+    expected = receivers * messages * senders
+    received = 0
+    sent = 0
+    start = time.perf_counter()
+    while received < expected and time.perf_counter() - start < 120:
+        if sent < messages:
+            chunk = min(50, messages - sent)
+            for sender, frame in zip(socks, frames):
+                sender.setblocking(True)
+                sender.sendall(frame * chunk)
+                sender.setblocking(False)
+            sent += chunk
+        received += pump(sel, 1.0)
+    elapsed = time.perf_counter() - start
+    for s in socks:
+        s.close()
+    return received, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark der Server-Engines")
+    parser.add_argument("--engine", default="async")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--idle", type=int, default=10000)
+    parser.add_argument("--receivers", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--size", type=int, default=64)
+    opts = parser.parse_args(argv)
+
+    proc = start_server(opts.engine, opts.port)
+    result = {"engine": opts.engine}
+    try:
+        base = proc_status(proc.pid)
+        start = time.perf_counter()
+        idle = open_idle(opts.port, opts.idle)
+        time.sleep(1.0)
+        loaded = proc_status(proc.pid)
+        result["idle_connections"] = len(idle)
+        result["idle_connect_s"] = round(time.perf_counter() - start, 3)
+        result["rss_kb_base"] = base["VmRSS"]
+        result["rss_kb_idle"] = loaded["VmRSS"]
+        result["rss_bytes_per_conn"] = round((loaded["VmRSS"] - base["VmRSS"]) * 1024 / max(1, len(idle)))
+        result["threads_idle"] = loaded["Threads"]
+
+        cpu_before = proc_cpu_seconds(proc.pid)
+        received, elapsed = broadcast_load(opts.port, opts.receivers, opts.messages, opts.size)
+        cpu = proc_cpu_seconds(proc.pid) - cpu_before
+        result["deliveries"] = received
+        result["deliveries_per_s"] = round(received / elapsed)
+        result["server_cpu_s"] = round(cpu, 3)
+        result["server_cpu_us_per_delivery"] = round(cpu * 1e6 / max(1, received), 2)
+        for s in idle:
+            s.close()
+    finally:
+        stop_server(proc)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
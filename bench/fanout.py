@@ -0,0 +1,105 @@
+# CPU-Kosten pro Broadcast in Abhängigkeit der Raumgröße, über echte Sockets:
+#   before – Frame pro Empfänger neu bauen, Writer schreibt b"".join(...) per sendall
+#   after  – Frame einmal bauen und teilen, Writer schreibt gebündelt per sendmsg
+#
+#   python -m Peer2PeerChatRoom.bench.fanout
+import argparse
+import json
+import socket
+import time
+from ..network.protocol import Protocol
+from ..server.outbound import send_frames
+from ..server.server import ChatServer, Client
+
+
+def make_room(room):
+    srv = ChatServer()
+    peers = []
+    for i in range(room):
+        a, b = socket.socketpair()
+        for s in (a, b):
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        b.setblocking(False)
+        client = Client(a, "127.0.0.1")
+        client.nickname = f"user{i}"
+        srv.clients[client.nickname] = client
+        peers.append(b)
+    return srv, peers
+
+
+def drain(peers):
+    for peer in peers:
+        try:
+            while peer.recv(1 << 20):
+                pass
+        except BlockingIOError:
+            pass
+
+
+def close_room(srv, peers):
+    for client in srv.clients.values():
+        client.conn.close()
+    for peer in peers:
+        peer.close()
+
+
+def run(room, messages, text, batch, encode_once):
+    srv, peers = make_room(room)
+    clients = list(srv.clients.values())
+    cpu = 0.0
+    syscalls = 0
+    for sent in range(1, messages + 1):
+        start = time.process_time()
+        if encode_once:
+            srv.broadcast("alice", text)
+        else:
+            for client in clients:
+                client.send(Protocol.broadcast("alice", text))
+        if sent % batch == 0 or sent == messages:
+            # entspricht einem Durchlauf aller Writer
+            for client in clients:
+                frames = client.queue.take(block=False)
+                if encode_once:
+                    send_frames(client.conn, frames)
+                else:
+                    client.conn.sendall(b"".join(frames))
+                syscalls += 1
+            cpu += time.process_time() - start
+            drain(peers)
+        else:
+            cpu += time.process_time() - start
+    close_room(srv, peers)
+    return cpu, syscalls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fan-out-Benchmark")
+    parser.add_argument("--rooms", default="10,100,1000,5000")
+    parser.add_argument("--deliveries", type=int, default=200000,
+                        help="Zustellungen pro Messpunkt (Nachrichten = deliveries / Raumgröße)")
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--batch", type=int, default=8,
+                        help="Frames, die sich pro Writer-Durchlauf ansammeln")
+    opts = parser.parse_args(argv)
+
+    text = "x" * opts.size
+    results = []
+    for room in (int(r) for r in opts.rooms.split(",")):
+        messages = max(opts.batch, opts.deliveries // room)
+        cpu_before, _ = run(room, messages, text, opts.batch, encode_once=False)
+        cpu_after, syscalls = run(room, messages, text, opts.batch, encode_once=True)
+        results.append({
+            "room": room,
+            "messages": messages,
+            "before_us_per_msg": round(cpu_before * 1e6 / messages, 1),
+            "after_us_per_msg": round(cpu_after * 1e6 / messages, 1),
+            "before_us_per_delivery": round(cpu_before * 1e6 / (messages * room), 3),
+            "after_us_per_delivery": round(cpu_after * 1e6 / (messages * room), 3),
+            "send_syscalls": syscalls,
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
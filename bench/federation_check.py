@@ -0,0 +1,191 @@
+# Prüft die Föderation mit drei Knoten auf localhost (a, b, c, vollvermascht, also
+# mit Schleifen): geflutete BROADCAST/USER_JOINED kommen bei jedem Client genau
+# einmal an, und nach einem Neustart von c hat c wieder das vollständige
+# Verzeichnis, ohne Nutzer, die inzwischen gegangen sind. Exit-Code 1 bei einem Fehler.
+#
+#   python -m Peer2PeerChatRoom.bench.federation_check --engine async
+#
+# Die Links eines Knotens liest das Skript über den Konsolenbefehl "peers".
+import argparse
+import os
+import tempfile
+import time
+from ..network.protocol import Protocol
+from ..server.federation import RECONNECT_DELAY
+from .cluster_check import check
+from .engine import TextClient, start_server, stop_server
+
+# Knoten -> Knoten, zu denen er sich selbst verbindet
+TOPOLOGY = {"a": (), "b": ("a",), "c": ("a", "b")}
+LINK_TIMEOUT = 4 * RECONNECT_DELAY + 5
+# So lange wird nach dem ersten Eintreffen auf Duplikate gewartet
+QUIET = 1.0
+
+
+class Node:
+    def __init__(self, name, index, opts, directory):
+        self.name = name
+        self.port = opts.port + index
+        self.federation_port = opts.port + 100 + index
+        self.opts = opts
+        self.log = os.path.join(directory, f"{name}.log")
+        self.proc = None
+
+    def start(self, nodes):
+        args = ["--node-id", self.name, "--federation-listen", f"127.0.0.1:{self.federation_port}"]
+        for peer in TOPOLOGY[self.name]:
+            args += ["--peer", f"127.0.0.1:{nodes[peer].federation_port}"]
+        with open(self.log, "ab") as log:
+            self.proc = start_server(self.opts.engine, self.port, args, pin=False, stdout=log)
+
+    def stop(self):
+        stop_server(self.proc)
+
+    def peers(self):
+        # Antwort auf "peers" aus dem Log des Prozesses
+        with open(self.log, "rb") as f:
+            offset = len(f.read())
+        self.proc.stdin.write(b"peers\n")
+        self.proc.stdin.flush()
+        deadline = time.monotonic() + 2
+        previous = None
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            with open(self.log, "rb") as f:
+                f.seek(offset)
+                text = f.read()
+            if text == previous:
+                # Ausgabe steht still: die Liste ist vollständig
+                break
+            previous = text
+        lines = (previous or b"").decode("utf-8", "replace").splitlines()
+        found = set()
+        for i, line in enumerate(lines):
+            if line.startswith("Verbundene Knoten:"):
+                for entry in lines[i + 1:]:
+                    if not entry.startswith(" - "):
+                        break
+                    found.add(entry[3:])
+        return found
+
+
+def wait_links(nodes, names):
+    deadline = time.monotonic() + LINK_TIMEOUT
+    while True:
+        links = {name: nodes[name].peers() for name in names}
+        if all(links[name] == set(nodes) - {name} for name in names) or time.monotonic() > deadline:
+            return links
+
+
+def listing(port, nick):
+    client = TextClient(port)
+    reply = client.register(nick)
+    entries = client.wait(lambda cmd, args: cmd == "USERLIST") if reply and reply[0] == "WELCOME" else None
+    return client, {entry.split(":")[0] for entry in entries[1]} if entries else set()
+
+
+def settle(clients):
+    # Alles einsammeln, was noch unterwegs ist (auch Duplikate)
+    time.sleep(QUIET)
+    for client in clients:
+        client.wait(lambda cmd, args: False, 0.05)
+
+
+def run(opts):
+    os.environ["PYTHONUNBUFFERED"] = "1"
+    results = []
+    clients = []
+    with tempfile.TemporaryDirectory() as directory:
+        nodes = {name: Node(name, i, opts, directory) for i, name in enumerate(TOPOLOGY)}
+        try:
+            for node in nodes.values():
+                node.start(nodes)
+            links = wait_links(nodes, nodes)
+            results.append(check(all(links[n] == set(nodes) - {n} for n in nodes),
+                                 "Links: " + ", ".join(f"{n}→{sorted(links[n])}" for n in nodes)))
+
+            watchers = {}
+            for name, node in nodes.items():
+                watchers[name] = TextClient(node.port)
+                watchers[name].register(f"beob_{name}")
+                clients.append(watchers[name])
+            settle(clients)
+
+            # Beitritt und Broadcast an a: jeder Beobachter genau einmal
+            dora = TextClient(nodes["a"].port)
+            clients.append(dora)
+            dora.register("dora")
+            dora.sock.sendall(Protocol.broadcast("dora", "genau einmal"))
+            for watcher in watchers.values():
+                watcher.wait(lambda cmd, args: cmd == "BROADCAST" and args[:1] == ["dora"])
+            settle(clients)
+            for name, watcher in watchers.items():
+                joined, broadcasts = watcher.count("USER_JOINED", "dora"), watcher.count("BROADCAST", "dora")
+                results.append(check(joined == 1 and broadcasts == 1,
+                                     f"beob_{name}: USER_JOINED dora {joined}x, BROADCAST {broadcasts}x"))
+
+            # c neu starten; währenddessen geht dora, erin kommt an b dazu
+            clients.remove(watchers["c"])
+            watchers["c"].close()
+            nodes["c"].stop()
+            dora.close()
+            clients.remove(dora)
+            erin = TextClient(nodes["b"].port)
+            clients.append(erin)
+            erin.register("erin")
+            watchers["a"].wait(lambda cmd, args: cmd == "USER_LEFT" and args[:1] == ["dora"])
+            nodes["c"].start(nodes)
+            links = wait_links(nodes, ["c"])
+            results.append(check(links["c"] == {"a", "b"}, f"c nach Neustart verbunden mit {sorted(links['c'])}"))
+
+            # Bis c sein Verzeichnis geholt hat, mit Wegwerf-Nicks nachsehen
+            expected = {"beob_a", "beob_b", "erin"}
+            deadline = time.monotonic() + LINK_TIMEOUT
+            attempt = 0
+            while True:
+                probe, listed = listing(nodes["c"].port, f"sonde{attempt}")
+                probe.close()
+                attempt += 1
+                if listed >= expected or time.monotonic() > deadline:
+                    break
+                time.sleep(0.2)
+            frieda, listed = listing(nodes["c"].port, "frieda")
+            clients.append(frieda)
+            stale = listed & {"dora", "beob_c"}
+            results.append(check(listed >= expected and not stale,
+                                 f"Verzeichnis an c nach Neustart: {sorted(listed)}"))
+            watchers["a"].wait(lambda cmd, args: cmd == "USER_JOINED" and args[:1] == ["frieda"])
+            probe, listed = listing(nodes["a"].port, "gustav")
+            clients.append(probe)
+            results.append(check("beob_c" not in listed and "frieda" in listed,
+                                 f"Verzeichnis an a: {sorted(listed)}"))
+
+            # Nach dem Neustart weiterhin genau einmal, in beide Richtungen
+            erin.sock.sendall(Protocol.broadcast("erin", "nach dem neustart"))
+            frieda.wait(lambda cmd, args: cmd == "BROADCAST" and args[:1] == ["erin"])
+            settle(clients)
+            results.append(check(frieda.count("BROADCAST", "erin") == 1,
+                                 f"frieda: BROADCAST erin {frieda.count('BROADCAST', 'erin')}x"))
+            for name in ("a", "b"):
+                joined = watchers[name].count("USER_JOINED", "frieda")
+                results.append(check(joined == 1, f"beob_{name}: USER_JOINED frieda {joined}x"))
+        finally:
+            for client in clients:
+                client.close()
+            for node in nodes.values():
+                if node.proc is not None:
+                    node.stop()
+    return all(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Funktionsprüfung der Föderation mit drei Knoten")
+    parser.add_argument("--engine", default="async")
+    parser.add_argument("--port", type=int, default=9190)
+    opts = parser.parse_args(argv)
+    if not run(opts):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
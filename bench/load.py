@@ -0,0 +1,283 @@
+# Lastgenerator: N headless Bots sprechen REGISTER/BROADCAST gegen einen Server und
+# messen die Zustell-Latenz jedes Broadcasts bei allen Empfängern.
+#
+#   python -m Peer2PeerChatRoom.bench.load --engine async --clients 500 --rate 200 --duration 10 \
+#       --output load-async.json
+#
+# Jeder Broadcast trägt seinen Sendezeitpunkt (perf_counter_ns) als erstes Wort;
+# Sender und Empfänger laufen im selben Prozess, die Uhren sind also vergleichbar.
+# Der Server wird auf einen Kern gepinnt, der Lastgenerator möglichst auf einen anderen.
+import argparse
+import json
+import os
+import random
+import selectors
+import socket
+import subprocess
+import time
+from ..network.protocol import FrameDecoder, Protocol
+from .engine import proc_cpu_seconds, proc_status, start_server, stop_server
+
+BROADCAST_PREFIX = b"BROADCAST "
+
+
+class Bot:
+    __slots__ = ("nick", "sock", "decoder", "out", "ready")
+
+    def __init__(self, nick, port, host="127.0.0.1"):
+        self.nick = nick
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        self.decoder = FrameDecoder()
+        self.out = bytearray(Protocol.register(nick, "0"))
+        self.ready = False
+
+    def flush(self):
+        # Gibt zurück, ob noch Daten ausstehen
+        try:
+            sent = self.sock.send(self.out)
+        except BlockingIOError:
+            return True
+        del self.out[:sent]
+        return bool(self.out)
+
+    def close(self):
+        try:
+            self.sock.sendall(Protocol.quit())
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class LoadRun:
+    def __init__(self, port, opts, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.opts = opts
+        self.sel = selectors.DefaultSelector()
+        self.bots = []
+        self.next_id = 0
+        self.latencies = []
+        self.sent = 0
+        self.expected = 0
+        self.delivered = 0
+        self.churned = 0
+
+    def add_bot(self):
+        bot = Bot(f"bot{self.next_id}", self.port, self.host)
+        self.next_id += 1
+        self.bots.append(bot)
+        self.sel.register(bot.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, bot)
+        return bot
+
+    def remove_bot(self, bot):
+        self.bots.remove(bot)
+        self.sel.unregister(bot.sock)
+        bot.close()
+
+    def send(self, bot, frame):
+        pending = bool(bot.out)
+        bot.out += frame
+        if not pending and bot.flush():
+            self.sel.modify(bot.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, bot)
+
+    def pump(self, timeout):
+        measure = self.latencies.append
+        for key, mask in self.sel.select(timeout=timeout):
+            bot = key.data
+            if mask & selectors.EVENT_WRITE and not bot.flush():
+                self.sel.modify(bot.sock, selectors.EVENT_READ, bot)
+            if not mask & selectors.EVENT_READ:
+                continue
+            try:
+                if not bot.decoder.recv_into(bot.sock):
+                    continue
+            except BlockingIOError:
+                continue
+            now = time.perf_counter_ns()
+            for frame in bot.decoder.frames():
+                if frame[:10] == BROADCAST_PREFIX:
+                    # "BROADCAST <nick> <ns> <füllung>"
+                    stamp = bytes(frame).split(b" ", 3)[2]
+                    measure(now - int(stamp))
+                    self.delivered += 1
+                elif not bot.ready and frame[:7] == b"WELCOME":
+                    bot.ready = True
+
+    def ramp(self):
+        # Verbindungen mit --ramp pro Sekunde aufbauen (0 = so schnell wie möglich)
+        opts = self.opts
+        interval = 1.0 / opts.ramp if opts.ramp > 0 else 0.0
+        start = time.perf_counter()
+        for i in range(opts.clients):
+            self.add_bot()
+            due = start + (i + 1) * interval
+            while True:
+                self.pump(0)
+                if time.perf_counter() >= due:
+                    break
+                time.sleep(min(0.005, due - time.perf_counter()))
+        # Auf alle WELCOMEs warten und Beitritts-Events abarbeiten
+        deadline = time.perf_counter() + 60
+        while time.perf_counter() < deadline and not all(b.ready for b in self.bots):
+            self.pump(0.1)
+        while self.sel.select(timeout=0.5):
+            self.pump(0)
+        return time.perf_counter() - start
+
+    def run(self):
+        opts = self.opts
+        padding = "x" * max(0, opts.size - 20)
+        senders = self.bots[:max(1, opts.senders)]
+        interval = 1.0 / opts.rate
+        churn_interval = 1.0 / opts.churn if opts.churn > 0 else None
+        rng = random.Random(1)
+        start = time.perf_counter()
+        end = start + opts.duration
+        next_send = start
+        next_churn = start + churn_interval if churn_interval else float("inf")
+        while True:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            while next_send <= now:
+                sender = senders[self.sent % len(senders)]
+                frame = Protocol.broadcast(sender.nick, f"{time.perf_counter_ns()} {padding}")
+                self.send(sender, frame)
+                self.sent += 1
+                self.expected += sum(1 for b in self.bots if b.ready)
+                next_send += interval
+            while next_churn <= now:
+                # Ein Nicht-Sender verlässt den Chat, ein neuer Bot kommt dazu
+                candidates = self.bots[len(senders):]
+                if candidates:
+                    self.remove_bot(rng.choice(candidates))
+                    self.add_bot()
+                    self.churned += 1
+                next_churn += churn_interval
+            self.pump(max(0.0, min(next_send, next_churn, end) - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        # Nachzügler einsammeln
+        deadline = time.perf_counter() + 5
+        while self.delivered < self.expected and time.perf_counter() < deadline:
+            self.pump(0.1)
+        return elapsed
+
+    def close(self):
+        for bot in list(self.bots):
+            self.remove_bot(bot)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def pin_to_other_core():
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) > 1:
+            os.sched_setaffinity(0, set(cores[1:]))
+    except (AttributeError, OSError):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lastgenerator mit headless Bots")
+    parser.add_argument("--engine", default="async")
+    parser.add_argument("--port", type=int, default=9150)
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="zusätzliches Argument für run_server (mehrfach möglich)")
+    parser.add_argument("--connect", default=None, metavar="HOST:PORT",
+                        help="bereits laufenden Server verwenden (ohne RSS/CPU-Messung)")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--ramp", type=float, default=0.0, help="neue Verbindungen pro Sekunde (0 = sofort)")
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=100.0, help="Broadcasts pro Sekunde (alle Sender)")
+    parser.add_argument("--size", type=int, default=64, help="ungefähre Nachrichtengröße in Bytes")
+    parser.add_argument("--churn", type=float, default=0.0, help="Austritte+Beitritte pro Sekunde")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output", default=None, help="Ergebnis als JSON in diese Datei schreiben")
+    opts = parser.parse_args(argv)
+
+    pin_to_other_core()
+    proc = None
+    host, port = "127.0.0.1", opts.port
+    if opts.connect:
+        host, _, port = opts.connect.rpartition(":")
+        port = int(port)
+    else:
+        proc = start_server(opts.engine, port, opts.server_arg)
+
+    result = {
+        "revision": git_revision(),
+        "engine": None if opts.connect else opts.engine,
+        "config": {k: v for k, v in vars(opts).items() if k != "output"},
+    }
+    run = LoadRun(port, opts, host)
+    try:
+        base = proc_status(proc.pid) if proc else None
+        ramp_s = run.ramp()
+        result["connect"] = {
+            "clients": len(run.bots),
+            "registered": sum(1 for b in run.bots if b.ready),
+            "ramp_s": round(ramp_s, 3),
+        }
+        if proc:
+            loaded = proc_status(proc.pid)
+            result["connect"].update({
+                "server_rss_kb_base": base["VmRSS"],
+                "server_rss_kb_loaded": loaded["VmRSS"],
+                "server_rss_bytes_per_conn": round((loaded["VmRSS"] - base["VmRSS"]) * 1024 / max(1, len(run.bots))),
+                "server_threads": loaded["Threads"],
+            })
+            cpu_before = proc_cpu_seconds(proc.pid)
+        elapsed = run.run()
+        latencies = sorted(run.latencies)
+        result["load"] = {
+            "duration_s": round(elapsed, 3),
+            "broadcasts_sent": run.sent,
+            "broadcasts_per_s": round(run.sent / elapsed, 1),
+            "deliveries_expected": run.expected,
+            "deliveries": run.delivered,
+            "deliveries_per_s": round(run.delivered / elapsed),
+            "churn_events": run.churned,
+            "latency_ms": {
+                name: None if value is None else round(value / 1e6, 3)
+                for name, value in (
+                    ("p50", percentile(latencies, 0.50)),
+                    ("p99", percentile(latencies, 0.99)),
+                    ("p999", percentile(latencies, 0.999)),
+                    ("max", latencies[-1] if latencies else None),
+                )
+            },
+        }
+        if proc:
+            cpu = proc_cpu_seconds(proc.pid) - cpu_before
+            result["load"]["server_cpu_s"] = round(cpu, 3)
+            result["load"]["server_cpu_percent"] = round(100 * cpu / elapsed, 1)
+    finally:
+        run.close()
+        if proc:
+            stop_server(proc)
+
+    text = json.dumps(result, indent=2)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
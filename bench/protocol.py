@@ -0,0 +1,206 @@
+# Mikrobenchmarks für network/protocol.py mit gespeicherten Baselines.
+# Läuft komplett offline (keine Sockets).
+#
+#   python -m Peer2PeerChatRoom.bench.protocol            # messen und mit Baseline vergleichen
+#   python -m Peer2PeerChatRoom.bench.protocol --save     # aktuelle Werte als Baseline speichern
+#   python -m Peer2PeerChatRoom.bench.protocol --check    # Exit-Code 1 bei Regression
+#
+# Damit die Baseline nicht nur auf einer Maschine gilt, wird jede Messung auf eine
+# Kalibrierungsschleife (reiner Python-Code) bezogen; verglichen werden diese Verhältnisse.
+import argparse
+import json
+import os
+import sys
+import timeit
+from ..network.protocol import FrameDecoder, Protocol, ProtocolV2, TextCodec, UserList
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "protocol.json")
+DEFAULT_THRESHOLD = 0.25
+
+SMALL_TEXT = "hallo welt, wie geht's?"
+LARGE_TEXT = "lorem ipsum dolor sit amet " * 2400
+EMOJI_TEXT = "😀 Grüße 🎉 aus Köln 🚀 " * 40
+USERLIST_ENTRIES = [f"user{i}:10.0.{i // 256 % 256}.{i % 256}:{5000 + i % 1000}" for i in range(10000)]
+
+
+def calibration():
+    total = 0
+    for i in range(2000):
+        total += i * i
+    return total
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def make_cases():
+    small = Protocol.broadcast("alice", SMALL_TEXT)
+    large = Protocol.broadcast("alice", LARGE_TEXT)
+    emoji = Protocol.broadcast("alice", EMOJI_TEXT)
+    userlist = Protocol.user_list(*USERLIST_ENTRIES)
+    pipelined = small * 1000
+    pipelined_chunks = chunks(pipelined, 1448)
+    userlist_args = Protocol.extract_command(userlist[4:])[1]
+    v2_broadcast = ProtocolV2.encode(TextCodec.decode(small[4:]))
+    v2_userlist = ProtocolV2.encode(UserList(USERLIST_ENTRIES))
+
+    def decode_stream_chunked():
+        buffer = b""
+        count = 0
+        for chunk in pipelined_chunks:
+            messages, buffer = Protocol.decode_stream(buffer + chunk)
+            count += len(messages)
+        return count
+
+    def frame_decoder_chunked():
+        decoder = FrameDecoder()
+        count = 0
+        for chunk in pipelined_chunks:
+            decoder.feed(chunk)
+            for _ in decoder.frames():
+                count += 1
+        return count
+
+    # name -> (funktion, Frames pro Aufruf)
+    return {
+        "build_small": (lambda: Protocol.broadcast("alice", SMALL_TEXT), 1),
+        "build_large_64k": (lambda: Protocol.broadcast("alice", LARGE_TEXT), 1),
+        "build_emoji": (lambda: Protocol.broadcast("alice", EMOJI_TEXT), 1),
+        "build_userlist_10k": (lambda: Protocol.user_list(*USERLIST_ENTRIES), 1),
+        "extract_small": (lambda: Protocol.extract_command(small[4:]), 1),
+        "extract_large_64k": (lambda: Protocol.extract_command(large[4:]), 1),
+        "extract_emoji": (lambda: Protocol.extract_command(emoji[4:]), 1),
+        "extract_userlist_10k": (lambda: Protocol.extract_command(userlist[4:]), 1),
+        "read_broadcast": (lambda: Protocol.read_broadcast(["alice", "hallo", "welt", "😀"]), 1),
+        "read_user_joined": (lambda: Protocol.read_user_joined(["bob", "10.0.0.1", "5000"]), 1),
+        "read_register": (lambda: Protocol.read_register(["bob", "5000", "v2,dir"]), 1),
+        "read_user_list_10k": (lambda: Protocol.read_user_list(userlist_args), 1),
+        "decode_stream_pipelined_1000": (lambda: Protocol.decode_stream(pipelined), 1000),
+        "decode_stream_chunked_1000": (decode_stream_chunked, 1000),
+        "frame_decoder_chunked_1000": (frame_decoder_chunked, 1000),
+        "v2_encode_small": (lambda: ProtocolV2.encode(TextCodec.decode(small[4:])), 1),
+        "v2_decode_small": (lambda: ProtocolV2.decode(v2_broadcast[4:]), 1),
+        "v2_decode_userlist_10k": (lambda: ProtocolV2.decode(v2_userlist[4:]), 1),
+    }
+
+
+def loop_count(timer, target=0.02):
+    # Anzahl Aufrufe, sodass eine Messung etwa target Sekunden dauert
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= target / 10:
+            return max(1, int(number * target / elapsed))
+        number *= 10
+
+
+def run(names=None, rounds=5, repeat=3):
+    # Fälle reihum in mehreren Runden messen und je Fall das beste Ergebnis nehmen:
+    # kurzzeitige Störungen (andere Prozesse, Taktänderungen) treffen so nicht
+    # einen Fall komplett. Die Kalibrierung läuft in jeder Runde mit.
+    cases = {name: case for name, case in make_cases().items() if names is None or name in names}
+    timers = {name: timeit.Timer(func) for name, (func, _) in cases.items()}
+    timers[None] = timeit.Timer(calibration)
+    counts = {name: loop_count(timer) for name, timer in timers.items()}
+    best = dict.fromkeys(timers, float("inf"))
+    for _ in range(rounds):
+        for name, timer in timers.items():
+            per_call = min(timer.repeat(repeat=repeat, number=counts[name])) / counts[name]
+            best[name] = min(best[name], per_call)
+    calib = best.pop(None)
+    results = {}
+    for name, per_call in best.items():
+        frames = cases[name][1]
+        results[name] = {
+            "us_per_call": round(per_call * 1e6, 3),
+            "frames_per_s": round(frames / per_call),
+            "relative": float(f"{per_call / calib:.4g}"),
+        }
+    return {"calibration_us": round(calib * 1e6, 3), "python": sys.version.split()[0], "cases": results}
+
+
+def save_run(names, runs=3):
+    # Baseline = Median aus mehreren Läufen, damit ein zufällig schneller Lauf
+    # nicht zum Maßstab wird
+    results = [run(names) for _ in range(runs)]
+    merged = results[len(results) // 2]
+    for name in merged["cases"]:
+        ordered = sorted((r["cases"][name] for r in results), key=lambda c: c["relative"])
+        merged["cases"][name] = ordered[len(ordered) // 2]
+    return merged
+
+
+def compare(current, baseline, threshold):
+    # Liste der Regressionen: (name, relative_alt, relative_neu, faktor)
+    regressions = []
+    for name, result in current["cases"].items():
+        old = baseline["cases"].get(name)
+        if old is None:
+            continue
+        factor = result["relative"] / old["relative"]
+        if factor > 1 + threshold:
+            regressions.append((name, old["relative"], result["relative"], factor))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mikrobenchmarks für network/protocol.py")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="Ergebnis als neue Baseline speichern")
+    parser.add_argument("--check", action="store_true", help="bei Regression mit Exit-Code 1 beenden")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="erlaubte Verlangsamung gegenüber der Baseline (0.25 = 25 %%)")
+    parser.add_argument("--filter", default=None, help="nur Fälle, deren Name diesen Text enthält")
+    parser.add_argument("--output", default=None, help="Ergebnis als JSON in diese Datei schreiben")
+    opts = parser.parse_args(argv)
+
+    names = [name for name in make_cases() if not opts.filter or opts.filter in name]
+    if opts.save:
+        current = save_run(names)
+    else:
+        current = run(names)
+    baseline = None
+    if os.path.exists(opts.baseline):
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'Fall':32} {'µs/Aufruf':>12} {'Frames/s':>12} {'vs. Baseline':>13}")
+    for name, result in current["cases"].items():
+        old = baseline["cases"].get(name) if baseline else None
+        delta = f"{(result['relative'] / old['relative'] - 1) * 100:+.1f} %" if old else "-"
+        print(f"{name:32} {result['us_per_call']:12.3f} {result['frames_per_s']:12d} {delta:>13}")
+
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if opts.save:
+        os.makedirs(os.path.dirname(opts.baseline), exist_ok=True)
+        with open(opts.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+        print(f"Baseline gespeichert: {opts.baseline}")
+        return 0
+
+    if baseline is None:
+        print("Keine Baseline vorhanden – mit --save anlegen.")
+        return 0
+    regressions = compare(current, baseline, opts.threshold)
+    if regressions:
+        # Auffällige Fälle noch einmal messen; nur was dabei wieder langsam ist, zählt
+        again = run([name for name, *_ in regressions])
+        for name, result in again["cases"].items():
+            if result["relative"] < current["cases"][name]["relative"]:
+                current["cases"][name] = result
+        regressions = compare(current, baseline, opts.threshold)
+    for name, old, new, factor in regressions:
+        print(f"REGRESSION {name}: {factor:.2f}x langsamer als die Baseline ({old} -> {new})")
+    if regressions and opts.check:
+        return 1
+    if not regressions:
+        print(f"Keine Regression über {opts.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# Raum-Nachrichten über den Server (relay) gegen das Client-Mesh (mesh, siehe
+# client/mesh.py): Server-CPU, CPU der Clients und Zustell-Latenz bei gleicher Last.
+#
+#   python -m Peer2PeerChatRoom.bench.rooms --rooms 8 --room-size 16 --rate 400 --duration 10
+#
+# Alle Bots laufen in diesem Prozess mit einer Selector-Schleife: je Bot eine
+# v2-Verbindung zum Server, ein UDP-Socket und ein MeshRouter, dessen Timer die
+# Schleife selbst aufruft. Beide Modi nutzen denselben Code; im Modus relay bietet
+# der Server nur kein "mesh" an, publish() schlägt fehl und der Bot sendet über TCP.
+# --loss verwirft ausgehende Mesh-Datagramme, um die Reparatur mitzumessen.
+import argparse
+import json
+import random
+import selectors
+import socket
+import time
+from ..client.mesh import MeshRouter
+from ..network.protocol import (
+    CAP_MESH, CAP_V2, FrameDecoder, Join, Protocol, ProtocolV2, RoomBroadcast, RoomMesh, TextCodec, Welcome,
+)
+from .engine import proc_cpu_seconds, start_server, stop_server
+from .load import git_revision, percentile, pin_to_other_core
+
+
+class RoomBot:
+    __slots__ = ("nick", "room", "sock", "udp", "decoder", "codec", "ready", "router", "run")
+
+    def __init__(self, run, nick, room, port):
+        self.run = run
+        self.nick = nick
+        self.room = room
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", 0))
+        self.udp.setblocking(False)
+        self.decoder = FrameDecoder()
+        self.codec = TextCodec
+        self.ready = False
+        self.router = MeshRouter(nick, self.sendto, self.delivered)
+        self.sock.sendall(Protocol.register(nick, str(self.udp.getsockname()[1]), CAP_V2, CAP_MESH))
+        self.sock.setblocking(False)
+
+    def sendto(self, data, addr):
+        if self.run.loss and self.run.rng.random() < self.run.loss:
+            return
+        self.udp.sendto(data, addr)
+
+    def delivered(self, room, sender, text):
+        if sender != self.nick:
+            self.run.measure(text)
+
+    def publish(self, text):
+        if not self.router.publish(self.room, text):
+            self.sock.sendall(ProtocolV2.encode(RoomBroadcast(self.room, self.nick, text)))
+
+    def on_tcp(self):
+        try:
+            if not self.decoder.recv_into(self.sock):
+                return
+        except BlockingIOError:
+            return
+        for payload in self.decoder.frames():
+            msg = self.codec.decode(payload)
+            if isinstance(msg, Welcome):
+                self.codec = ProtocolV2 if CAP_V2 in msg.caps else TextCodec
+                self.ready = True
+                self.sock.sendall(self.codec.encode(Join(self.room)))
+            elif isinstance(msg, RoomBroadcast):
+                if msg.sender != self.nick:
+                    self.run.measure(msg.text)
+            elif isinstance(msg, RoomMesh):
+                self.router.update(msg.room, msg.epoch, msg.members)
+
+    def on_udp(self):
+        while True:
+            try:
+                data, addr = self.udp.recvfrom(65535)
+            except BlockingIOError:
+                return
+            self.router.received(data, addr)
+
+    def close(self):
+        self.sock.close()
+        self.udp.close()
+
+
+class RoomRun:
+    def __init__(self, port, opts):
+        self.opts = opts
+        self.loss = opts.loss
+        self.rng = random.Random(1)
+        self.sel = selectors.DefaultSelector()
+        self.latencies = []
+        self.delivered = 0
+        self.bots = []
+        for i in range(opts.rooms * opts.room_size):
+            bot = RoomBot(self, f"bot{i}", f"raum{i // opts.room_size}", port)
+            self.sel.register(bot.sock, selectors.EVENT_READ, bot.on_tcp)
+            self.sel.register(bot.udp, selectors.EVENT_READ, bot.on_udp)
+            self.bots.append(bot)
+
+    def measure(self, text):
+        # "<perf_counter_ns> <füllung>"
+        self.latencies.append(time.perf_counter_ns() - int(text.split(" ", 1)[0]))
+        self.delivered += 1
+
+    def pump(self, timeout):
+        for key, _ in self.sel.select(timeout=timeout):
+            key.data()
+
+    def tick(self):
+        now = time.monotonic()
+        for bot in self.bots:
+            bot.router.tick(now)
+
+    def settle(self, mesh):
+        # Alle angemeldet und (im Mesh-Modus) alle Räume mit vollständiger Mitgliederliste
+        deadline = time.perf_counter() + 60
+        size = self.opts.room_size
+        while time.perf_counter() < deadline:
+            self.pump(0.01)
+            self.tick()
+            if all(b.ready for b in self.bots) and (not mesh or all(
+                    b.router.active(b.room) and len(b.router.rooms[b.room].addrs) == size for b in self.bots)):
+                break
+        # Nachzügler und MESH_HEADs der Beitritte abwarten
+        quiet = time.perf_counter() + 0.5
+        while time.perf_counter() < quiet:
+            if self.sel.select(timeout=0.01):
+                self.pump(0)
+                quiet = time.perf_counter() + 0.5
+            self.tick()
+
+    def load(self):
+        opts = self.opts
+        padding = "x" * max(0, opts.size - 20)
+        interval = 1.0 / opts.rate
+        sent = 0
+        start = time.perf_counter()
+        end = start + opts.duration
+        next_send = next_tick = start
+        while True:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            while next_send <= now:
+                self.bots[sent % len(self.bots)].publish(f"{time.perf_counter_ns()} {padding}")
+                sent += 1
+                next_send += interval
+            if next_tick <= now:
+                self.tick()
+                next_tick = now + 0.01
+            self.pump(max(0.0, min(next_send, next_tick, end) - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        expected = sent * (opts.room_size - 1)
+        deadline = time.perf_counter() + 5
+        while self.delivered < expected and time.perf_counter() < deadline:
+            self.tick()
+            self.pump(0.01)
+        return sent, expected, elapsed
+
+    def close(self):
+        for bot in self.bots:
+            bot.close()
+
+
+def run_mode(mode, port, opts):
+    server_args = list(opts.server_arg)
+    if mode == "mesh":
+        server_args += ["--mesh-max", str(opts.room_size)]
+    proc = start_server(opts.engine, port, server_args)
+    run = RoomRun(port, opts)
+    try:
+        run.settle(mode == "mesh")
+        server_before = proc_cpu_seconds(proc.pid)
+        client_before = time.process_time()
+        sent, expected, elapsed = run.load()
+        server_cpu = proc_cpu_seconds(proc.pid) - server_before
+        client_cpu = time.process_time() - client_before
+    finally:
+        run.close()
+        stop_server(proc)
+    latencies = sorted(run.latencies)
+    routers = [b.router for b in run.bots]
+    return {
+        "mode": mode,
+        "meshed": all(r.active(b.room) for r, b in zip(routers, run.bots)),
+        "duration_s": round(elapsed, 3),
+        "messages_sent": sent,
+        "deliveries_expected": expected,
+        "deliveries": run.delivered,
+        "mesh_repaired": sum(r.repaired for r in routers),
+        "mesh_lost": sum(r.lost for r in routers),
+        "server_cpu_s": round(server_cpu, 3),
+        "server_cpu_percent": round(100 * server_cpu / elapsed, 1),
+        "clients_cpu_s": round(client_cpu, 3),
+        "latency_ms": {
+            name: None if value is None else round(value / 1e6, 3)
+            for name, value in (
+                ("p50", percentile(latencies, 0.50)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Raum-Nachrichten: Server-Relay gegen Client-Mesh")
+    parser.add_argument("--engine", default="async")
+    parser.add_argument("--port", type=int, default=9160)
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="zusätzliches Argument für run_server (mehrfach möglich)")
+    parser.add_argument("--modes", default="relay,mesh")
+    parser.add_argument("--rooms", type=int, default=8)
+    parser.add_argument("--room-size", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=400.0, help="Raum-Nachrichten pro Sekunde (alle Räume)")
+    parser.add_argument("--size", type=int, default=64, help="ungefähre Nachrichtengröße in Bytes")
+    parser.add_argument("--loss", type=float, default=0.0, help="Verlustrate ausgehender Mesh-Datagramme")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output", default=None, help="Ergebnis als JSON in diese Datei schreiben")
+    opts = parser.parse_args(argv)
+
+    pin_to_other_core()
+    result = {
+        "revision": git_revision(),
+        "config": {k: v for k, v in vars(opts).items() if k != "output"},
+        "runs": [run_mode(mode, opts.port + i, opts) for i, mode in enumerate(opts.modes.split(","))],
+    }
+    text = json.dumps(result, indent=2)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Zuverlässige UDP-Signalisierung (client/signalling.py) über localhost mit
+# künstlichem Paketverlust in beide Richtungen: Zeit bis zur Bestätigung einer
+# Anfrage (p50/p99/max), Anteil erfolgreicher und fehlgeschlagener Anfragen.
+#
+#   python -m Peer2PeerChatRoom.bench.signalling --loss 0,0.1,0.3
+import argparse
+import json
+import random
+import socket
+import time
+from ..client.core import UDPListenerThread
+from ..client.signalling import Signalling
+from ..network.protocol import Protocol
+
+
+class LossySocket:
+    # Verwirft ausgehende Datagramme mit Wahrscheinlichkeit loss
+    def __init__(self, sock, loss, rng):
+        self.sock = sock
+        self.loss = loss
+        self.rng = rng
+
+    def sendto(self, data, addr):
+        if self.rng.random() >= self.loss:
+            self.sock.sendto(data, addr)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def endpoint(loss, rng, dispatch, acks=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    signalling = Signalling(LossySocket(sock, loss, rng), dispatch)
+
+    def received(cmd, addr, args):
+        if cmd == "CHAT_ACK" and acks is not None:
+            acks.add(Protocol.read_chat_ack(args))
+        signalling.received(cmd, addr, args)
+
+    UDPListenerThread(sock, received).start()
+    return sock, signalling
+
+
+def run(loss, requests, seed):
+    rng = random.Random(seed)
+    received = []
+    acks = set()
+    failed = set()
+    sender_sock, sender = endpoint(loss, rng, lambda *args: None, acks)
+    receiver_sock, receiver = endpoint(loss, rng, lambda cmd, addr, args: received.append(args))
+    target = receiver_sock.getsockname()
+    acked = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        ids = []
+        ids.append(sender.send(target, lambda rid: Protocol.chat_request(40000, rid),
+                               lambda: failed.add(ids[0])))
+        while ids[0] not in acks and ids[0] not in failed:
+            time.sleep(0.0002)
+        if ids[0] in acks:
+            acked.append(time.perf_counter() - started)
+    time.sleep(0.1)
+    for sig, sock in ((sender, sender_sock), (receiver, receiver_sock)):
+        sig.close()
+        sock.close()
+    acked.sort()
+
+    def pct(q):
+        return round(acked[min(len(acked) - 1, int(q * len(acked)))] * 1000, 2) if acked else None
+
+    return {
+        "loss": loss,
+        "requests": requests,
+        "acked": len(acked),
+        "failed": len(failed),
+        "delivered_unique": len(set(tuple(args) for args in received)),
+        "duplicates_dispatched": len(received) - len(set(tuple(args) for args in received)),
+        "ack_p50_ms": pct(0.5),
+        "ack_p99_ms": pct(0.99),
+        "ack_max_ms": pct(1.0),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark der UDP-Signalisierung mit Paketverlust")
+    parser.add_argument("--loss", default="0,0.1,0.3", help="Verlustraten je Richtung, kommagetrennt")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    opts = parser.parse_args(argv)
+    results = [run(float(loss), opts.requests, opts.seed) for loss in opts.loss.split(",")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+# TLS-Reconnect-Sturm: N Clients verbinden sich gleichzeitig neu, einmal mit vollem
+# Handshake (full) und einmal mit der Sitzung ihrer vorigen Verbindung (resumed).
+#
+#   python -m Peer2PeerChatRoom.bench.tls --clients 5000 --engine async
+#
+# Das Zertifikat ist selbstsigniert und wird für jeden Lauf mit openssl erzeugt.
+# Pro Modus: eigener Server, eine erste Welle, die die Sitzungen einsammelt, dann
+# der gemessene Sturm. Jeder Bot gilt als verbunden, sobald der Server über TLS auf
+# HISTORY antwortet (vor REGISTER: nur HISTORY_END). REGISTER entfällt bewusst,
+# sonst überdeckt der Presence-Fan-out an alle N Clients die Handshake-Kosten.
+# Ein Kanarienvogel-Client fragt währenddessen alle 10 ms per HISTORY an und misst,
+# wie lange der Server bereits verbundene Clients warten lässt.
+import argparse
+import json
+import os
+import selectors
+import socket
+import ssl
+import subprocess
+import tempfile
+import time
+import urllib.request
+from ..network.protocol import FrameDecoder, History, HistoryEnd, TextCodec
+from ..network.tls import RECV_SIZE, TLSChannel, client_context
+from .engine import proc_cpu_seconds, start_server, stop_server
+from .load import git_revision, percentile, pin_to_other_core
+
+PROBE = TextCodec.encode(History(0, 0))
+CANARY_INTERVAL = 0.01
+KEYS = {
+    "rsa2048": ["-newkey", "rsa:2048"],
+    "ec256": ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"],
+}
+
+
+def make_cert(directory, key):
+    cert, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", *KEYS[key], "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1", "-keyout", keyfile, "-out", cert],
+                   check=True, capture_output=True)
+    return cert, keyfile
+
+
+class StormBot:
+    __slots__ = ("wave", "sock", "channel", "decoder", "session", "started", "on_reply")
+
+    def __init__(self, wave, session, on_reply):
+        self.wave = wave
+        self.session = session
+        self.on_reply = on_reply
+        self.sock = None
+        self.channel = None
+        self.decoder = FrameDecoder()
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.channel = TLSChannel(self.wave.context, False, "localhost", self.session)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.connect_ex(("127.0.0.1", self.wave.port))
+        self.wave.sel.register(self.sock, selectors.EVENT_WRITE, self.on_connected)
+
+    def on_connected(self):
+        if self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            self.wave.failed(self)
+            return
+        self.wave.sel.modify(self.sock, selectors.EVENT_READ, self.on_read)
+        self.channel.step()
+        self.sock.sendall(self.channel.outgoing())
+
+    def probe(self):
+        self.started = time.perf_counter()
+        self.sock.sendall(self.channel.encrypt(PROBE))
+
+    def on_read(self):
+        try:
+            data = self.sock.recv(RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.wave.failed(self)
+            return
+        channel = self.channel
+        try:
+            if not channel.established:
+                if not channel.step(data):
+                    out = channel.outgoing()
+                    if out:
+                        self.sock.sendall(out)
+                    return
+                # Client-Finished und die erste Anfrage in einem Schwung
+                self.sock.sendall(channel.encrypt(PROBE))
+                data = b""
+            plain = channel.decrypt(data)
+        except ssl.SSLError:
+            self.wave.failed(self)
+            return
+        if not plain:
+            return
+        self.decoder.feed(plain)
+        for payload in self.decoder.frames():
+            if isinstance(TextCodec.decode(payload), HistoryEnd):
+                self.on_reply(self)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.wave.sel.unregister(self.sock)
+            except (KeyError, ValueError):
+                pass
+            self.sock.close()
+
+
+class Wave:
+    # Alle Bots einer Welle in einer Selector-Schleife, höchstens concurrency gleichzeitig im Aufbau
+    def __init__(self, port, context, concurrency):
+        self.port = port
+        self.context = context
+        self.concurrency = concurrency
+        self.sel = selectors.DefaultSelector()
+        self.canary = None
+        self.canary_rtts = []
+        self.canary_due = None
+
+    def start_canary(self):
+        self.canary = StormBot(self, None, self.canary_replied)
+        self.canary.start()
+        while self.canary_due is None:
+            self.pump(0.1)
+        self.canary_rtts.clear()
+
+    def canary_replied(self, bot):
+        self.canary_rtts.append(time.perf_counter() - bot.started)
+        self.canary_due = time.perf_counter() + CANARY_INTERVAL
+
+    def failed(self, bot):
+        if bot is self.canary:
+            raise RuntimeError("Kanarienvogel-Verbindung abgebrochen")
+        bot.close()
+        self.errors += 1
+        self.in_flight -= 1
+
+    def connected(self, bot):
+        self.latencies.append(time.perf_counter() - bot.started)
+        self.in_flight -= 1
+
+    def pump(self, timeout):
+        for key, _ in self.sel.select(timeout=timeout):
+            key.data()
+
+    def run(self, sessions):
+        # Ein Bot pro Sitzung (None = voller Handshake); liefert die verbundenen Bots
+        self.latencies = []
+        self.errors = 0
+        self.in_flight = 0
+        bots = [StormBot(self, session, self.connected) for session in sessions]
+        waiting = iter(bots)
+        remaining = len(bots)
+        while len(self.latencies) + self.errors < len(bots):
+            while remaining and self.in_flight < self.concurrency:
+                next(waiting).start()
+                self.in_flight += 1
+                remaining -= 1
+            timeout = 0.1
+            if self.canary_due is not None:
+                now = time.perf_counter()
+                if self.canary_due <= now:
+                    self.canary_due = float("inf")
+                    self.canary.probe()
+                timeout = max(0.0, min(timeout, self.canary_due - now))
+            self.pump(timeout)
+        return bots
+
+    def close(self, bots):
+        for bot in bots:
+            bot.close()
+
+
+def scrape_handshakes(metrics_port):
+    counts = {}
+    with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5) as response:
+        for line in response.read().decode().splitlines():
+            if line.startswith("chat_tls_handshakes_total{"):
+                name, value = line.rsplit(" ", 1)
+                counts[name.split('"')[1]] = int(float(value))
+    return counts
+
+
+def run_mode(mode, port, cert, opts):
+    metrics_port = port + 1000
+    server_args = ["--tls-cert", cert[0], "--tls-key", cert[1], "--metrics-port", str(metrics_port),
+                   *opts.server_arg]
+    if opts.tls_workers:
+        server_args += ["--tls-workers", str(opts.tls_workers)]
+    proc = start_server(opts.engine, port, server_args)
+    context = client_context(cert[0])
+    if opts.max_version == "1.2":
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+    wave = Wave(port, context, opts.concurrency)
+    try:
+        wave.start_canary()
+        # Erste Welle: Sitzungen einsammeln, dann alle Verbindungen trennen
+        bots = wave.run([None] * opts.clients)
+        sessions = [b.channel.obj.session if mode == "resumed" else None for b in bots]
+        wave.close(bots)
+        wave.run([])
+        settle = time.perf_counter() + 0.5
+        while time.perf_counter() < settle:
+            wave.pump(0.05)
+        wave.canary_rtts.clear()
+        server_before = proc_cpu_seconds(proc.pid)
+        client_before = time.process_time()
+        start = time.perf_counter()
+        bots = wave.run(sessions)
+        elapsed = time.perf_counter() - start
+        server_cpu = proc_cpu_seconds(proc.pid) - server_before
+        client_cpu = time.process_time() - client_before
+        resumed = sum(1 for b in bots if b.channel.established and b.channel.resumed)
+        wave.close(bots)
+        handshakes = scrape_handshakes(metrics_port)
+    finally:
+        if wave.canary is not None:
+            wave.canary.close()
+        stop_server(proc)
+    latencies = sorted(wave.latencies)
+    canary = sorted(wave.canary_rtts)
+    connected = len(latencies)
+    return {
+        "mode": mode,
+        "tls_version": bots[0].channel.obj.version() if bots else None,
+        "clients": opts.clients,
+        "connected": connected,
+        "errors": wave.errors,
+        "resumed": resumed,
+        "server_handshakes": handshakes,
+        "duration_s": round(elapsed, 3),
+        "handshakes_per_s": round(connected / elapsed, 1),
+        "server_cpu_s": round(server_cpu, 3),
+        "server_cpu_ms_per_handshake": round(1000 * server_cpu / max(1, connected), 3),
+        "clients_cpu_s": round(client_cpu, 3),
+        "connect_ms": {
+            name: None if value is None else round(value * 1000, 2)
+            for name, value in (("p50", percentile(latencies, 0.50)), ("p99", percentile(latencies, 0.99)))
+        },
+        "canary_ms": {
+            name: None if value is None else round(value * 1000, 2)
+            for name, value in (
+                ("p50", percentile(canary, 0.50)),
+                ("p99", percentile(canary, 0.99)),
+                ("max", canary[-1] if canary else None),
+            )
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TLS-Reconnect-Sturm: volle gegen fortgesetzte Handshakes")
+    parser.add_argument("--engine", default="async")
+    parser.add_argument("--port", type=int, default=9170)
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="zusätzliches Argument für run_server (mehrfach möglich)")
+    parser.add_argument("--modes", default="full,resumed")
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=1000, help="gleichzeitig laufende Verbindungsaufbauten")
+    parser.add_argument("--key", choices=sorted(KEYS), default="rsa2048")
+    parser.add_argument("--max-version", choices=("1.2", "1.3"), default="1.3")
+    parser.add_argument("--tls-workers", type=int, default=None, help="an run_server durchgereicht")
+    parser.add_argument("--output", default=None, help="Ergebnis als JSON in diese Datei schreiben")
+    opts = parser.parse_args(argv)
+
+    pin_to_other_core()
+    with tempfile.TemporaryDirectory() as directory:
+        cert = make_cert(directory, opts.key)
+        result = {
+            "revision": git_revision(),
+            "config": {k: v for k, v in vars(opts).items() if k != "output"},
+            "runs": [run_mode(mode, opts.port + i, cert, opts) for i, mode in enumerate(opts.modes.split(","))],
+        }
+    text = json.dumps(result, indent=2)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
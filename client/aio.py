@@ -0,0 +1,415 @@
+# Headless-Client auf asyncio: Server-TCP, UDP und private P2P-Chats laufen
+# auf einer Eventloop, ohne Threads und ohne tkinter. Gedacht für Bots und
+# Integrationsdienste; ein Prozess kann viele Identitäten gleichzeitig halten.
+#
+#   async def main():
+#       client = AsyncChatClient("bot1", "127.0.0.1", 9000)
+#       await client.connect()
+#       await client.broadcast("hallo")
+#       async for event in client.events():
+#           if isinstance(event, Broadcast):
+#               print(event.sender, event.text)
+#           elif isinstance(event, PrivateChatRequest):
+#               chat = await event.accept()
+#               async for text in chat:
+#                   await chat.send(text.upper())
+import asyncio
+import random
+import time
+import unicodedata
+from collections import deque
+from .chat_session import HANDSHAKE_TIMEOUT
+from .directory import DirectoryReplica
+from .signalling import ACK_TIMEOUT, DUPLICATE_WINDOW, RETRIES, read_request_id
+from ..network.protocol import (
+    CAP_DIR, CAP_V2, HEADER, Broadcast, Error, FileCancel, FileChunk, FileOffer, Join, P2PBye, P2PHello,
+    P2PMessage, Part, Protocol, ProtocolV2, Quit, RoomBroadcast, Sync, TextCodec, UserJoined, UserLeft,
+    UserList, UserListDelta, UserListPage, Welcome,
+)
+
+PRIVATE_CHAT_TIMEOUT = 10.0
+EVENT_LIMIT = 10000
+
+
+async def read_frame(reader):
+    head = await reader.readexactly(HEADER.size)
+    return await reader.readexactly(HEADER.unpack(head)[0])
+
+
+async def p2p_handshake(reader, writer, nick):
+    # Wie chat_session.handshake: beide Seiten schicken P2P_HELLO
+    writer.write(ProtocolV2.encode(P2PHello(nick, [])))
+    hello = ProtocolV2.decode(await asyncio.wait_for(read_frame(reader), HANDSHAKE_TIMEOUT))
+    if not isinstance(hello, P2PHello):
+        raise ConnectionError("Gegenüber spricht kein P2P-Protokoll")
+    return unicodedata.normalize("NFC", hello.nick)
+
+
+class PrivateChatRequest:
+    # Event: jemand möchte privat chatten (UDP CHAT_REQUEST)
+    def __init__(self, client, ip, udp_port, tcp_port, request_id=None):
+        self.client = client
+        self.ip = ip
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.request_id = request_id
+
+    async def accept(self):
+        reader, writer = await asyncio.open_connection(self.ip, self.tcp_port)
+        try:
+            peer_nick = await p2p_handshake(reader, writer, self.client.nickname)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            writer.close()
+            raise
+        return PrivateChat(reader, writer, self.client.nickname, peer_nick, self.ip, self.tcp_port)
+
+    def reject(self):
+        addr = (self.ip, self.udp_port)
+        if self.request_id is None:
+            self.client.send_udp(Protocol.chat_rejected(), addr)
+        else:
+            _, delivery = self.client.send_reliable(addr, Protocol.chat_rejected, self.request_id)
+            # Unbestätigte Ablehnung: das Gegenüber läuft dann in seinen Timeout
+            delivery.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    def __repr__(self):
+        return f"PrivateChatRequest({self.ip}:{self.tcp_port})"
+
+
+class PrivateChat:
+    # Private P2P-Verbindung; gleiches Leitungsformat wie PrivateChatSession
+    # (v2-Frames, P2P_BYE beendet). Iterieren liefert die Nachrichten des
+    # Gegenübers, bis die Verbindung endet. Dateiangebote werden abgelehnt.
+    def __init__(self, reader, writer, local_nick, peer_nick, peer_ip, peer_port):
+        self.reader = reader
+        self.writer = writer
+        self.local_nick = local_nick
+        self.peer_nick = peer_nick
+        self.peer_ip = peer_ip
+        self.peer_port = peer_port
+        self.closed = False
+
+    async def send(self, message):
+        self.writer.write(ProtocolV2.encode(P2PMessage(message)))
+        await self.writer.drain()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.closed:
+            try:
+                msg = ProtocolV2.decode(await read_frame(self.reader))
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                break
+            if isinstance(msg, P2PMessage):
+                return msg.text
+            if isinstance(msg, P2PBye):
+                break
+            if isinstance(msg, FileOffer):
+                self.writer.write(ProtocolV2.encode(FileCancel(msg.file_id, 0, "nicht unterstützt")))
+            elif isinstance(msg, FileChunk):
+                try:
+                    await self.reader.readexactly(msg.length)
+                except (OSError, asyncio.IncompleteReadError):
+                    break
+        await self._shutdown()
+        raise StopAsyncIteration
+
+    async def close(self):
+        if self.closed:
+            return
+        try:
+            self.writer.write(ProtocolV2.encode(P2PBye()))
+            await self.writer.drain()
+        except OSError:
+            pass
+        await self._shutdown()
+
+    async def _shutdown(self):
+        self.closed = True
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        try:
+            cmd, args = Protocol.extract_udp_message(data)
+        except (ValueError, UnicodeDecodeError):
+            return
+        self.client.on_udp(cmd, args, addr)
+
+
+class AsyncChatClient:
+    def __init__(self, nickname, host, port, directory=None, event_limit=EVENT_LIMIT):
+        self.nickname = nickname
+        self.host = host
+        self.port = port
+        self.directory = directory or DirectoryReplica()
+        self.codec = TextCodec
+        self.dir_sync = False
+        self.udp_port = None
+        self.connected = False
+        # nick -> "nick:ip:udp" aller angemeldeten Nutzer
+        self.users = {}
+        # Älteste Events fallen weg, wenn niemand sie abholt
+        self.dropped_events = 0
+        self._events = deque(maxlen=event_limit)
+        self._event_ready = asyncio.Event()
+        self._reader = None
+        self._writer = None
+        self._udp = None
+        self._reader_task = None
+        # Anfrage-ID -> Future der laufenden eigenen Chat-Anfrage
+        self._requests = {}
+        # Zuverlässige UDP-Signalisierung wie in client/signalling.py:
+        # (addr, Anfrage-ID) -> Future, das beim CHAT_ACK erfüllt wird
+        self._next_id = random.getrandbits(31)
+        self._unacked = {}
+        self._seen = {}
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self._udp, _ = await loop.create_datagram_endpoint(lambda: _UDPProtocol(self), local_addr=("0.0.0.0", 0))
+        self.udp_port = self._udp.get_extra_info("sockname")[1]
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._writer.write(Protocol.register(self.nickname, str(self.udp_port), CAP_V2, CAP_DIR))
+        reply = await self._read_text_reply()
+        if isinstance(reply, Error) and reply.reason.startswith("REGISTER"):
+            # Alter Server ohne Fähigkeiten-Argument
+            self._writer.write(Protocol.register(self.nickname, str(self.udp_port)))
+            reply = await self._read_text_reply()
+        if not isinstance(reply, Welcome):
+            await self._teardown()
+            raise ConnectionError(reply.reason if isinstance(reply, Error) else "Keine Antwort vom Server")
+        self.nickname = reply.nick
+        self.codec = ProtocolV2 if CAP_V2 in reply.caps else TextCodec
+        self.dir_sync = CAP_DIR in reply.caps
+        self.connected = True
+        if self.dir_sync:
+            self._send(Sync(self.directory.epoch, self.directory.version))
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_frame(self):
+        return await read_frame(self._reader)
+
+    async def _read_text_reply(self):
+        # Antworten auf REGISTER kommen immer im Textformat
+        while True:
+            try:
+                reply = TextCodec.decode(await self._read_frame())
+            except asyncio.IncompleteReadError:
+                return None
+            if reply is not None:
+                return reply
+
+    async def _read_loop(self):
+        try:
+            while True:
+                try:
+                    msg = self.codec.decode(await self._read_frame())
+                except ValueError:
+                    continue
+                if msg is not None:
+                    self._dispatch(msg)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            self.connected = False
+            self._event_ready.set()
+
+    def _dispatch(self, msg):
+        if isinstance(msg, UserListPage):
+            if self.directory.add_page(msg):
+                self._set_users(self.directory.entry_list())
+        elif isinstance(msg, UserListDelta):
+            for change in self.directory.apply(msg):
+                if change[0] == "+":
+                    nick, ip, udp = change[1:].split(":")
+                    self.users[nick] = change[1:]
+                    self._push(UserJoined(nick, ip, int(udp)))
+                else:
+                    self.users.pop(change[1:], None)
+                    self._push(UserLeft(change[1:]))
+            if self.directory.has_gap():
+                self.directory.pending.clear()
+                self._send(Sync(self.directory.epoch, self.directory.version))
+        elif isinstance(msg, UserList):
+            self._set_users(msg.entries)
+        else:
+            if isinstance(msg, UserJoined):
+                self.users[msg.nick] = f"{msg.nick}:{msg.ip}:{msg.udp_port}"
+            elif isinstance(msg, UserLeft):
+                self.users.pop(msg.nick, None)
+            self._push(msg)
+
+    def _set_users(self, entries):
+        self.users = {entry.split(":", 1)[0]: entry for entry in entries}
+        self._push(UserList(entries))
+
+    def _push(self, event):
+        if len(self._events) == self._events.maxlen:
+            self.dropped_events += 1
+        self._events.append(event)
+        self._event_ready.set()
+
+    async def events(self):
+        # Alle Server-Nachrichten (Verzeichnisänderungen als USERLIST/USER_JOINED/
+        # USER_LEFT) und PrivateChatRequest; endet mit der Verbindung.
+        while True:
+            while self._events:
+                yield self._events.popleft()
+            if not self.connected:
+                return
+            self._event_ready.clear()
+            await self._event_ready.wait()
+
+    def _send(self, msg):
+        self._writer.write(self.codec.encode(msg))
+
+    async def broadcast(self, message):
+        self._send(Broadcast(self.nickname, unicodedata.normalize("NFC", message)))
+        await self._writer.drain()
+
+    async def join_room(self, room):
+        self._send(Join(room))
+        await self._writer.drain()
+
+    async def part_room(self, room):
+        self._send(Part(room))
+        await self._writer.drain()
+
+    async def room_broadcast(self, room, message):
+        self._send(RoomBroadcast(room, self.nickname, unicodedata.normalize("NFC", message)))
+        await self._writer.drain()
+
+    def send_udp(self, data, addr):
+        self._udp.sendto(data, addr)
+
+    def send_reliable(self, addr, build, request_id=None):
+        # Wiederholt build(id) mit wachsendem Abstand bis zum CHAT_ACK; gibt (id, Task)
+        # zurück, der Task endet mit TimeoutError, wenn nie eine Bestätigung kommt.
+        # Antworten übernehmen die ID der Anfrage.
+        if request_id is None:
+            request_id = self._next_id
+            self._next_id = (request_id + 1) & 0x7FFFFFFF
+        acked = asyncio.get_running_loop().create_future()
+        self._unacked[(addr, request_id)] = acked
+        data = build(request_id)
+
+        async def retransmit():
+            try:
+                for attempt in range(RETRIES + 1):
+                    self.send_udp(data, addr)
+                    try:
+                        return await asyncio.wait_for(asyncio.shield(acked), ACK_TIMEOUT * 2 ** attempt)
+                    except asyncio.TimeoutError:
+                        pass
+                raise TimeoutError(f"{addr[0]}:{addr[1]} ist nicht erreichbar (keine Bestätigung)")
+            finally:
+                self._unacked.pop((addr, request_id), None)
+
+        return request_id, asyncio.create_task(retransmit())
+
+    def on_udp(self, cmd, args, addr):
+        try:
+            if cmd == "CHAT_ACK":
+                acked = self._unacked.get((addr, Protocol.read_chat_ack(args)))
+                if acked is not None and not acked.done():
+                    acked.set_result(None)
+                return
+            request_id = read_request_id(cmd, args)
+        except ValueError:
+            return
+        if request_id is not None:
+            self.send_udp(Protocol.chat_ack(request_id), addr)
+            now = time.monotonic()
+            while self._seen:
+                old, expires = next(iter(self._seen.items()))
+                if expires > now:
+                    break
+                del self._seen[old]
+            if (addr, request_id) in self._seen:
+                return
+            self._seen[(addr, request_id)] = now + DUPLICATE_WINDOW
+        if cmd == "CHAT_REQUEST":
+            tcp_port, request_id = Protocol.read_chat_request(args)
+            self._push(PrivateChatRequest(self, addr[0], addr[1], tcp_port, request_id))
+        elif cmd == "CHAT_REJECTED":
+            future = self._requests.get(request_id)
+            if future is not None and not future.done():
+                future.set_exception(ConnectionRefusedError("Chat-Anfrage abgelehnt"))
+
+    async def request_private_chat(self, nick, timeout=PRIVATE_CHAT_TIMEOUT):
+        # Wartet, bis das Gegenüber annimmt; ConnectionRefusedError bei Ablehnung,
+        # TimeoutError ohne Antwort – nach ~1,5 s, wenn die Anfrage nie bestätigt wird
+        entry = self.users.get(nick)
+        if entry is None:
+            raise LookupError(f"{nick} ist nicht angemeldet")
+        _, ip, udp = entry.split(":")
+        addr = (ip, int(udp))
+        future = asyncio.get_running_loop().create_future()
+
+        async def on_connect(reader, writer):
+            if future.done():
+                writer.close()
+                return
+            try:
+                peer_nick = await p2p_handshake(reader, writer, self.nickname)
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if not future.done():
+                    future.set_exception(ConnectionError(f"P2P-Handshake fehlgeschlagen: {e}"))
+                return
+            if future.done():
+                writer.close()
+                return
+            peer = writer.get_extra_info("peername")
+            future.set_result(PrivateChat(reader, writer, self.nickname, peer_nick, peer[0], peer[1]))
+
+        server = await asyncio.start_server(on_connect, "0.0.0.0", 0)
+        tcp_port = server.sockets[0].getsockname()[1]
+        request_id, delivery = self.send_reliable(addr, lambda request_id: Protocol.chat_request(tcp_port, request_id))
+        self._requests[request_id] = future
+
+        def unreachable(task):
+            if not task.cancelled() and task.exception() is not None and not future.done():
+                future.set_exception(task.exception())
+
+        delivery.add_done_callback(unreachable)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._requests.pop(request_id, None)
+            delivery.cancel()
+            server.close()
+
+    async def close(self):
+        if self.connected:
+            try:
+                self._send(Quit())
+                await self._writer.drain()
+            except OSError:
+                pass
+        await self._teardown()
+
+    async def _teardown(self):
+        self.connected = False
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        if self._reader_task is not None:
+            await self._reader_task
+        if self._udp is not None:
+            self._udp.close()
+        self._event_ready.set()
@@ -1,55 +1,644 @@
 #chat_session.py
+import os
+import selectors
+import socket
 import threading
+import time
+from collections import deque
 from datetime import datetime
+from ..network.protocol import (
+    CAP_FILE, CAP_PING, CAP_TYPING, FileAccept, FileCancel, FileChunk, FileOffer, FileProgress,
+    FrameDecoder, P2PBye, P2PHello, P2PMessage, P2PPing, P2PPong, P2PTyping, ProtocolV2,
+)
+
+# Private Chats laufen über die längenpräfixierten v2-Frames (P2P_HELLO,
+# P2P_MSG, P2P_BYE); Dateien gehen über dieselbe Verbindung in Blöcken zu
+# CHUNK_BYTES, jeweils ein FILE_CHUNK und danach die rohen Bytes per sendfile.
+# Chatnachrichten und Bestätigungen haben Vorrang und gehen zwischen zwei
+# Blöcken raus.
+# Der Empfänger bestätigt alle ACK_EVERY Bytes mit FILE_PROGRESS; der Sender hat
+# höchstens WINDOW Bytes unbestätigt unterwegs. Unvollständige Dateien bleiben
+# als .part liegen und werden beim nächsten Annehmen ab ihrer Größe fortgesetzt.
+#
+# Verbindungen bleiben nach dem Schließen des Fensters offen (Pool je Nick und
+# Adresse) und werden beim erneuten Öffnen ohne Anfrage und Handshake
+# weiterbenutzt. Ruhende Verbindungen werden alle HEALTH_INTERVAL per P2P_PING
+# geprüft und nach IDLE_TIMEOUT ohne Fenster und ohne Verkehr geschlossen.
+
+HANDSHAKE_TIMEOUT = 10.0
+CHUNK_BYTES = 256 << 10
+ACK_EVERY = 1 << 20
+WINDOW = 8 << 20
+PART_SUFFIX = ".part"
+# So lange darf P2P_BYE samt vorher Gesendetem beim Schließen noch brauchen
+CLOSE_TIMEOUT = 5.0
+# Höchstens so viele Bytes je Sitzung und Durchlauf, damit eine große Datei
+# die anderen Sitzungen nicht aufhält
+WRITE_BUDGET = 1 << 20
+IDLE_TIMEOUT = 600.0
+HEALTH_INTERVAL = 30.0
+HEALTH_TIMEOUT = 10.0
+# Takt für Leerlauf- und Lebenszeichen-Prüfung
+TICK = 1.0
+# Zeilen, die ohne offenes Fenster ankommen, bis es wieder geöffnet wird
+BACKLOG_LINES = 500
+# Höchstens so oft P2P_TYPING beim Tippen
+TYPING_INTERVAL = 3.0
+
+
+def handshake(conn, local_nick, timeout=HANDSHAKE_TIMEOUT):
+    # Beide Seiten schicken P2P_HELLO; liefert (P2P_HELLO des Gegenübers, Decoder
+    # mit eventuell schon empfangenen weiteren Frames)
+    conn.settimeout(timeout)
+    conn.sendall(ProtocolV2.encode(P2PHello(local_nick, [CAP_FILE, CAP_PING, CAP_TYPING])))
+    decoder = FrameDecoder()
+    while True:
+        for payload in decoder.frames():
+            hello = ProtocolV2.decode(payload)
+            if not isinstance(hello, P2PHello):
+                raise OSError("Gegenüber spricht kein P2P-Protokoll")
+            conn.settimeout(None)
+            return hello, decoder
+        if not decoder.recv_into(conn):
+            raise OSError("Verbindung vor P2P_HELLO beendet")
+
+
+class FileTransfer:
+    def __init__(self, file_id, name, size, outgoing, path=None):
+        self.file_id = file_id
+        self.name = name
+        self.size = size
+        self.outgoing = outgoing
+        self.path = path
+        # Sender: vom Empfänger bestätigt; Empfänger: geschrieben
+        self.offset = 0
+        # Sender: bereits abgeschickt; Empfänger: zuletzt bestätigt
+        self.sent = 0
+        # Ab hier lief diese Übertragung (für die Rate, bei Fortsetzen > 0)
+        self.start_offset = 0
+        self.started = None
+        self.finished = None
+        # offered, running, done, failed
+        self.state = "offered"
+        self.reason = None
+        self.file = None
+
+    def rate(self):
+        # Bytes pro Sekunde vom Start bis jetzt bzw. bis zum Ende
+        if not self.started:
+            return 0.0
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return (self.offset - self.start_offset) / max(elapsed, 1e-6)
+
+    def __repr__(self):
+        direction = "an" if self.outgoing else "von"
+        return f"FileTransfer({self.name!r} {direction} Gegenüber, {self.offset}/{self.size}, {self.state})"
+
+
+class PrivateSessionManager:
+    # Besitzt alle P2P-Sockets, je Gegenüber (Nick, IP) eine Sitzung. Ein einziger
+    # Thread bedient alle Sitzungen über einen Selector; die Sockets sind nicht
+    # blockierend. Andere Threads legen nur Frames in die Sitzungen und wecken
+    # den Thread über ein Socket-Paar.
+    def __init__(self):
+        # (peer_nick, peer_ip) -> PrivateChatSession
+        self.sessions = {}
+        # on_reopen(session) aus dem Selector-Thread, wenn für eine Sitzung ohne
+        # Fenster etwas ankommt
+        self.on_reopen = None
+        self.cond = threading.Condition()
+        # Sitzungen, deren Anmeldung am Selector neu berechnet werden muss
+        self.dirty = set()
+        # Nur Selector-Thread: am Selector angemeldete Sitzungen
+        self.registered = set()
+        self.selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, peer_nick, peer_ip):
+        # Noch offene Verbindung zu diesem Gegenüber oder None
+        session = self.sessions.get((peer_nick, peer_ip))
+        if session is None or session.closing or session.stop_event.is_set():
+            return None
+        return session
+
+    def add(self, session):
+        # Meldet die Sitzung an; eine ältere Sitzung mit demselben Gegenüber wird beendet
+        with self.cond:
+            old = self.sessions.get(session.key)
+            if old is session:
+                return
+            self.sessions[session.key] = session
+            self.dirty.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="p2p-sessions", daemon=True)
+                self._thread.start()
+        if old is not None:
+            old.close()
+        self._wake()
+
+    def update(self, session):
+        # Aus beliebigem Thread: die Sitzung hat etwas zu senden oder wird geschlossen
+        if threading.current_thread() is self._thread:
+            # Wird nach dem laufenden Ereignis ohnehin neu berechnet
+            with self.cond:
+                self.dirty.add(session)
+            return
+        with self.cond:
+            self.dirty.add(session)
+        self._wake()
+
+    def close_all(self, timeout=1.0):
+        # Schließt alle Sitzungen und wartet höchstens timeout, bis P2P_BYE raus ist
+        for session in list(self.sessions.values()):
+            session.close()
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.sessions and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            # Puffer voll: der Thread wird ohnehin geweckt
+            pass
+
+    def _run(self):
+        selector = self.selector
+        next_check = time.monotonic() + TICK
+        while True:
+            with self.cond:
+                dirty, self.dirty = self.dirty, set()
+            for session in dirty:
+                self._refresh(session)
+            now = time.monotonic()
+            deadlines = [s.close_deadline for s in self.registered if s.close_deadline]
+            if self.registered:
+                deadlines.append(next_check)
+            timeout = max(0.0, min(deadlines) - now) if deadlines else None
+            for key, mask in selector.select(timeout):
+                session = key.data
+                if session is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ:
+                    session._on_readable()
+                if mask & selectors.EVENT_WRITE and session.ended is None:
+                    session._on_writable()
+                self._refresh(session)
+            now = time.monotonic()
+            for session in list(self.registered):
+                if session.close_deadline and session.close_deadline <= now and session.ended is None:
+                    session.ended = "Chat beendet"
+                    self._refresh(session)
+            if now >= next_check:
+                next_check = now + TICK
+                self._check(now)
+
+    def _check(self, now):
+        # Leerlauf und Lebenszeichen aller Sitzungen
+        for session in list(self.registered):
+            if session.ended is not None or session.closing:
+                continue
+            if session.gui_callback is None and now - session.last_activity > IDLE_TIMEOUT:
+                session.close()
+            elif session.ping_sent is not None:
+                if now - session.ping_sent > HEALTH_TIMEOUT:
+                    session.ended = "Gegenüber antwortet nicht"
+                    self._refresh(session)
+            elif CAP_PING in session.peer_caps and now - session.last_rx > HEALTH_INTERVAL:
+                session.ping_sent = now
+                session.ping_nonce = (session.ping_nonce + 1) & 0xFFFFFFFF
+                session._send_frame(P2PPing(session.ping_nonce))
+
+    def _refresh(self, session):
+        # Nur im Selector-Thread: Anmeldung an den Zustand der Sitzung anpassen
+        registered = session in self.registered
+        if session.stop_event.is_set() and session.ended is None:
+            # Vor dem Start geschlossen
+            session.ended = "Chat beendet"
+        if session.ended is None and session.closing and not session._fill():
+            session.ended = "Chat beendet"
+        if session.ended is not None:
+            if registered:
+                self.selector.unregister(session.conn)
+                self.registered.discard(session)
+            with self.cond:
+                if self.sessions.get(session.key) is session:
+                    del self.sessions[session.key]
+                self.cond.notify_all()
+            session._shutdown(session.ended)
+            return
+        events = selectors.EVENT_READ
+        if session._fill():
+            events |= selectors.EVENT_WRITE
+        if not registered:
+            session.conn.setblocking(False)
+            self.selector.register(session.conn, events, session)
+            self.registered.add(session)
+        elif self.selector.get_key(session.conn).events != events:
+            self.selector.modify(session.conn, events, session)
+
 
 class PrivateChatSession:
-    def __init__(self, conn, gui_callback, local_nick, peer_nick, peer_ip, peer_port):
+    def __init__(self, conn, gui_callback, local_nick, peer_nick, peer_ip, peer_port, manager, decoder=None,
+                 caps=()):
         self.conn = conn
         self.gui_callback = gui_callback  # Methode zum Anzeigen von Nachrichten
         self.local_nick = local_nick
         self.peer_nick = peer_nick
         self.peer_ip = peer_ip
         self.peer_port = peer_port
+        self.key = (peer_nick, peer_ip)
+        self.manager = manager
+        self.decoder = decoder or FrameDecoder()
+        # Fähigkeiten aus dem P2P_HELLO des Gegenübers
+        self.peer_caps = set(caps)
+        # file_callback(event, transfer) mit event "offer", "progress", "done", "failed";
+        # ohne Callback werden angebotene Dateien abgelehnt, außer die Sitzung wartet
+        # ohne Fenster im Pool
+        self.file_callback = None
+        # typing_callback() bei P2P_TYPING
+        self.typing_callback = None
+        # Zeilen, die ohne Fenster ankamen (gui_callback None)
+        self.backlog = deque(maxlen=BACKLOG_LINES)
+        self._typing_sent = 0.0
         self.stop_event = threading.Event()
+        # Schützt frames, sending, closing und die Zustände der Übertragungen
+        self.lock = threading.Lock()
+        self.frames = deque()
+        # Laufende ausgehende Übertragungen, reihum je ein Block
+        self.sending = deque()
+        self.closing = False
+        self.close_deadline = None
+        self.outgoing = {}
+        self.incoming = {}
+        self.next_file_id = 1
+        self.started = False
+        # Nur Selector-Thread: Grund fürs Ende, noch zu sendende Bytes und der
+        # Rohdaten-Teil des laufenden FILE_CHUNK ([transfer, offset, restliche Bytes])
+        self.ended = None
+        self.out = None
+        self.block = None
+        self.last_rx = self.last_activity = time.monotonic()
+        self.ping_sent = None
+        self.ping_nonce = 0
+        # Empfänger gerade im Rohdaten-Teil eines FILE_CHUNK: [transfer oder None, restliche Bytes]
+        self.raw = None
 
     def start(self):
-        threading.Thread(target=self._recv_loop, daemon=True).start()
+        # Lesen beginnt erst hier, nachdem die Callbacks gesetzt sind; mehrfacher Aufruf schadet nicht
+        self.started = True
+        self.manager.add(self)
+
+    def attach(self, gui_callback, file_callback=None, typing_callback=None):
+        # Ein Fenster übernimmt die Sitzung; liefert die Zeilen, die ohne Fenster ankamen
+        with self.lock:
+            self.gui_callback = gui_callback
+            self.file_callback = file_callback
+            self.typing_callback = typing_callback
+            backlog = list(self.backlog)
+            self.backlog.clear()
+            self.last_activity = time.monotonic()
+        return backlog
+
+    def detach(self):
+        # Fenster geschlossen: die Verbindung bleibt im Pool des Managers
+        with self.lock:
+            self.gui_callback = self.file_callback = self.typing_callback = None
+            self.last_activity = time.monotonic()
+
+    def offers(self):
+        # Noch unbeantwortete Dateiangebote, z. B. für ein neu geöffnetes Fenster
+        return [t for t in list(self.incoming.values()) if t.state == "offered"]
+
+    def typing(self):
+        # Beim Tippen aufrufen; sendet höchstens alle TYPING_INTERVAL ein P2P_TYPING
+        now = time.monotonic()
+        if CAP_TYPING in self.peer_caps and now - self._typing_sent >= TYPING_INTERVAL:
+            self._typing_sent = now
+            self._send_frame(P2PTyping())
+
+    def _emit(self, line):
+        with self.lock:
+            callback = self.gui_callback
+            if callback is None:
+                reopen = not self.backlog
+                self.backlog.append(line)
+        if callback is not None:
+            callback(line)
+        elif reopen and self.manager.on_reopen is not None:
+            self.manager.on_reopen(self)
+
+    def _send_frame(self, msg):
+        with self.lock:
+            if self.stop_event.is_set() or self.closing:
+                return
+            self.frames.append(ProtocolV2.encode(msg))
+        self.manager.update(self)
 
     def send(self, message):
-        try:
-            self.conn.sendall(message.encode())
-            self._log_local(message)
-        except:
-            self.close()
+        if self.stop_event.is_set():
+            return
+        self.last_activity = time.monotonic()
+        self._send_frame(P2PMessage(message))
+        self._log_local(message)
 
     def close(self):
-        self.stop_event.set()
-        try:
-            self.conn.sendall(b"[DISCONNECT]")
-        except:
-            pass
+        # P2P_BYE geht noch raus, danach trennt der Selector-Thread die Verbindung
+        with self.lock:
+            if self.stop_event.is_set() or self.closing:
+                return
+            self.frames.append(ProtocolV2.encode(P2PBye()))
+            self.closing = True
+            self.close_deadline = time.monotonic() + CLOSE_TIMEOUT
+        if self.started:
+            self.manager.update(self)
+        else:
+            self._shutdown("Chat beendet")
+
+    def _shutdown(self, reason):
+        with self.lock:
+            if self.stop_event.is_set():
+                return
+            self.stop_event.set()
         self.conn.close()
+        for transfer in [*self.outgoing.values(), *self.incoming.values()]:
+            self._fail(transfer, reason, notify_peer=False)
+            if transfer.outgoing and transfer.file is not None:
+                transfer.file.close()
 
-    def _recv_loop(self):
-        while not self.stop_event.is_set():
-            try:
-                data = self.conn.recv(1024)
-                if not data:
+    # --- Senden (Selector-Thread) ----------------------------------------
+
+    def _fill(self):
+        # Sorgt für Daten in out/block; False, wenn nichts zu senden ist
+        while self.out is None and self.block is None:
+            with self.lock:
+                if self.frames:
+                    self.out = memoryview(b"".join(self.frames))
+                    self.frames.clear()
                     break
-                decoded = data.decode().strip()
-                if decoded == "[DISCONNECT]":
+                transfer = None if self.closing else self._next_block()
+            if transfer is None:
+                return False
+            if transfer.file is None:
+                try:
+                    transfer.file = open(transfer.path, "rb")
+                except OSError as e:
+                    self._fail(transfer, f"Datei kann nicht gelesen werden: {e}")
+                    continue
+            offset = transfer.sent
+            count = min(CHUNK_BYTES, transfer.size - offset)
+            transfer.sent = offset + count
+            self.out = memoryview(ProtocolV2.encode(FileChunk(transfer.file_id, offset, count)))
+            self.block = [transfer, offset, count]
+        return True
+
+    def _next_block(self):
+        # Erste laufende Übertragung mit Platz im Fenster; beendete fallen raus.
+        # Nur mit self.lock.
+        for _ in range(len(self.sending)):
+            transfer = self.sending[0]
+            if transfer.state != "running" or transfer.sent >= transfer.size:
+                self.sending.popleft()
+                if transfer.file is not None:
+                    transfer.file.close()
+                continue
+            self.sending.rotate(-1)
+            if transfer.sent - transfer.offset < WINDOW:
+                return transfer
+        return None
+
+    def _on_writable(self):
+        budget = WRITE_BUDGET
+        try:
+            while budget > 0 and self._fill():
+                if self.out is not None:
+                    n = self.conn.send(self.out)
+                    self.out = self.out[n:] if n < len(self.out) else None
+                else:
+                    # Nach dem Header müssen die angekündigten Bytes folgen, auch
+                    # wenn die Übertragung inzwischen abgebrochen wurde
+                    transfer, offset, remaining = self.block
+                    n = os.sendfile(self.conn.fileno(), transfer.file.fileno(), offset, remaining)
+                    if not n:
+                        raise OSError("Datei wurde während der Übertragung verkürzt")
+                    self.block = [transfer, offset + n, remaining - n] if n < remaining else None
+                budget -= n
+        except (BlockingIOError, InterruptedError):
+            pass
+        except (OSError, ValueError):
+            self.ended = "Verbindung getrennt"
+
+    def send_file(self, path):
+        # Bietet die Datei an; übertragen wird, sobald das Gegenüber annimmt
+        size = os.path.getsize(path)
+        with self.lock:
+            file_id = self.next_file_id
+            self.next_file_id += 1
+            transfer = FileTransfer(file_id, os.path.basename(path), size, True, path)
+            self.outgoing[file_id] = transfer
+        self._send_frame(FileOffer(file_id, transfer.name, size))
+        return transfer
+
+    # --- Empfang (Selector-Thread) ----------------------------------------
+
+    def _on_readable(self):
+        try:
+            if not self.decoder.recv_into(self.conn):
+                self.ended = "Verbindung getrennt"
+                return
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.ended = "Verbindung getrennt"
+            return
+        # Jedes empfangene Byte zählt als Lebenszeichen
+        self.last_rx = time.monotonic()
+        self.ping_sent = None
+        try:
+            if not self._process():
+                if self.gui_callback is not None:
                     self.gui_callback(f"[INFO] {self.peer_nick} hat den Chat beendet.")
+                self.ended = "Chat beendet"
+        except ValueError:
+            self.ended = "Verbindung getrennt"
+
+    def _process(self):
+        # Alles Gepufferte verarbeiten; False nach P2P_BYE
+        decoder = self.decoder
+        while True:
+            if self.raw is not None:
+                data = decoder.take(self.raw[1])
+                if not data:
+                    return True
+                self.raw[1] -= len(data)
+                if self.raw[0] is not None:
+                    self._write_chunk(self.raw[0], data)
+                if not self.raw[1]:
+                    self.raw = None
+                continue
+            for payload in decoder.frames():
+                msg = ProtocolV2.decode(payload)
+                if isinstance(msg, P2PBye):
+                    return False
+                self._handle(msg)
+                if self.raw is not None:
                     break
-                self._log_peer(decoded)
-            except:
-                break
-        self.stop_event.set()
-        self.conn.close()
+            else:
+                return True
+
+    def _handle(self, msg):
+        if isinstance(msg, P2PPing):
+            self._send_frame(P2PPong(msg.nonce))
+            return
+        if isinstance(msg, P2PPong):
+            return
+        self.last_activity = self.last_rx
+        if isinstance(msg, P2PMessage):
+            self._log_peer(msg.text)
+        elif isinstance(msg, P2PTyping):
+            callback = self.typing_callback
+            if callback is not None:
+                callback()
+        elif isinstance(msg, FileChunk):
+            transfer = self.incoming.get(msg.file_id)
+            if transfer is not None and (transfer.state != "running" or msg.offset != transfer.offset):
+                transfer = None
+            self.raw = [transfer, msg.length]
+        elif isinstance(msg, FileOffer):
+            transfer = FileTransfer(msg.file_id, os.path.basename(msg.name), msg.size, False)
+            self.incoming[msg.file_id] = transfer
+            if self.file_callback is not None:
+                self.file_callback("offer", transfer)
+            elif self.gui_callback is None:
+                # Ohne Fenster: das wieder geöffnete Fenster fragt über offers() nach
+                self._emit(f"[INFO] {self.peer_nick} möchte dir {transfer.name} senden.")
+            else:
+                self.reject_file(transfer)
+        elif isinstance(msg, FileAccept):
+            transfer = self.outgoing.get(msg.file_id)
+            with self.lock:
+                if transfer is None or transfer.state != "offered" or msg.offset > transfer.size:
+                    return
+                transfer.state = "running"
+                transfer.offset = transfer.sent = transfer.start_offset = msg.offset
+                transfer.started = time.monotonic()
+                self.sending.append(transfer)
+        elif isinstance(msg, FileProgress):
+            transfer = self.outgoing.get(msg.file_id)
+            with self.lock:
+                if transfer is None or transfer.state != "running":
+                    return
+                transfer.offset = msg.offset
+            if msg.offset >= transfer.size:
+                self._finish(transfer)
+            else:
+                self._event("progress", transfer)
+        elif isinstance(msg, FileCancel):
+            transfer = (self.incoming if msg.outgoing else self.outgoing).get(msg.file_id)
+            if transfer is not None:
+                self._fail(transfer, msg.reason, notify_peer=False)
+
+    def _write_chunk(self, transfer, data):
+        try:
+            transfer.file.write(data)
+        except (OSError, ValueError) as e:
+            # ValueError: inzwischen abgebrochen und geschlossen
+            self._fail(transfer, f"Schreiben fehlgeschlagen: {e}")
+            self.raw[0] = None
+            return
+        transfer.offset += len(data)
+        if transfer.offset >= transfer.size:
+            self._finish(transfer)
+        elif transfer.offset - transfer.sent >= ACK_EVERY:
+            transfer.sent = transfer.offset
+            self._send_frame(FileProgress(transfer.file_id, transfer.offset))
+            self._event("progress", transfer)
+
+    def accept_file(self, transfer, path):
+        # Schreibt nach path + ".part" und benennt am Ende um; liegt dort schon
+        # ein Teil, wird ab dessen Größe fortgesetzt
+        part = path + PART_SUFFIX
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset > transfer.size:
+            offset = 0
+        try:
+            transfer.file = open(part, "r+b" if offset else "wb")
+            transfer.file.truncate(offset)
+            transfer.file.seek(offset)
+        except OSError as e:
+            self._fail(transfer, f"Datei kann nicht geschrieben werden: {e}")
+            return
+        with self.lock:
+            if transfer.state != "offered":
+                transfer.file.close()
+                return
+            transfer.path = path
+            transfer.offset = transfer.sent = transfer.start_offset = offset
+            transfer.started = time.monotonic()
+            transfer.state = "running"
+        self._send_frame(FileAccept(transfer.file_id, offset))
+        if offset >= transfer.size:
+            self._finish(transfer)
+
+    def reject_file(self, transfer):
+        self._fail(transfer, "abgelehnt")
+
+    def cancel_file(self, transfer):
+        self._fail(transfer, "abgebrochen")
+
+    def _finish(self, transfer):
+        with self.lock:
+            if transfer.state != "running":
+                return
+            transfer.state = "done"
+            transfer.finished = time.monotonic()
+        if not transfer.outgoing:
+            transfer.file.close()
+            try:
+                os.replace(transfer.path + PART_SUFFIX, transfer.path)
+            except OSError as e:
+                transfer.state = "failed"
+                transfer.reason = f"Umbenennen fehlgeschlagen: {e}"
+                self._event("failed", transfer)
+                return
+            self._send_frame(FileProgress(transfer.file_id, transfer.offset))
+        self._event("done", transfer)
+
+    def _fail(self, transfer, reason, notify_peer=True):
+        with self.lock:
+            if transfer.state in ("done", "failed"):
+                return
+            transfer.state = "failed"
+            transfer.reason = reason
+            transfer.finished = time.monotonic()
+        if not transfer.outgoing and transfer.file is not None:
+            # .part bleibt zum Fortsetzen liegen
+            transfer.file.close()
+        if notify_peer:
+            self._send_frame(FileCancel(transfer.file_id, int(transfer.outgoing), reason))
+        self._event("failed", transfer)
+
+    def _event(self, event, transfer):
+        if self.file_callback is not None:
+            self.file_callback(event, transfer)
 
     def _log_peer(self, msg):
         timestamp = datetime.now().strftime("%H:%M")
-        self.gui_callback(f"[{self.peer_nick}] ({timestamp}): {msg}")
+        self._emit(f"[{self.peer_nick}] ({timestamp}): {msg}")
 
     def _log_local(self, msg):
         timestamp = datetime.now().strftime("%H:%M")
-        self.gui_callback(f"[{self.local_nick}] ({timestamp}): {msg}")
+        self._emit(f"[{self.local_nick}] ({timestamp}): {msg}")
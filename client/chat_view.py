@@ -0,0 +1,96 @@
+import tkinter as tk
+import zlib
+from collections import deque
+
+# Chatfenster mit begrenztem Scrollback. Im tk.Text stehen höchstens etwa
+# SCROLLBACK_LINES Zeilen; ältere werden in Blöcken zu TRIM_BATCH Zeilen
+# herausgeschnitten und komprimiert im Archiv abgelegt. Scrollt der Nutzer
+# oben an den Anfang, kommt der jüngste archivierte Block zurück ins Widget.
+# Einfügen und Rendern kosten damit unabhängig von der Sitzungsdauer gleich viel.
+
+SCROLLBACK_LINES = 2000
+TRIM_BATCH = 500
+# Darüber fallen die ältesten Blöcke ganz weg
+ARCHIVE_LINES = 200_000
+
+
+class ChatView:
+    def __init__(self, text, scrollback=SCROLLBACK_LINES, trim_batch=TRIM_BATCH, archive_lines=ARCHIVE_LINES):
+        self.text = text
+        self.scrollback = scrollback
+        self.trim_batch = trim_batch
+        self.archive_lines = archive_lines
+        # (zeilen, zlib-komprimierter Text), jüngster Block rechts
+        self.archive = deque()
+        self.archived = 0
+        self.dropped = 0
+        # Folgt die Ansicht dem Ende? Nur dann wird nach dem Schreiben mitgescrollt.
+        self.follow = True
+        self._restore_pending = False
+        text.config(yscrollcommand=self._on_view)
+        text.bind("<MouseWheel>", lambda e: self.scroll(int(-1 * (e.delta / 120))))
+        text.bind("<Button-4>", lambda e: self.scroll(-1))  # Linux
+        text.bind("<Button-5>", lambda e: self.scroll(1))   # Linux
+
+    def line_count(self):
+        return int(self.text.index("end-1c").split(".")[0]) - 1
+
+    def write(self, lines):
+        text = self.text
+        text.config(state='normal')
+        text.insert(tk.END, "\n".join(lines) + "\n")
+        self._trim()
+        text.config(state='disabled')
+        if self.follow:
+            text.yview(tk.END)
+
+    def _trim(self):
+        excess = self.line_count() - self.scrollback
+        if excess < self.trim_batch:
+            return
+        count = excess
+        if not self.follow:
+            # Nicht unter der Ansicht wegschneiden, was der Nutzer gerade liest
+            count = min(count, int(self.text.index("@0,0").split(".")[0]) - 1)
+            if count < self.trim_batch:
+                return
+        end = f"{count + 1}.0"
+        self._archive(count, self.text.get("1.0", end))
+        self.text.delete("1.0", end)
+
+    def _archive(self, count, chunk):
+        self.archive.append((count, zlib.compress(chunk.encode("utf-8"), 1)))
+        self.archived += count
+        while self.archived > self.archive_lines and len(self.archive) > 1:
+            old, _ = self.archive.popleft()
+            self.archived -= old
+            self.dropped += old
+
+    def restore(self):
+        # Jüngsten archivierten Block oben wieder einfügen; die Ansicht bleibt
+        # auf derselben Zeile stehen
+        self._restore_pending = False
+        if not self.archive:
+            return False
+        count, chunk = self.archive.pop()
+        self.archived -= count
+        text = self.text
+        top = text.index("@0,0")
+        text.config(state='normal')
+        text.insert("1.0", zlib.decompress(chunk).decode("utf-8"))
+        text.config(state='disabled')
+        line, col = top.split(".")
+        text.yview(f"{int(line) + count}.{col}")
+        return True
+
+    def scroll(self, units):
+        if units < 0 and self.text.yview()[0] <= 0.0:
+            self.restore()
+        self.text.yview_scroll(units, "units")
+
+    def _on_view(self, first, last):
+        self.follow = float(last) >= 1.0
+        if float(first) <= 0.0 and not self.follow and self.archive and not self._restore_pending:
+            # Oben angekommen (z. B. per Tastatur): nachladen, sobald Tk fertig gezeichnet hat
+            self._restore_pending = True
+            self.text.after_idle(self.restore)
@@ -1,23 +1,42 @@
 # client.py – refaktoriert für PrivateChatSession
 from .core import ChatCore
 from .gui import ChatGUI
+import argparse
 import tkinter as tk
 from tkinter import messagebox
 import threading
 import socket
-import queue
+import time
+from datetime import datetime
 from ..network.protocol import Protocol
-from .chat_session import PrivateChatSession
+from ..network.tls import TLSClient, client_context
+from .chat_session import PrivateChatSession, PrivateSessionManager, handshake
+from .directory import DirectoryReplica
+from .roster import Roster, UserRecord
+
+# So viele Nachrichten holt der Client beim Verbinden aus dem Verlauf
+HISTORY_BACKFILL = 100
 
 class ChatClientController:
-    def __init__(self):
+    def __init__(self, tls=None):
         self.root = tk.Tk()
         self.core = None
         self.gui = None
-        self.chat_requests = queue.Queue()
+        # Bleibt über Reconnects erhalten: danach werden nur Änderungen geladen
+        self.directory = DirectoryReplica()
+        # Zeitstempel (ms, Serveruhr) der neuesten bekannten Nachricht für HISTORY
+        self.history_since = 0
+        # Die anderen angemeldeten Nutzer; die GUI zeigt davon nur den sichtbaren Ausschnitt
+        self.roster = Roster()
+        # Alle privaten Chats auf einem Thread; bleiben über Reconnects zum Server offen
+        self.sessions = PrivateSessionManager()
+        # TLSClient oder None; behält die TLS-Sitzung für schnelle Reconnects
+        self.tls = tls
 
     def start(self):
         self.gui = ChatGUI(self.root, self)
+        # Nachricht für einen Chat ohne Fenster: Fenster wieder öffnen
+        self.sessions.on_reopen = self.gui.pump.threadsafe(self.gui.show_private_chat)
         self.root.mainloop()
 
     def connect_from_gui(self):
@@ -30,13 +49,15 @@ class ChatClientController:
         self.connect(nickname, server_ip, server_port)
 
     def connect(self, nickname, server_ip, server_port):
-        self.core = ChatCore(nickname, server_ip, server_port)
-        self.core.set_callback("on_connect", self.on_connect)
-        self.core.set_callback("on_disconnect", self.on_disconnect)
+        self.core = ChatCore(nickname, server_ip, server_port, self.directory, self.sessions, self.tls)
+        # Callbacks kommen aus Netzwerk-Threads und laufen über die Pumpe im Tk-Thread
+        pump = self.gui.pump
+        self.core.set_callback("on_connect", pump.threadsafe(self.on_connect))
+        self.core.set_callback("on_disconnect", pump.threadsafe(self.on_disconnect))
         self.core.set_callback("on_log", self.gui.log)
-        self.core.set_callback("on_tcp_command", self.handle_tcp_command)
-        self.core.set_callback("on_udp_command", self.handle_udp_command)
-        self.core.set_callback("on_private_chat", self.gui.show_private_chat)
+        self.core.set_callback("on_tcp_command", pump.threadsafe(self.handle_tcp_command))
+        self.core.set_callback("on_udp_command", pump.threadsafe(self.handle_udp_command))
+        self.core.set_callback("on_private_chat", pump.threadsafe(self.gui.show_private_chat))
         self.core.set_callback("on_private_chat_request", self.on_private_chat_request)
         threading.Thread(target=self.core.connect, daemon=True).start()
 
@@ -45,6 +66,7 @@ class ChatClientController:
             self.gui.status_label.config(text="Verbunden", fg="green")
             self.gui.connect_button.config(state="disabled")
             self.gui.disconnect_button.config(state="normal")
+            self.core.request_history(self.history_since, HISTORY_BACKFILL)
         else:
             messagebox.showerror("Fehler", f"Verbindung fehlgeschlagen: {info}")
             self.gui.status_label.config(text="Nicht verbunden", fg="red")
@@ -54,10 +76,13 @@ class ChatClientController:
             self.core.disconnect()
 
     def on_disconnect(self):
+        # Beim nächsten Verbinden nur nachholen, was seitdem kam (setzt
+        # ungefähr synchrone Uhren von Client und Server voraus)
+        self.history_since = max(self.history_since, time.time_ns() // 1_000_000)
         self.gui.status_label.config(text="Nicht verbunden", fg="red")
         self.gui.connect_button.config(state="normal")
         self.gui.disconnect_button.config(state="disabled")
-        self.gui.clear_user_list()
+        self.roster.clear()
 
     def send_broadcast_from_gui(self, event=None):
         message = self.gui.input_entry.get().strip()
@@ -66,86 +91,132 @@ class ChatClientController:
             self.gui.input_entry.delete(0, 'end')
 
     def send_broadcast(self, message):
-        if self.core:
+        if not self.core:
+            return
+        if message.startswith("/"):
+            self.handle_room_command(message)
+        else:
             self.core.send_broadcast(message)
 
+    def handle_room_command(self, line):
+        # /join <raum>, /part <raum>, /room <raum> <nachricht>
+        cmd, _, rest = line.partition(" ")
+        room, _, text = rest.strip().partition(" ")
+        if cmd == "/join" and room:
+            self.core.join_room(room)
+        elif cmd == "/part" and room:
+            self.core.part_room(room)
+        elif cmd == "/room" and room and text:
+            self.core.send_room_broadcast(room, text)
+        else:
+            self.gui.log("[INFO] Befehle: /join <raum>, /part <raum>, /room <raum> <nachricht>")
+
     def handle_user_click(self, event):
-        selection = self.gui.user_list.get(tk.ACTIVE)
-        try:
-            nick, ip, udp = selection.split(":")
-            udp_port = int(udp)
-            self.core.send_chat_request(ip, udp_port, nick)
-        except:
+        record = self.gui.roster_view.selected()
+        if record is None:
             messagebox.showerror("Fehler", "Ungültiger Eintrag in der Userliste.")
+            return
+        self.core.send_chat_request(record.ip, record.udp_port, record.nick)
 
     def handle_tcp_command(self, cmd, args):
         if cmd == "BROADCAST":
             sender, msg = Protocol.read_broadcast(args)
             self.gui.log(f"[{sender}]: {msg}")
         elif cmd == "USERLIST":
-            entries = Protocol.read_user_list(args)
-            filtered = [entry for entry in entries if not entry.startswith(self.core.own_nickname + ":")]
-            self.gui.update_user_list(filtered)
+            own = self.core.own_nickname
+            records = []
+            for entry in Protocol.read_user_list(args):
+                nick, ip, udp = entry.split(":")
+                if nick != own:
+                    records.append(UserRecord(nick, ip, int(udp)))
+            self.roster.replace(records)
         elif cmd == "USER_JOINED":
             nick, ip, udp = Protocol.read_user_joined(args)
             if nick != self.core.own_nickname:
-                self.gui.user_list.insert(tk.END, f"{nick}:{ip}:{udp}")
+                self.roster.add(nick, ip, int(udp))
             self.gui.log(f"[INFO] {nick} ist beigetreten")
         elif cmd == "USER_LEFT":
             left_nick = Protocol.read_user_left(args)
-            for i in range(self.gui.user_list.size()):
-                if self.gui.user_list.get(i).startswith(left_nick + ":"):
-                    self.gui.user_list.delete(i)
-                    break
+            self.roster.remove(left_nick)
             self.gui.log(f"[INFO] {left_nick} hat den Chat verlassen")
+        elif cmd == "ROOM_BROADCAST":
+            room, sender, msg = Protocol.read_room_broadcast(args)
+            self.gui.log(f"[{room}] [{sender}]: {msg}")
+        elif cmd == "ROOM_MEMBERS":
+            room, nicks = Protocol.read_room_members(args)
+            self.gui.log(f"[{room}] Mitglieder: {', '.join(nicks)}")
+        elif cmd == "ROOM_JOINED":
+            room, nick = Protocol.read_room_event(args)
+            if nick != self.core.own_nickname:
+                self.gui.log(f"[{room}] {nick} ist beigetreten")
+        elif cmd == "ROOM_LEFT":
+            room, nick = Protocol.read_room_event(args)
+            self.gui.log(f"[{room}] {nick} hat den Raum verlassen")
+        elif cmd == "HISTORY_ENTRY":
+            _, ts, sender, msg = Protocol.read_history_entry(args)
+            self.history_since = max(self.history_since, ts)
+            stamp = datetime.fromtimestamp(ts / 1000).strftime("%d.%m. %H:%M")
+            self.gui.log(f"[{stamp}] [{sender}]: {msg}")
+        elif cmd == "HISTORY_END":
+            if Protocol.read_history_end(args):
+                self.gui.log("[INFO] Ältere Nachrichten wurden nicht geladen")
         elif cmd == "ERROR":
             reason = Protocol.read_error(args)
             self.gui.log(f"[SERVER FEHLER] {reason}")
 
     def handle_udp_command(self, cmd, addr, args):
+        # Kommt über die Pumpe sofort nach dem Empfang; Wiederholungen hat der
+        # Signalisierungs-Layer bereits aussortiert
         if cmd == "CHAT_REQUEST":
             try:
-                port = Protocol.read_chat_request(args)
-                self.chat_requests.put((addr[0], addr[1], port))
-                self.root.after(1000, self.check_chat_requests)
+                port, request_id = Protocol.read_chat_request(args)
             except ValueError:
                 self.gui.log(f"[UDP] Ungültige CHAT_REQUEST von {addr}")
+                return
+            self.answer_chat_request(addr[0], addr[1], port, request_id)
         elif cmd == "CHAT_REJECTED":
             self.gui.log(f"[UDP] Chat-Anfrage von {addr} abgelehnt")
 
-    def check_chat_requests(self):
-        while not self.chat_requests.empty():
-            ip, udp_port, tcp_port = self.chat_requests.get()
-            accept = self.gui.show_dark_popup(
-                "Chat-Anfrage",
-                f"{ip}:{tcp_port} möchte mit dir chatten. Annehmen?",
-                yes_text="Annehmen",
-                no_text="Ablehnen"
+    def answer_chat_request(self, ip, udp_port, tcp_port, request_id):
+        accept = self.gui.show_dark_popup(
+            "Chat-Anfrage",
+            f"{ip}:{tcp_port} möchte mit dir chatten. Annehmen?",
+            yes_text="Annehmen",
+            no_text="Ablehnen"
+        )
+        if not self.core or not self.core.running:
+            return
+        if accept:
+            # Verbindungsaufbau und Handshake können dauern: nicht im Tk-Thread
+            threading.Thread(target=self.open_private_chat, args=(ip, tcp_port, self.core.nickname),
+                             daemon=True).start()
+        else:
+            try:
+                self.core.reject_chat(ip, udp_port, request_id)
+            except Exception as e:
+                self.gui.log(f"[WARNUNG] CHAT_REJECTED konnte nicht gesendet werden: {e}")
+
+    def open_private_chat(self, ip, tcp_port, nickname):
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            conn.connect((ip, tcp_port))
+            hello, decoder = handshake(conn, nickname)
+            session = PrivateChatSession(
+                conn=conn,
+                gui_callback=self.gui.log,
+                local_nick=nickname,
+                peer_nick=hello.nick,
+                peer_ip=ip,
+                peer_port=tcp_port,
+                manager=self.sessions,
+                decoder=decoder,
+                caps=hello.caps
             )
-            if accept:
-                try:
-                    conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    conn.connect((ip, tcp_port))
-                    conn.sendall(self.core.nickname.encode())
-                    peer_nickname = conn.recv(1024).decode().strip()
-                    session = PrivateChatSession(
-                        conn=conn,
-                        gui_callback=self.gui.log,
-                        local_nick=self.core.nickname,
-                        peer_nick=peer_nickname,
-                        peer_ip=ip,
-                        peer_port=tcp_port
-                    )
-                    session.start()
-                    self.gui.show_private_chat(session)
-                except Exception as e:
-                    self.gui.log(f"[FEHLER] Verbindung fehlgeschlagen: {e}")
-            else:
-                try:
-                    self.core.udp_sock.sendto(Protocol.chat_rejected(), (ip, udp_port))
-                except Exception as e:
-                    self.gui.log(f"[WARNUNG] CHAT_REJECTED konnte nicht gesendet werden: {e}")
-        self.root.after(1000, self.check_chat_requests)
+        except Exception as e:
+            conn.close()
+            self.gui.log(f"[FEHLER] Verbindung fehlgeschlagen: {e}")
+            return
+        self.gui.pump.threadsafe(self.gui.show_private_chat)(session)
 
     def on_private_chat_request(self, ip, udp_port, tcp_port):
         return self.gui.show_dark_popup(
@@ -157,8 +228,20 @@ class ChatClientController:
 
     def on_closing(self):
         self.disconnect()
+        self.sessions.close_all()
+        self.gui.pump.stop()
         self.root.destroy()
 
 if __name__ == "__main__":
-    client = ChatClientController()
+    parser = argparse.ArgumentParser(description="Peer2Peer Chatroom Client")
+    parser.add_argument("--tls", action="store_true", help="Zum Server per TLS verbinden")
+    parser.add_argument("--tls-ca", default=None,
+                        help="Zertifikat(e), denen vertraut wird, z. B. das selbstsignierte des Servers (impliziert --tls)")
+    parser.add_argument("--tls-insecure", action="store_true",
+                        help="Zertifikat des Servers nicht prüfen (nur zum Testen)")
+    opts = parser.parse_args()
+    tls = None
+    if opts.tls or opts.tls_ca or opts.tls_insecure:
+        tls = TLSClient(client_context(opts.tls_ca, verify=not opts.tls_insecure))
+    client = ChatClientController(tls)
     client.start()
\ No newline at end of file
@@ -1,12 +1,46 @@
+import random
 import socket
+import struct
 import threading
+import time
 import unicodedata
-from .chat_session import PrivateChatSession
-from ..network.protocol import Protocol
+from .chat_session import PrivateChatSession, PrivateSessionManager, handshake
+from .directory import DirectoryReplica
+from .mesh import MeshRouter
+from .signalling import Signalling
+from ..network.protocol import (
+    CAP_DIR, CAP_MESH, CAP_RESUME, CAP_V2, MESH_OPCODES, SESSION_GAP, Broadcast, Error, FrameDecoder,
+    History, Join, Part, Protocol, ProtocolV2, Quit, RoomBroadcast, RoomLeft, RoomMesh, Seq, Session,
+    Sync, TextCodec, UserListDelta, UserListPage, Welcome,
+)
+from ..network.tls import connect as tls_connect
 from datetime import datetime
 
+# So lange (Sekunden) versucht der Client nach einem Abbruch, die Sitzung fortzusetzen
+RESUME_WINDOW = 25.0
+# So lange (Sekunden) wartet eine bestätigte Chat-Anfrage auf die Antwort des Gegenübers
+CHAT_ANSWER_TIMEOUT = 30.0
+
+class ChatRequest:
+    # Eigene offene Chat-Anfrage; outcome wird gesetzt, wenn sie vorzeitig endet
+    def __init__(self, server_sock, target, nick):
+        self.server_sock = server_sock
+        self.target = target
+        self.nick = nick
+        self.request_id = None
+        self.started = time.perf_counter()
+        self.outcome = None
+
+class ResumeState:
+    # Token der Sitzung und Nummer des letzten vollständig verarbeiteten Events
+    def __init__(self):
+        self.token = None
+        self.seq = 0
+        # Aus dem letzten SEQ-Frame; gilt erst, wenn das Event danach verarbeitet ist
+        self.pending = None
+
 class ChatCore:
-    def __init__(self, nickname, server_ip, server_port):
+    def __init__(self, nickname, server_ip, server_port, directory=None, sessions=None, tls=None):
         self.nickname = nickname
         self.server_ip = server_ip
         self.server_port = server_port
@@ -16,46 +50,153 @@ class ChatCore:
         self.running = False
         self.tcp_thread = None
         self.udp_thread = None
+        self.codec = TextCodec
+        # Verzeichnis-Kopie; der Aufrufer kann sie über Reconnects hinweg weiterreichen
+        self.directory = directory or DirectoryReplica()
+        self.dir_sync = False
+        self.resume = ResumeState()
+        self.signalling = None
+        # Raum-Nachrichten direkt über UDP, wenn der Server "mesh" anbietet
+        self.mesh = None
+        # Anfrage-ID -> ChatRequest
+        self.chat_requests = {}
+        # Private Chats; wie directory vom Aufrufer über Reconnects hinweg weiterreichbar
+        self.sessions = sessions or PrivateSessionManager()
+        # TLSClient (network/tls.py) oder None; hält die Sitzung für den nächsten
+        # Handshake und sollte daher ebenfalls weitergereicht werden
+        self.tls = tls
         self.callbacks = {}
 
     def connect(self):
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((self.server_ip, self.server_port))
+            self.sock = self._open()
             self.udp_port = UDPPortChooser.choose()
             self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.udp_sock.bind(('0.0.0.0', self.udp_port))
-            self.sock.sendall(Protocol.register(self.nickname, str(self.udp_port)))
-            buffer = b""
-            while True:
-                data = self.sock.recv(1024)
-                if not data:
-                    raise Exception("Keine Antwort vom Server.")
-                buffer += data
-                messages, buffer = Protocol.decode_stream(buffer)
-                if messages:
-                    cmd, args = Protocol.extract_command(messages[0])
-                    break
-            if cmd == "WELCOME":
-                self.own_nickname = args[0]
+            self.sock.sendall(Protocol.register(self.nickname, str(self.udp_port), CAP_V2, CAP_DIR, CAP_RESUME,
+                                                 CAP_MESH))
+            decoder = FrameDecoder()
+            reply = self._read_reply(decoder)
+            if isinstance(reply, Error) and reply.reason.startswith("REGISTER"):
+                # Alter Server kennt kein Fähigkeiten-Argument: ohne v2 erneut registrieren
+                self.sock.sendall(Protocol.register(self.nickname, str(self.udp_port)))
+                reply = self._read_reply(decoder)
+            if isinstance(reply, Welcome):
+                self._welcome(reply)
+                self._remember_tls(self.sock)
+                if CAP_MESH in reply.caps:
+                    self.mesh = MeshRouter(self.own_nickname, self.udp_sock.sendto, self._mesh_deliver)
+                    self.mesh.start()
                 self.running = True
-                self.tcp_thread = TCPReceiverThread(self.sock, self.handle_tcp_command)
-                self.tcp_thread.start()
-                self.udp_thread = UDPListenerThread(self.udp_sock, self.handle_udp_command)
-                self.udp_thread.start()
                 self._trigger("on_connect", True, self.own_nickname)
-            elif cmd == "ERROR":
+                if self.dir_sync:
+                    # Bekannten Stand sofort anzeigen, der Server schickt nur die Änderungen
+                    if self.directory.entries:
+                        self.handle_tcp_command("USERLIST", self.directory.entry_list())
+                    self.request_sync()
+                self._start_receiver(decoder)
+                self.signalling = Signalling(self.udp_sock, self.handle_udp_command)
+                self.udp_thread = UDPListenerThread(self.udp_sock, self.signalling.received,
+                                                    self.mesh.received if self.mesh else None)
+                self.udp_thread.start()
+            elif isinstance(reply, Error):
                 self.sock.close()
                 self.sock = None
-                self._trigger("on_connect", False, ' '.join(args))
+                self._trigger("on_connect", False, reply.reason)
         except Exception as e:
             self.sock = None
             self._trigger("on_connect", False, str(e))
 
+    def _open(self, timeout=None):
+        if self.tls is not None:
+            return tls_connect((self.server_ip, self.server_port), self.tls, timeout)
+        return socket.create_connection((self.server_ip, self.server_port), timeout=timeout)
+
+    def _remember_tls(self, sock):
+        # Erst nach der ersten Antwort des Servers sind seine Session-Tickets angekommen
+        if self.tls is not None:
+            self.tls.remember(sock.channel)
+
+    def _welcome(self, reply):
+        self.own_nickname = reply.nick
+        self.codec = ProtocolV2 if CAP_V2 in reply.caps else TextCodec
+        self.dir_sync = CAP_DIR in reply.caps
+        if CAP_RESUME not in reply.caps:
+            self.resume = ResumeState()
+
+    def _start_receiver(self, decoder):
+        self.tcp_thread = TCPReceiverThread(self.sock, self.handle_tcp_message, decoder, self.codec,
+                                            self.on_connection_lost)
+        self.tcp_thread.start()
+
+    def _read_reply(self, decoder, sock=None):
+        # Antworten auf REGISTER/RESUME kommen immer im Textformat
+        sock = sock or self.sock
+        while True:
+            for payload in decoder.frames():
+                reply = TextCodec.decode(payload)
+                if reply is not None:
+                    return reply
+            if not decoder.recv_into(sock):
+                raise OSError("Keine Antwort vom Server.")
+
+    def on_connection_lost(self, sock):
+        # Vom Empfangs-Thread, wenn die TCP-Verbindung endet. War das kein
+        # disconnect(), wird die Sitzung per RESUME fortgesetzt: gleicher Nickname,
+        # nur die verpassten Events, keine neue Nutzerliste.
+        if not self.running or sock is not self.sock:
+            return
+        if self.resume.token is not None:
+            self._trigger("on_log", "[INFO] Verbindung unterbrochen – Sitzung wird fortgesetzt …")
+            deadline = time.monotonic() + RESUME_WINDOW
+            delay = 0.1
+            while self.running and time.monotonic() < deadline:
+                try:
+                    if self._resume():
+                        return
+                    self._trigger("on_log", "[INFO] Sitzung abgelaufen – bitte neu verbinden.")
+                    break
+                except OSError:
+                    pass
+                # Zufällige Verzögerung, damit nicht alle Clients gleichzeitig wiederkommen
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, 5.0)
+        if self.running and sock is self.sock:
+            self.disconnect()
+
+    def _resume(self):
+        # True = fortgesetzt, False = Server kennt die Sitzung nicht mehr; OSError = nochmal versuchen
+        sock = self._open(timeout=5)
+        try:
+            sock.sendall(Protocol.resume(self.nickname, self.resume.token, self.resume.seq,
+                                         str(self.udp_port), CAP_V2, CAP_DIR, CAP_RESUME, CAP_MESH))
+            decoder = FrameDecoder()
+            reply = self._read_reply(decoder, sock)
+        except OSError:
+            sock.close()
+            raise
+        if not isinstance(reply, Welcome):
+            sock.close()
+            return False
+        sock.settimeout(None)
+        self._remember_tls(sock)
+        old = self.sock
+        self.sock = sock
+        try:
+            old.close()
+        except OSError:
+            pass
+        self.resume.pending = None
+        self._welcome(reply)
+        self._start_receiver(decoder)
+        return True
+
     def disconnect(self):
         if self.running:
+            # Zuerst, damit der Empfangs-Thread das Schließen nicht für einen Abbruch hält
+            self.running = False
             try:
-                self.sock.sendall(Protocol.quit())
+                self.sock.sendall(self.codec.encode(Quit()))
             except:
                 pass
             try:
@@ -63,55 +204,137 @@ class ChatCore:
                 self.sock.close()
             except:
                 pass
+            if self.signalling:
+                self.signalling.close()
+            if self.mesh:
+                self.mesh.close()
+                self.mesh = None
+            for request in list(self.chat_requests.values()):
+                self._end_chat_request(request, "closed")
             try:
                 self.udp_sock.close()
             except:
                 pass
-            self.running = False
             self.sock = None
             self.udp_sock = None
             self._trigger("on_disconnect")
 
+    def request_sync(self):
+        self.sock.sendall(self.codec.encode(Sync(self.directory.epoch, self.directory.version)))
+
+    def request_history(self, since, limit):
+        # Antwort: HISTORY_ENTRY-Frames (älteste zuerst), danach HISTORY_END
+        if self.sock:
+            self.sock.sendall(self.codec.encode(History(since, limit)))
+
     def send_broadcast(self, message):
         if message and self.sock:
             # Unicode-Normalisierung für Emojis
             message = unicodedata.normalize("NFC", message)
-            self.sock.sendall(Protocol.broadcast(self.nickname, message))
+            self.sock.sendall(self.codec.encode(Broadcast(self.nickname, message)))
+
+    def join_room(self, room):
+        if self.sock:
+            self.sock.sendall(self.codec.encode(Join(room)))
+
+    def part_room(self, room):
+        if self.sock:
+            self.sock.sendall(self.codec.encode(Part(room)))
+
+    def send_room_broadcast(self, room, message):
+        if message and self.sock:
+            message = unicodedata.normalize("NFC", message)
+            if self.mesh and self.mesh.publish(room, message):
+                return
+            self.sock.sendall(self.codec.encode(RoomBroadcast(room, self.nickname, message)))
 
     def send_chat_request(self, target_ip, target_udp_port, target_nick=None):
+        # Die Anfrage wird wiederholt, bis das Gegenüber sie bestätigt; ohne
+        # Bestätigung oder bei Ablehnung endet sie sofort statt nach dem Timeout.
+        # Steht noch eine Verbindung zu diesem Gegenüber im Pool, wird sie ohne
+        # Anfrage und Handshake weiterbenutzt.
+        session = target_nick and self.sessions.get(target_nick, target_ip)
+        if session:
+            self._trigger("on_private_chat", session)
+            return
+        if not self.signalling:
+            return
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.bind(('', 0))
         server.listen(1)
         tcp_port = server.getsockname()[1]
-        threading.Thread(target=self.accept_chat, args=(server, target_nick), daemon=True).start()
-        try:
-            msg = Protocol.chat_request(tcp_port)
-            self.udp_sock.sendto(msg, (target_ip, target_udp_port))
-            self._trigger("on_log", f"[INFO] Chat-Anfrage an {target_ip}:{target_udp_port} gesendet")
-        except Exception as e:
-            self._trigger("on_log", f"[FEHLER] Chat-Anfrage konnte nicht gesendet werden: {e}")
+        request = ChatRequest(server, (target_ip, target_udp_port), target_nick)
+        request.request_id = self.signalling.send(
+            request.target, lambda request_id: Protocol.chat_request(tcp_port, request_id),
+            lambda: self._end_chat_request(request, "unreachable"))
+        self.chat_requests[request.request_id] = request
+        threading.Thread(target=self.accept_chat, args=(request,), daemon=True).start()
+        self._trigger("on_log", f"[INFO] Chat-Anfrage an {target_nick or target_ip}:{target_udp_port} gesendet")
+
+    def reject_chat(self, ip, udp_port, request_id=None):
+        if not self.signalling:
+            return
+        if request_id is None:
+            # Älterer Client ohne Anfrage-IDs: einmalig, ohne Bestätigung
+            self.udp_sock.sendto(Protocol.chat_rejected(), (ip, udp_port))
+        else:
+            self.signalling.send((ip, udp_port), Protocol.chat_rejected, request_id=request_id)
+
+    def _end_chat_request(self, request, outcome):
+        # Beendet das Warten in accept_chat; erst shutdown() weckt ein
+        # blockierendes accept() in einem anderen Thread auf
+        if request.outcome is None:
+            request.outcome = outcome
+            try:
+                request.server_sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
-    def accept_chat(self, server_sock, expected_nick=None):
-        server_sock.settimeout(10)
+    def accept_chat(self, request):
+        server_sock = request.server_sock
+        name = request.nick or f"{request.target[0]}:{request.target[1]}"
+        server_sock.settimeout(CHAT_ANSWER_TIMEOUT)
         try:
-            conn, addr = server_sock.accept()
-            peer_nickname = conn.recv(1024).decode().strip()
-            peer_nickname = unicodedata.normalize("NFC", peer_nickname)
-            conn.sendall(self.nickname.encode())
+            try:
+                conn, addr = server_sock.accept()
+            except socket.timeout:
+                self._trigger("on_log", f"[INFO] {name} hat deine Chat-Anfrage nicht beantwortet.")
+                return
+            except OSError:
+                if request.outcome == "rejected":
+                    self._trigger("on_log", f"[INFO] {name} hat deine Chat-Anfrage abgelehnt.")
+                elif request.outcome == "unreachable":
+                    self._trigger("on_log", f"[INFO] {name} ist nicht erreichbar (keine Bestätigung).")
+                return
+            try:
+                hello, decoder = handshake(conn, self.nickname)
+            except (OSError, ValueError):
+                conn.close()
+                raise
+            peer_nickname = unicodedata.normalize("NFC", hello.nick)
+            # Gestartet wird die Sitzung von on_private_chat, nachdem die
+            # Callbacks gesetzt sind
             session = PrivateChatSession(
                 conn=conn,
                 gui_callback=lambda msg: self._trigger("on_log", msg),
                 local_nick=self.nickname,
                 peer_nick=peer_nickname,
                 peer_ip=addr[0],
-                peer_port=addr[1]
+                peer_port=addr[1],
+                manager=self.sessions,
+                decoder=decoder,
+                caps=hello.caps
             )
-            session.start()
+            elapsed = (time.perf_counter() - request.started) * 1000
+            self._trigger("on_log", f"[INFO] Privater Chat mit {peer_nickname} nach {elapsed:.0f} ms aufgebaut")
             self._trigger("on_private_chat", session)
-        except socket.timeout:
-            self._trigger("on_log", "[INFO] Deine Chat-Anfrage wurde nicht beantwortet oder abgelehnt.")
+        except (OSError, ValueError) as e:
+            self._trigger("on_log", f"[FEHLER] Privater Chat konnte nicht aufgebaut werden: {e}")
         finally:
             server_sock.close()
+            self.chat_requests.pop(request.request_id, None)
+            if self.signalling:
+                self.signalling.cancel(request.target, request.request_id)
 
     def set_callback(self, event, callback):
         self.callbacks[event] = callback
@@ -124,10 +347,65 @@ class ChatCore:
     def current_time():
         return datetime.now().strftime("%H:%M")
 
+    def handle_tcp_message(self, msg):
+        if isinstance(msg, Seq):
+            self.resume.pending = msg.seq
+            return
+        if isinstance(msg, Session):
+            self.resume.token = msg.token
+            self.resume.seq = msg.seq
+            self.resume.pending = None
+            if msg.state == SESSION_GAP:
+                self._trigger("on_log", "[INFO] Sitzung fortgesetzt, einige Nachrichten gingen verloren")
+                if self.dir_sync:
+                    self.request_sync()
+            elif msg.state:
+                self._trigger("on_log", "[INFO] Sitzung fortgesetzt")
+            return
+        if isinstance(msg, RoomMesh):
+            if self.mesh:
+                self.mesh.update(msg.room, msg.epoch, msg.members)
+            return
+        if isinstance(msg, RoomLeft) and msg.nick == self.own_nickname and self.mesh:
+            self.mesh.forget(msg.room)
+        if isinstance(msg, UserListPage):
+            if self.directory.add_page(msg):
+                self.handle_tcp_command("USERLIST", self.directory.entry_list())
+        elif isinstance(msg, UserListDelta):
+            changes = self.directory.apply(msg)
+            if len(changes) > 1:
+                self.handle_tcp_command("USERLIST", self.directory.entry_list())
+            elif changes and changes[0][0] == "+":
+                self.handle_tcp_command("USER_JOINED", changes[0][1:].split(":"))
+            elif changes:
+                self.handle_tcp_command("USER_LEFT", [changes[0][1:]])
+            if self.directory.has_gap():
+                # Deltas fehlen (z. B. verworfene Frames): Stand neu anfordern
+                self.directory.pending.clear()
+                self.request_sync()
+        else:
+            self.handle_tcp_command(msg.command, msg.to_args())
+        if self.resume.pending is not None:
+            self.resume.seq = self.resume.pending
+            self.resume.pending = None
+
     def handle_tcp_command(self, cmd, args):
         self._trigger("on_tcp_command", cmd, args)
 
+    def _mesh_deliver(self, room, sender, text):
+        # Über das Mesh zugestellt: für die Oberfläche wie vom Server weitergeleitet
+        self.handle_tcp_command("ROOM_BROADCAST", [room, sender, text])
+
     def handle_udp_command(self, cmd, addr, args):
+        # Vom Signalisierungs-Layer, ohne Duplikate
+        if cmd == "CHAT_REJECTED":
+            try:
+                request = self.chat_requests.get(Protocol.read_chat_rejected(args))
+            except ValueError:
+                request = None
+            if request is not None:
+                self._end_chat_request(request, "rejected")
+                return
         self._trigger("on_udp_command", cmd, addr, args)
 
 class UDPPortChooser:
@@ -140,41 +418,58 @@ class UDPPortChooser:
         return port
 
 class TCPReceiverThread(threading.Thread):
-    def __init__(self, sock, callback):
+    def __init__(self, sock, callback, decoder=None, codec=TextCodec, on_close=None):
         super().__init__(daemon=True)
         self.sock = sock
         self.callback = callback
+        # Decoder aus connect() übernehmen, damit schon empfangene Frames
+        # (z. B. USERLIST direkt nach WELCOME) nicht verloren gehen
+        self.decoder = decoder or FrameDecoder()
+        self.codec = codec
+        self.on_close = on_close
         self.running = True
     def run(self):
-        buffer = b""
         while self.running:
             try:
-                data = self.sock.recv(1024)
-                if not data:
+                for payload in self.decoder.frames():
+                    try:
+                        msg = self.codec.decode(payload)
+                    except ValueError:
+                        continue
+                    if msg is not None:
+                        self.callback(msg)
+                if not self.decoder.recv_into(self.sock):
                     break
-                buffer += data
-                messages, buffer = Protocol.decode_stream(buffer)
-                for payload in messages:
-                    cmd, args = Protocol.extract_command(payload)
-                    self.callback(cmd, args)
             except:
                 break
+        if self.on_close:
+            self.on_close(self.sock)
     def stop(self):
         self.running = False
 
 class UDPListenerThread(threading.Thread):
-    def __init__(self, udp_sock, callback):
+    def __init__(self, udp_sock, callback, on_frame=None):
         super().__init__(daemon=True)
         self.udp_sock = udp_sock
         self.callback = callback
+        # on_frame(data, addr) für binäre Mesh-Datagramme
+        self.on_frame = on_frame
         self.running = True
     def run(self):
         while self.running:
             try:
-                data, addr = self.udp_sock.recvfrom(1024)
-                cmd, args = Protocol.extract_udp_message(data)
-                self.callback(cmd, addr, args)
+                data, addr = self.udp_sock.recvfrom(65535)
             except OSError:
                 break
+            try:
+                if len(data) > 4 and data[4] in MESH_OPCODES:
+                    if self.on_frame:
+                        self.on_frame(data, addr)
+                    continue
+                cmd, args = Protocol.extract_udp_message(data)
+                self.callback(cmd, addr, args)
+            except (ValueError, UnicodeDecodeError, struct.error):
+                # Kaputtes Datagramm: verwerfen, der Listener muss weiterlaufen
+                continue
     def stop(self):
         self.running = False
@@ -0,0 +1,76 @@
+PENDING_LIMIT = 64
+
+
+class DirectoryReplica:
+    # Lokale Kopie des versionierten Nutzerverzeichnisses des Servers.
+    # Bleibt über Reconnects erhalten: mit (epoch, version) fragt der Client per
+    # SYNC nur die Änderungen seitdem ab statt der kompletten Liste.
+    def __init__(self):
+        self.epoch = 0
+        self.version = 0
+        self.entries = {}
+        # Zu früh eingetroffene Deltas: (epoch, base) -> UserListDelta
+        self.pending = {}
+        self.snapshot = None
+
+    def entry_list(self):
+        return list(self.entries.values())
+
+    def add_page(self, page):
+        # Gibt True zurück, sobald die letzte Seite eines Snapshots da ist;
+        # danach ersetzt der Snapshot das Verzeichnis komplett.
+        key = (page.epoch, page.version)
+        if self.snapshot is None or self.snapshot[0] != key:
+            self.snapshot = (key, {})
+        entries = self.snapshot[1]
+        for entry in page.entries:
+            entries[entry.split(":", 1)[0]] = entry
+        if page.more:
+            return False
+        self.snapshot = None
+        if page.epoch == self.epoch and page.version <= self.version:
+            # Inzwischen schon per Delta weiter
+            return True
+        self.epoch, self.version = key
+        self.entries = entries
+        self.pending = {k: d for k, d in self.pending.items() if k[0] == self.epoch}
+        self._drain()
+        return True
+
+    def apply(self, delta):
+        # Liefert die tatsächlich wirksamen Änderungen ("+nick:ip:udp" / "-nick"),
+        # auch die von zwischengespeicherten Deltas, die jetzt anschließen.
+        if delta.epoch != self.epoch or delta.base > self.version:
+            self.pending[(delta.epoch, delta.base)] = delta
+            return []
+        applied = self._apply(delta)
+        return applied + self._drain()
+
+    def _apply(self, delta):
+        if delta.version <= self.version:
+            return []
+        applied = []
+        for change in delta.changes:
+            if change[0] == "+":
+                entry = change[1:]
+                nick = entry.split(":", 1)[0]
+                if self.entries.get(nick) != entry:
+                    self.entries[nick] = entry
+                    applied.append(change)
+            elif self.entries.pop(change[1:], None) is not None:
+                applied.append(change)
+        self.version = delta.version
+        return applied
+
+    def _drain(self):
+        applied = []
+        while self.pending:
+            ready = [k for k in self.pending if k[0] == self.epoch and k[1] <= self.version]
+            if not ready:
+                break
+            for key in sorted(ready, key=lambda k: k[1]):
+                applied.extend(self._apply(self.pending.pop(key)))
+        return applied
+
+    def has_gap(self):
+        return len(self.pending) > PENDING_LIMIT
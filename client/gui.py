@@ -1,13 +1,33 @@
 # gui.py – angepasst für PrivateChatSession
+import time
 import tkinter as tk
+from tkinter import filedialog
 from .emoji_bar import EmojiBar
+from .chat_view import ChatView
+from .roster import RosterView
+from .ui_pump import UIPump
+
+# So lange steht "schreibt …" nach dem letzten P2P_TYPING in der Statuszeile
+TYPING_SHOW_MS = 5000
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
 
 
 class ChatGUI:
     def __init__(self, master, controller):
         self.master = master
         self.controller = controller
+        # Alle Anzeige-Aufträge aus Netzwerk-Threads laufen über diese Pumpe
+        self.pump = UIPump(master)
+        # Offene private Chatfenster je Sitzung
+        self.private_windows = {}
         self.build_gui()
+        self.pump.start()
 
     def build_gui(self):
         self.master.title("Peer2Peer Chatroom ✨")
@@ -41,12 +61,8 @@ class ChatGUI:
         chat_box_frame.pack(padx=15, pady=8, fill="both")
         self.chat_box = tk.Text(chat_box_frame, state='disabled', height=12, bg="#23272f", fg="#d1d1d1", insertbackground="#d1d1d1", relief="flat", font=("Consolas", 11), borderwidth=0, highlightthickness=0)
         self.chat_box.pack(fill="both", expand=True)
-        # Mausrad-Scrolling aktivieren
-        def _on_mousewheel(event):
-            self.chat_box.yview_scroll(int(-1*(event.delta/120)), "units")
-        self.chat_box.bind("<MouseWheel>", _on_mousewheel)
-        self.chat_box.bind("<Button-4>", lambda e: self.chat_box.yview_scroll(-1, "units"))  # Linux
-        self.chat_box.bind("<Button-5>", lambda e: self.chat_box.yview_scroll(1, "units"))   # Linux
+        # Begrenzter Scrollback, Mausrad-Scrolling lädt ältere Zeilen nach
+        self.chat_view = ChatView(self.chat_box)
 
         # --- Input ---
         input_frame = tk.Frame(self.master, bg="#23272f")
@@ -84,27 +100,42 @@ class ChatGUI:
         # --- Bottom/Userlist ---
         bottom_frame = tk.Frame(self.master, bg="#23272f")
         bottom_frame.pack(padx=15, pady=5, fill="both", expand=True)
-        tk.Label(bottom_frame, text="Users:", bg="#23272f", fg="#b9bbbe", font=("Segoe UI", 10, "bold")).pack(anchor="w")
-        self.user_list = tk.Listbox(bottom_frame, bg="#23272f", fg="#b9bbbe", selectbackground="#36393f", selectforeground="#f6f6f6", relief="flat", font=("Segoe UI", 11))
+        users_header = tk.Frame(bottom_frame, bg="#23272f")
+        users_header.pack(fill="x")
+        tk.Label(users_header, text="Users:", bg="#23272f", fg="#b9bbbe", font=("Segoe UI", 10, "bold")).pack(side="left")
+        # Tippen filtert die Liste nach Nick-Anfang
+        self.user_filter = tk.StringVar()
+        tk.Entry(users_header, textvariable=self.user_filter, width=18, bg="#23272f", fg="#d1d1d1", insertbackground="#d1d1d1", relief="flat").pack(side="right")
+        tk.Label(users_header, text="Suche:", bg="#23272f", fg="#b9bbbe").pack(side="right", padx=(0,4))
+        user_list_frame = tk.Frame(bottom_frame, bg="#23272f")
+        user_list_frame.pack(fill="both", expand=True, pady=(2,0))
+        self.user_list = tk.Listbox(user_list_frame, bg="#23272f", fg="#b9bbbe", selectbackground="#36393f", selectforeground="#f6f6f6", relief="flat", font=("Segoe UI", 11))
         self.user_list.bind("<Double-Button-1>", self.controller.handle_user_click)
-        self.user_list.pack(fill="both", expand=True, pady=(2,0))
+        user_scroll = tk.Scrollbar(user_list_frame, orient="vertical")
+        user_scroll.pack(side="right", fill="y")
+        self.user_list.pack(side="left", fill="both", expand=True)
+        # Zeigt nur die sichtbaren Zeilen der Nutzerliste des Controllers
+        self.roster_view = RosterView(self.user_list, user_scroll, self.controller.roster)
+        self.user_filter.trace_add("write", lambda *_: self.roster_view.set_filter(self.user_filter.get()))
 
     def log(self, message):
-        self.chat_box.config(state='normal')
-        self.chat_box.insert(tk.END, message + "\n")
-        self.chat_box.config(state='disabled')
-        self.chat_box.yview(tk.END)
+        # Aus beliebigem Thread; geschrieben wird gebündelt im nächsten Frame
+        self.pump.write(self.write_lines, message)
 
-    def update_user_list(self, users):
-        self.user_list.delete(0, tk.END)
-        for entry in users:
-            self.user_list.insert(tk.END, entry)
-
-    def clear_user_list(self):
-        self.user_list.delete(0, tk.END)
+    def write_lines(self, lines):
+        self.chat_view.write(lines)
 
     def show_private_chat(self, session):
+        # Auch für Sitzungen aus dem Pool: ein vorhandenes Fenster nur nach vorne holen
+        window = self.private_windows.get(session)
+        if window is not None and window.winfo_exists():
+            window.deiconify()
+            window.lift()
+            return
+        if session.stop_event.is_set():
+            return
         chat_window = tk.Toplevel(self.master)
+        self.private_windows[session] = chat_window
         chat_window.title(f"Privater Chat mit {session.peer_nick} @ {session.peer_ip}:{session.peer_port}")
         chat_window.configure(bg="#23272f")
         chat_window.geometry("500x350")
@@ -119,12 +150,7 @@ class ChatGUI:
         chat_box_frame.columnconfigure(0, weight=1)
         chat_box = tk.Text(chat_box_frame, state='disabled', height=10, bg="#23272f", fg="#d1d1d1", insertbackground="#d1d1d1", relief="flat", font=("Consolas", 11), borderwidth=0, highlightthickness=0)
         chat_box.grid(row=0, column=0, sticky="nsew")
-        # Mausrad-Scrolling aktivieren
-        def _on_mousewheel(event):
-            chat_box.yview_scroll(int(-1*(event.delta/120)), "units")
-        chat_box.bind("<MouseWheel>", _on_mousewheel)
-        chat_box.bind("<Button-4>", lambda e: chat_box.yview_scroll(-1, "units"))  # Linux
-        chat_box.bind("<Button-5>", lambda e: chat_box.yview_scroll(1, "units"))   # Linux
+        chat_view = ChatView(chat_box)
 
         input_frame = tk.Frame(chat_window, bg="#23272f")
         input_frame.grid(row=1, column=0, sticky="ew", padx=15, pady=(0,2))
@@ -160,16 +186,93 @@ class ChatGUI:
         )
         toggle_emoji_btn.grid(row=0, column=2, padx=(6, 0))
 
+        def offer_file():
+            path = filedialog.askopenfilename(parent=chat_window, title="Datei senden")
+            if path:
+                try:
+                    transfer = session.send_file(path)
+                except OSError as e:
+                    write_chat([f"[FEHLER] Datei kann nicht gesendet werden: {e}"])
+                    return
+                write_chat([f"[INFO] {transfer.name} ({format_size(transfer.size)}) angeboten"])
+
+        file_btn = tk.Button(input_frame, text="Datei", command=offer_file, bg="#36393f", fg="#f6f6f6", relief="flat", activebackground="#23272f")
+        file_btn.grid(row=0, column=3, padx=(6, 0))
+        status_label = tk.Label(chat_window, text="", anchor="w", bg="#23272f", fg="#b9bbbe", font=("Segoe UI", 9))
+        status_label.grid(row=2, column=0, sticky="ew", padx=15)
+        # Laufende Übertragungen und "schreibt …" für die Statuszeile
+        running = {}
+        typing_until = [0]
+
+
+        def write_chat(lines):
+            if chat_box.winfo_exists():
+                chat_view.write(lines)
 
         def log_chat(message):
-            chat_box.config(state='normal')
-            chat_box.insert(tk.END, message + "\n")
-            chat_box.config(state='disabled')
-            chat_box.yview(tk.END)
+            # Vom Empfangs-Thread der Sitzung
+            self.pump.write(write_chat, message)
+
+        def show_status():
+            if status_label.winfo_exists():
+                parts = [f"{'↑' if t.outgoing else '↓'} {t.name} {t.offset * 100 // max(t.size, 1)}% "
+                         f"({format_size(t.rate())}/s)" for t in running.values()]
+                if typing_until[0] > time.monotonic():
+                    parts.append(f"{session.peer_nick} schreibt …")
+                status_label.config(text="   ".join(parts))
+
+        def on_typing():
+            if status_label.winfo_exists():
+                typing_until[0] = time.monotonic() + TYPING_SHOW_MS / 1000
+                self.pump.defer(show_status)
+                status_label.after(TYPING_SHOW_MS, show_status)
+
+        def on_file(event, transfer):
+            # Im Tk-Thread, über die Pumpe
+            if not chat_window.winfo_exists():
+                if event == "offer":
+                    session.reject_file(transfer)
+                return
+            key = (transfer.outgoing, transfer.file_id)
+            if event == "offer":
+                accept = self.show_dark_popup(
+                    "Datei empfangen",
+                    f"{session.peer_nick} möchte dir {transfer.name} ({format_size(transfer.size)}) senden.",
+                    yes_text="Speichern", no_text="Ablehnen")
+                path = accept and filedialog.asksaveasfilename(parent=chat_window, initialfile=transfer.name)
+                if path:
+                    session.accept_file(transfer, path)
+                else:
+                    session.reject_file(transfer)
+                return
+            if event == "progress":
+                running[key] = transfer
+            else:
+                running.pop(key, None)
+                direction = "gesendet" if transfer.outgoing else f"gespeichert unter {transfer.path}"
+                if event == "done":
+                    write_chat([f"[INFO] {transfer.name} {direction} ({format_size(transfer.rate())}/s)"])
+                else:
+                    write_chat([f"[INFO] Übertragung von {transfer.name} beendet: {transfer.reason}"])
+            self.pump.defer(show_status)
+
+        def on_close():
+            # Die Verbindung bleibt im Pool und wird beim nächsten Öffnen weiterbenutzt
+            session.detach()
+            self.private_windows.pop(session, None)
+            chat_window.destroy()
 
         input_entry.bind("<Return>", send_msg)
-        chat_window.protocol("WM_DELETE_WINDOW", lambda: (session.close(), chat_window.destroy()))
-        session.gui_callback = log_chat
+        input_entry.bind("<Key>", lambda e: session.typing(), add="+")
+        chat_window.protocol("WM_DELETE_WINDOW", on_close)
+        backlog = session.attach(
+            log_chat,
+            lambda event, transfer: self.pump.post(on_file, event, transfer),
+            self.pump.threadsafe(on_typing))
+        if backlog:
+            write_chat(backlog)
+        for transfer in session.offers():
+            self.pump.post(on_file, "offer", transfer)
         session.start()
 
     def show_dark_popup(self, title, message, yes_text="Annehmen", no_text="Ablehnen"):
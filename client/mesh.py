@@ -0,0 +1,316 @@
+import random
+import threading
+import time
+from collections import deque
+from ..network.protocol import HEADER, MeshData, MeshHead, MeshNack, ProtocolV2
+
+# Raum-Nachrichten ohne Server-Relay. Der Urheber nummeriert seine Nachrichten
+# pro Raum und schickt sie an die Wurzel-Kinder eines Baums über die sortierte
+# Mitgliederliste (Wurzel = Urheber, MESH_FANOUT Kinder je Knoten); jeder Knoten
+# reicht neue Nachrichten an seine eigenen Kinder weiter. Empfänger liefern pro
+# Urheber in Reihenfolge aus, puffern Nachrichten hinter einer Lücke und fragen
+# die fehlenden per MESH_NACK direkt beim Urheber nach, der die letzten
+# MESH_HISTORY Nachrichten vorhält. Nach Nachrichten und wenn neue Mitglieder
+# dazukommen, schickt jeder spätestens nach HEAD_DELAY HEAD_REPEAT-mal ein
+# MESH_HEAD mit seiner letzten Nummer an alle; so fällt auch der Verlust der
+# letzten bzw. ersten Nachricht auf. Bleibt eine Lücke nach NACK_RETRIES
+# Nachfragen offen, wird sie übersprungen.
+
+MESH_FANOUT = 4
+MESH_HISTORY = 1024
+# Längere Nachrichten gehen über den Server, damit Datagramme nicht fragmentieren
+MESH_MAX_TEXT = 1200
+HEAD_DELAY = 0.2
+HEAD_REPEAT = 3
+NACK_INTERVAL = 0.05
+NACK_RETRIES = 8
+# Höchstzahl Nachrichten, die eine MESH_NACK anfordern kann
+NACK_RANGE = 64
+
+
+def parse_member(entry):
+    nick, ip, udp = entry.rsplit(":", 2)
+    return nick, (ip, int(udp))
+
+
+def tree_children(count, origin, own, fanout=MESH_FANOUT):
+    # Indizes der Kinder von own im Baum mit Wurzel origin
+    rel = (own - origin) % count
+    first = rel * fanout + 1
+    return [(origin + child) % count for child in range(first, min(first + fanout, count))]
+
+
+class MeshRoom:
+    __slots__ = ("epoch", "joined", "nicks", "addrs", "index", "seq", "sent", "head_due", "heads")
+
+    def __init__(self, epoch, addrs):
+        self.epoch = epoch
+        # Epoche unseres Beitritts; ab ihr nummerieren wir auch selbst
+        self.joined = epoch
+        self.addrs = addrs
+        self.nicks = sorted(addrs)
+        self.index = {nick: i for i, nick in enumerate(self.nicks)}
+        self.seq = 0
+        # (seq, text) der eigenen letzten Nachrichten für MESH_NACK
+        self.sent = deque(maxlen=MESH_HISTORY)
+        self.head_due = None
+        self.heads = 0
+
+    def children(self, origin, own):
+        i, j = self.index.get(origin), self.index.get(own)
+        if i is None or j is None:
+            return []
+        return [self.addrs[self.nicks[k]] for k in tree_children(len(self.nicks), i, j)]
+
+
+class OriginState:
+    # Empfangsstand für einen Urheber (Raum, Nick, Sitzung)
+    __slots__ = ("next", "high", "pending", "nack_at", "nacks")
+
+    def __init__(self, seq):
+        self.next = seq
+        self.high = seq - 1
+        self.pending = {}
+        self.nack_at = None
+        self.nacks = 0
+
+
+class MeshRouter:
+    def __init__(self, nick, send, deliver):
+        self.nick = nick
+        # send(data, addr) verschickt ein Datagramm; deliver(room, sender, text)
+        # wird unter dem Lock in Reihenfolge aufgerufen und darf nicht blockieren
+        self.send = send
+        self.deliver = deliver
+        # Zufällige Sitzung, damit Nummern nach einem Neustart nicht als Duplikate gelten
+        self.session = random.getrandbits(32)
+        self.rooms = {}
+        # (raum, urheber, sitzung) -> OriginState
+        self.origins = {}
+        self.lost = 0
+        self.repaired = 0
+        self.running = True
+        self.waiting = False
+        self.cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mesh", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def update(self, room, epoch, members):
+        # Aus ROOM_MESH; ohne Mitglieder (oder ohne uns) läuft der Raum über den Server
+        addrs = dict(parse_member(entry) for entry in members)
+        with self.cond:
+            current = self.rooms.get(room)
+            if current is not None and epoch < current.epoch:
+                return
+            if self.nick not in addrs:
+                self._forget(room)
+                return
+            state = MeshRoom(epoch, addrs)
+            if current is not None:
+                state.joined, state.seq, state.sent = current.joined, current.seq, current.sent
+                state.head_due, state.heads = current.head_due, current.heads
+                if not addrs.keys() <= current.addrs.keys():
+                    # Neue Mitglieder kennen unseren Stand noch nicht; ohne MESH_HEAD
+                    # fiele ihnen der Verlust unserer nächsten Nachricht nicht auf
+                    state.heads = HEAD_REPEAT
+                    if state.head_due is None:
+                        state.head_due = time.monotonic() + HEAD_DELAY
+                        if self.waiting:
+                            self.cond.notify()
+            self.rooms[room] = state
+            for key in [key for key in self.origins if key[0] == room and key[1] not in addrs]:
+                del self.origins[key]
+
+    def forget(self, room):
+        with self.cond:
+            self._forget(room)
+
+    def _forget(self, room):
+        self.rooms.pop(room, None)
+        for key in [key for key in self.origins if key[0] == room]:
+            del self.origins[key]
+
+    def active(self, room):
+        return room in self.rooms
+
+    def publish(self, room, text):
+        # False: Raum nicht im Mesh oder Nachricht zu lang, der Aufrufer nimmt den Server
+        if len(text.encode("utf-8")) > MESH_MAX_TEXT:
+            return False
+        with self.cond:
+            state = self.rooms.get(room)
+            if state is None:
+                return False
+            state.seq += 1
+            state.sent.append((state.seq, text))
+            data = ProtocolV2.encode(MeshData(room, self.nick, self.session, state.joined, state.seq, 1, text))
+            targets = state.children(self.nick, self.nick)
+            state.heads = HEAD_REPEAT
+            if state.head_due is None:
+                state.head_due = time.monotonic() + HEAD_DELAY
+                if self.waiting:
+                    self.cond.notify()
+            self.deliver(room, self.nick, text)
+        for addr in targets:
+            self._sendto(data, addr)
+        return True
+
+    def received(self, data, addr):
+        # Callback des UDPListenerThread für Mesh-Datagramme (mit Längenpräfix)
+        try:
+            msg = ProtocolV2.decode(memoryview(data)[HEADER.size:])
+        except ValueError:
+            return
+        if isinstance(msg, MeshData):
+            self._on_data(msg, data)
+        elif isinstance(msg, MeshHead):
+            self._on_head(msg)
+        elif isinstance(msg, MeshNack):
+            self._on_nack(msg, addr)
+
+    def _on_data(self, msg, data):
+        targets = ()
+        with self.cond:
+            state = self.rooms.get(msg.room)
+            if state is None or msg.origin not in state.addrs or msg.origin == self.nick:
+                return
+            origin = self._origin(state, msg, msg.seq)
+            seq = msg.seq
+            if seq < origin.next or seq in origin.pending:
+                return
+            if msg.relay:
+                targets = state.children(msg.origin, self.nick)
+            else:
+                self.repaired += 1
+            origin.high = max(origin.high, seq)
+            if seq == origin.next:
+                self.deliver(msg.room, msg.origin, msg.text)
+                origin.next += 1
+                self._drain(msg.room, msg.origin, origin)
+            else:
+                origin.pending[seq] = msg.text
+                self._gap(origin)
+        for target in targets:
+            self._sendto(data, target)
+
+    def _on_head(self, msg):
+        with self.cond:
+            state = self.rooms.get(msg.room)
+            if state is None or msg.origin not in state.addrs:
+                return
+            origin = self._origin(state, msg, msg.seq + 1)
+            if msg.seq > origin.high:
+                origin.high = msg.seq
+                self._gap(origin)
+
+    def _on_nack(self, msg, addr):
+        frames = []
+        with self.cond:
+            state = self.rooms.get(msg.room)
+            if state is None or msg.origin != self.nick or msg.session != self.session or not state.sent:
+                return
+            base = state.sent[0][0]
+            for seq in range(max(msg.first, base), min(msg.last, msg.first + NACK_RANGE - 1, state.seq) + 1):
+                frames.append(ProtocolV2.encode(
+                    MeshData(msg.room, self.nick, self.session, state.joined, seq, 0, state.sent[seq - base][1])))
+        for data in frames:
+            self._sendto(data, addr)
+
+    def _origin(self, state, msg, first):
+        key = (msg.room, msg.origin, msg.session)
+        origin = self.origins.get(key)
+        if origin is None:
+            # Erstes Datagramm dieses Urhebers. Nummeriert er erst seit unserem
+            # Beitritt, fehlt uns alles ab 1; sonst gilt Früheres als vor dem Beitritt.
+            origin = self.origins[key] = OriginState(1 if msg.since >= state.joined else first)
+        return origin
+
+    def _drain(self, room, nick, origin):
+        # Nach Fortschritt bei origin.next: Gepuffertes ausliefern, Nachfragen neu zählen
+        pending = origin.pending
+        while origin.next in pending:
+            self.deliver(room, nick, pending.pop(origin.next))
+            origin.next += 1
+        origin.nacks = 0
+        if origin.high < origin.next:
+            origin.nack_at = None
+
+    def _gap(self, origin):
+        if origin.nack_at is None and origin.high >= origin.next:
+            # Kurz warten: im Baum überholen sich Datagramme gelegentlich
+            origin.nack_at = time.monotonic() + NACK_INTERVAL
+            if self.waiting:
+                self.cond.notify()
+
+    def tick(self, now):
+        # Fällige MESH_HEADs und MESH_NACKs verschicken; liefert den nächsten Termin oder None
+        with self.cond:
+            sends, deadline = self._due(now)
+        for data, addr in sends:
+            self._sendto(data, addr)
+        return deadline
+
+    def _due(self, now):
+        sends = []
+        deadline = None
+        for room, state in self.rooms.items():
+            if state.head_due is None:
+                continue
+            if state.head_due <= now:
+                state.heads -= 1
+                state.head_due = now + HEAD_DELAY if state.heads > 0 else None
+                data = ProtocolV2.encode(MeshHead(room, self.nick, self.session, state.joined, state.seq))
+                sends.extend((data, addr) for nick, addr in state.addrs.items() if nick != self.nick)
+            if state.head_due is not None:
+                deadline = min(deadline or state.head_due, state.head_due)
+        for (room, nick, session), origin in self.origins.items():
+            if origin.nack_at is None:
+                continue
+            if origin.nack_at > now:
+                deadline = min(deadline or origin.nack_at, origin.nack_at)
+                continue
+            last = min(origin.pending) - 1 if origin.pending else origin.high
+            if origin.nacks >= NACK_RETRIES:
+                # Aufgeben: Lücke überspringen
+                self.lost += last - origin.next + 1
+                origin.next = last + 1
+                self._drain(room, nick, origin)
+                if origin.nack_at is None:
+                    continue
+                last = min(origin.pending) - 1 if origin.pending else origin.high
+                origin.nacks = 0
+            origin.nacks += 1
+            origin.nack_at = now + NACK_INTERVAL * origin.nacks
+            deadline = min(deadline or origin.nack_at, origin.nack_at)
+            addr = self.rooms[room].addrs.get(nick)
+            if addr is not None:
+                sends.append((ProtocolV2.encode(MeshNack(room, nick, session, origin.next, last)), addr))
+        return sends, deadline
+
+    def _sendto(self, data, addr):
+        try:
+            self.send(data, addr)
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    break
+                sends, deadline = self._due(time.monotonic())
+                if not sends:
+                    self.waiting = True
+                    self.cond.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+                    self.waiting = False
+                    continue
+            for data, addr in sends:
+                self._sendto(data, addr)
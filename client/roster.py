@@ -0,0 +1,190 @@
+import tkinter as tk
+import tkinter.font as tkfont
+from bisect import bisect_left
+
+# Nutzerliste des GUI-Clients. Roster hält nick -> UserRecord und die nach Nick
+# sortierten Schlüssel (casefold); Zeilenposition und Präfixsuche sind damit ein
+# bisect. RosterView zeigt davon nur die sichtbaren Zeilen im Listbox an und
+# ändert bei USER_JOINED/USER_LEFT nur die betroffene Zeile.
+
+
+class UserRecord:
+    __slots__ = ("nick", "ip", "udp_port")
+
+    def __init__(self, nick, ip, udp_port):
+        self.nick = nick
+        self.ip = ip
+        self.udp_port = udp_port
+
+    def label(self):
+        return f"{self.nick}:{self.ip}:{self.udp_port}"
+
+
+class Roster:
+    def __init__(self):
+        self.records = {}
+        # (nick.casefold(), nick), sortiert
+        self.keys = []
+        # listener(kind, index) mit kind "insert", "delete" (index in keys) oder "reset"
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, nick):
+        return nick in self.records
+
+    def get(self, nick):
+        return self.records.get(nick)
+
+    def at(self, index):
+        return self.records[self.keys[index][1]]
+
+    def prefix_range(self, prefix):
+        # [lo, hi) aller Nicks, die (ohne Groß-/Kleinschreibung) mit prefix beginnen
+        prefix = prefix.casefold()
+        return bisect_left(self.keys, (prefix,)), bisect_left(self.keys, (prefix + "\U0010ffff",))
+
+    def replace(self, records):
+        self.records = {record.nick: record for record in records}
+        self.keys = sorted((nick.casefold(), nick) for nick in self.records)
+        self._notify("reset", None)
+
+    def clear(self):
+        self.replace(())
+
+    def add(self, nick, ip, udp_port):
+        if nick in self.records:
+            self.remove(nick)
+        self.records[nick] = UserRecord(nick, ip, udp_port)
+        key = (nick.casefold(), nick)
+        index = bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self._notify("insert", index)
+
+    def remove(self, nick):
+        if self.records.pop(nick, None) is None:
+            return False
+        index = bisect_left(self.keys, (nick.casefold(), nick))
+        del self.keys[index]
+        self._notify("delete", index)
+        return True
+
+    def _notify(self, kind, index):
+        for listener in self.listeners:
+            listener(kind, index)
+
+
+class RosterView:
+    # Der Listbox enthält nur die Zeilen [offset, offset + rows) des gefilterten
+    # Bereichs [lo, hi); die Scrollbar wird von Hand auf die Gesamtlänge gesetzt.
+    def __init__(self, listbox, scrollbar, roster):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.roster = roster
+        self.prefix = ""
+        self.lo = self.hi = 0
+        self.offset = 0
+        self.rows = int(listbox.cget("height"))
+        self.line_height = tkfont.Font(font=listbox.cget("font")).metrics("linespace") + 1
+        roster.listeners.append(self.on_change)
+        scrollbar.config(command=self.on_scrollbar)
+        listbox.bind("<Configure>", self.on_resize)
+        listbox.bind("<MouseWheel>", lambda e: self.scroll(int(-1 * (e.delta / 120))))
+        listbox.bind("<Button-4>", lambda e: self.scroll(-1))  # Linux
+        listbox.bind("<Button-5>", lambda e: self.scroll(1))   # Linux
+        self.on_change("reset", None)
+
+    def total(self):
+        return self.hi - self.lo
+
+    def set_filter(self, prefix):
+        self.prefix = prefix.strip().casefold()
+        self.lo, self.hi = self.roster.prefix_range(self.prefix)
+        self.offset = 0
+        self.render()
+
+    def selected(self):
+        # UserRecord der aktiven Zeile oder None
+        if not self.listbox.size():
+            return None
+        index = self.lo + self.offset + self.listbox.index(tk.ACTIVE)
+        return self.roster.at(index) if index < self.hi else None
+
+    def on_change(self, kind, index):
+        if kind == "reset":
+            self.lo, self.hi = self.roster.prefix_range(self.prefix)
+            self.render()
+        elif kind == "insert":
+            key = self.roster.keys[index][0]
+            if key.startswith(self.prefix):
+                self.hi += 1
+                self._insert_row(index - self.lo)
+            elif key < self.prefix:
+                self.lo += 1
+                self.hi += 1
+        elif index < self.lo:
+            self.lo -= 1
+            self.hi -= 1
+        elif index < self.hi:
+            self.hi -= 1
+            self._delete_row(index - self.lo)
+
+    def _insert_row(self, row):
+        if row < self.offset:
+            # Sichtbarer Ausschnitt bleibt stehen
+            self.offset += 1
+        elif row < self.offset + self.rows:
+            self.listbox.insert(row - self.offset, self.roster.at(self.lo + row).label())
+            if self.listbox.size() > self.rows:
+                self.listbox.delete(self.rows)
+        self._update_scrollbar()
+
+    def _delete_row(self, row):
+        if row < self.offset:
+            self.offset -= 1
+        elif row < self.offset + self.rows:
+            self.listbox.delete(row - self.offset)
+            last = self.offset + self.rows - 1
+            if last < self.total():
+                self.listbox.insert(tk.END, self.roster.at(self.lo + last).label())
+            elif self.offset:
+                # Am Ende der Liste: eine Zeile zurückrücken statt Lücke
+                self.offset -= 1
+                self.listbox.insert(0, self.roster.at(self.lo + self.offset).label())
+        self._update_scrollbar()
+
+    def render(self):
+        self.offset = max(0, min(self.offset, self.total() - self.rows))
+        start = self.lo + self.offset
+        stop = min(start + self.rows, self.hi)
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *(self.roster.at(i).label() for i in range(start, stop)))
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        total = self.total()
+        if total <= self.rows:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.offset / total, (self.offset + self.rows) / total)
+
+    def scroll(self, units):
+        self.offset += units
+        self.render()
+        return "break"
+
+    def on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.offset = int(float(value) * self.total())
+        elif unit == "pages":
+            self.offset += int(value) * self.rows
+        else:
+            self.offset += int(value)
+        self.render()
+
+    def on_resize(self, event):
+        rows = max(1, event.height // self.line_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.render()
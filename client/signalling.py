@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+from ..network.protocol import Protocol
+
+# Zuverlässige Signalisierung über den UDP-Socket des Clients. Ausgehende
+# Nachrichten bekommen eine Anfrage-ID und werden mit wachsendem Abstand
+# (ACK_TIMEOUT, doppelt, vierfach, …) wiederholt, bis ein CHAT_ACK kommt; bleibt
+# auch die letzte von RETRIES Wiederholungen unbestätigt, gilt das Gegenüber als
+# nicht erreichbar (nach 50+100+200+400+800 ms ≈ 1,5 s).
+# Eingehende Nachrichten mit ID werden immer bestätigt, aber nur einmal
+# weitergereicht – Wiederholungen derselben (Adresse, ID) fallen weg.
+
+ACK_TIMEOUT = 0.05
+RETRIES = 4
+DUPLICATE_WINDOW = 30.0
+
+
+def read_request_id(cmd, args):
+    # Anfrage-ID einer zuverlässigen Nachricht oder None (ältere Clients, andere Befehle)
+    if cmd == "CHAT_REQUEST":
+        return Protocol.read_chat_request(args)[1]
+    if cmd == "CHAT_REJECTED":
+        return Protocol.read_chat_rejected(args)
+    return None
+
+
+class PendingSend:
+    __slots__ = ("addr", "data", "attempts", "deadline", "on_failed")
+
+    def __init__(self, addr, data, deadline, on_failed):
+        self.addr = addr
+        self.data = data
+        self.attempts = 0
+        self.deadline = deadline
+        self.on_failed = on_failed
+
+
+class Signalling:
+    def __init__(self, sock, dispatch, ack_timeout=ACK_TIMEOUT, retries=RETRIES):
+        self.sock = sock
+        # dispatch(cmd, addr, args) für jede neue (nicht doppelte) Nachricht
+        self.dispatch = dispatch
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        # Zufälliger Start, damit IDs nach einem Neustart nicht als Duplikate gelten
+        self.next_id = random.getrandbits(31)
+        # (addr, id) -> PendingSend
+        self.pending = {}
+        # (addr, id) -> Ablaufzeit, in Einfügereihenfolge
+        self.seen = {}
+        self.running = True
+        self.waiting = False
+        self.cond = threading.Condition()
+        self._thread = threading.Thread(target=self._retransmit_loop, name="signalling", daemon=True)
+        self._thread.start()
+
+    def send(self, addr, build, on_failed=None, request_id=None):
+        # build(request_id) -> Datagramm; on_failed() aus dem Signalisierungs-Thread,
+        # wenn nie eine Bestätigung kommt. Antworten (CHAT_REJECTED) übernehmen die
+        # ID der Anfrage, sonst wird eine neue vergeben. Gibt die ID zurück.
+        with self.cond:
+            if request_id is None:
+                request_id = self.next_id
+                self.next_id = (request_id + 1) & 0x7FFFFFFF
+            data = build(request_id)
+            self.pending[(addr, request_id)] = PendingSend(addr, data, time.monotonic() + self.ack_timeout, on_failed)
+            if self.waiting:
+                self.cond.notify()
+        self._sendto(data, addr)
+        return request_id
+
+    def cancel(self, addr, request_id):
+        with self.cond:
+            self.pending.pop((addr, request_id), None)
+
+    def received(self, cmd, addr, args):
+        # Callback des UDPListenerThread
+        try:
+            if cmd == "CHAT_ACK":
+                with self.cond:
+                    self.pending.pop((addr, Protocol.read_chat_ack(args)), None)
+                return
+            request_id = read_request_id(cmd, args)
+        except ValueError:
+            request_id = None
+        if request_id is not None:
+            self._sendto(Protocol.chat_ack(request_id), addr)
+            key = (addr, request_id)
+            now = time.monotonic()
+            with self.cond:
+                seen = self.seen
+                while seen:
+                    old, expires = next(iter(seen.items()))
+                    if expires > now:
+                        break
+                    del seen[old]
+                if key in seen:
+                    return
+                seen[key] = now + DUPLICATE_WINDOW
+        self.dispatch(cmd, addr, args)
+
+    def _sendto(self, data, addr):
+        try:
+            self.sock.sendto(data, addr)
+        except OSError:
+            pass
+
+    def _retransmit_loop(self):
+        while True:
+            due = []
+            failed = []
+            with self.cond:
+                if not self.running:
+                    break
+                now = time.monotonic()
+                for key, entry in list(self.pending.items()):
+                    if entry.deadline > now:
+                        continue
+                    if entry.attempts >= self.retries:
+                        del self.pending[key]
+                        failed.append(entry)
+                    else:
+                        entry.attempts += 1
+                        entry.deadline = now + self.ack_timeout * 2 ** entry.attempts
+                        due.append(entry)
+                if not due and not failed:
+                    timeout = min((e.deadline for e in self.pending.values()), default=None)
+                    self.waiting = True
+                    self.cond.wait(None if timeout is None else max(0.0, timeout - now))
+                    self.waiting = False
+                    continue
+            for entry in due:
+                self._sendto(entry.data, entry.addr)
+            for entry in failed:
+                if entry.on_failed:
+                    entry.on_failed()
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.pending.clear()
+            self.cond.notify()
@@ -0,0 +1,88 @@
+import queue
+from time import perf_counter
+
+# Übergabe von Netzwerk-Threads an den Tk-Mainloop. tkinter darf nur aus dem
+# Thread benutzt werden, der den Mainloop betreibt; Empfangs-Threads legen
+# deshalb nur Aufträge in eine Warteschlange, die der Mainloop einmal pro
+# Frame abarbeitet – höchstens BUDGET_MS lang, der Rest folgt im nächsten Frame.
+#
+# Innerhalb eines Durchlaufs werden Textzeilen je Ziel gesammelt und am Ende
+# mit einem einzigen Aufruf geschrieben; mit defer() angemeldete Funktionen
+# (z. B. Neuaufbau der Nutzerliste) laufen ebenfalls nur einmal am Ende.
+
+FRAME_MS = 16
+BUDGET_MS = 8
+
+
+class UIPump:
+    def __init__(self, root, frame_ms=FRAME_MS, budget_ms=BUDGET_MS):
+        self.root = root
+        self.frame_ms = frame_ms
+        self.budget = budget_ms / 1000
+        self.queue = queue.SimpleQueue()
+        # Nur Tk-Thread: gesammelte Zeilen je Ziel und ausstehende defer()-Aufrufe
+        self.lines = {}
+        self.deferred = {}
+        self._after = None
+
+    def start(self):
+        self._after = self.root.after(self.frame_ms, self._drain)
+
+    def stop(self):
+        if self._after is not None:
+            self.root.after_cancel(self._after)
+            self._after = None
+
+    def post(self, func, *args):
+        # Aus beliebigem Thread: func(*args) im Tk-Thread ausführen
+        self.queue.put((func, args))
+
+    def write(self, sink, line):
+        # Aus beliebigem Thread: Zeile an sink(lines) übergeben, gebündelt mit
+        # weiteren Zeilen für dasselbe Ziel
+        self.queue.put((None, (sink, line)))
+
+    def threadsafe(self, func):
+        return lambda *args: self.queue.put((func, args))
+
+    def defer(self, func):
+        # Nur Tk-Thread: func einmal am Ende des laufenden Durchlaufs aufrufen
+        self.deferred[func] = None
+
+    def _drain(self):
+        # Den nächsten Durchlauf gleich einplanen: Aufträge mit eigener
+        # Ereignisschleife (modale Dialoge) lassen Tk weiterlaufen, die Pumpe
+        # arbeitet dann verschachtelt weiter. Es ist immer genau ein after offen.
+        self._after = self.root.after(self.frame_ms, self._drain)
+        deadline = perf_counter() + self.budget
+        get = self.queue.get_nowait
+        try:
+            while perf_counter() < deadline:
+                try:
+                    func, args = get()
+                except queue.Empty:
+                    break
+                if func is None:
+                    sink, line = args
+                    pending = self.lines.get(sink)
+                    if pending is None:
+                        self.lines[sink] = [line]
+                    else:
+                        pending.append(line)
+                else:
+                    func(*args)
+        finally:
+            self.flush()
+            if not self.queue.empty() and self._after is not None:
+                # Liegt noch etwas an, gleich im nächsten Durchlauf weitermachen
+                self.root.after_cancel(self._after)
+                self._after = self.root.after(1, self._drain)
+
+    def flush(self):
+        while self.lines or self.deferred:
+            lines, self.lines = self.lines, {}
+            for sink, batch in lines.items():
+                sink(batch)
+            deferred, self.deferred = self.deferred, {}
+            for func in deferred:
+                func()
@@ -1,16 +1,91 @@
 import struct
 
+HEADER = struct.Struct("!I")
+
+
+class FrameDecoder:
+    # Zustandsbehafteter Decoder für längenpräfixierte Frames auf einem TCP-Stream.
+    # Daten landen per recv_into direkt in einem vorab allozierten bytearray,
+    # frames() liefert memoryviews auf die Nutzdaten ohne Zwischenkopien.
+    # Die memoryviews sind nur bis zum nächsten recv_into/feed gültig.
+    def __init__(self, size: int = 65536, max_frame: int = 16 << 20):
+        self.buffer = bytearray(max(size, HEADER.size))
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.max_frame = max_frame
+
+    def writable(self, hint: int = 0) -> memoryview:
+        # Freien Bereich am Ende liefern; vorher Reste nach vorne schieben
+        # bzw. den Puffer vergrößern, falls ein Frame nicht hineinpasst.
+        needed = max(hint, 1)
+        if self.end - self.start >= HEADER.size:
+            frame_len = HEADER.size + HEADER.unpack_from(self.buffer, self.start)[0]
+            needed = max(needed, frame_len - (self.end - self.start))
+        if len(self.buffer) - self.end < needed:
+            remaining = self.end - self.start
+            if remaining + needed > len(self.buffer):
+                buffer = bytearray(max(2 * len(self.buffer), remaining + needed))
+                buffer[:remaining] = self.view[self.start:self.end]
+                self.buffer = buffer
+                self.view = memoryview(buffer)
+            elif remaining:
+                self.buffer[:remaining] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, remaining
+        return self.view[self.end:]
+
+    def advance(self, nbytes: int) -> None:
+        self.end += nbytes
+
+    def recv_into(self, sock) -> int:
+        nbytes = sock.recv_into(self.writable())
+        self.end += nbytes
+        return nbytes
+
+    def feed(self, data: bytes) -> None:
+        self.writable(len(data))[:len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        view, unpack_from = self.view, HEADER.unpack_from
+        start, end = self.start, self.end
+        while end - start >= 4:
+            msg_len = unpack_from(view, start)[0]
+            if msg_len > self.max_frame:
+                raise ValueError(f"Frame zu groß: {msg_len} Bytes")
+            begin = start + 4
+            start = begin + msg_len
+            if start > end:
+                break
+            self.start = start
+            yield view[begin:start]
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def take(self, limit: int) -> memoryview:
+        # Bis zu limit bereits empfangene Bytes als Rohdaten entnehmen (Nutzdaten
+        # nach einem Frame, z. B. FILE_CHUNK); gültig bis zum nächsten recv_into/feed
+        n = min(limit, self.end - self.start)
+        view = self.view[self.start:self.start + n]
+        self.start += n
+        return view
+
+    def pending(self) -> bytes:
+        return bytes(self.view[self.start:self.end])
+
+
 class Protocol:
     @staticmethod
     def build_command(command: str, *args: str) -> bytes:
         message = f"{command} {' '.join(args)}"
         payload = message.encode('utf-8')
-        length_prefix = struct.pack("!I", len(payload))
+        length_prefix = HEADER.pack(len(payload))
         return length_prefix + payload
 
     @staticmethod
     def extract_command(byte_msg: bytes) -> tuple[str, list[str]]:
-        msg = byte_msg.decode('utf-8')
+        # str(...) statt .decode(), damit auch memoryviews aus dem FrameDecoder gehen
+        msg = str(byte_msg, 'utf-8')
         parts = msg.strip().split()
         if not parts:
             return None, []
@@ -18,23 +93,21 @@ class Protocol:
 
     @staticmethod
     def decode_stream(buffer: bytes) -> tuple[list[bytes], bytes]:
-        messages = []
-        offset = 0
-        while len(buffer) - offset >= 4:
-            msg_len = struct.unpack("!I", buffer[offset:offset + 4])[0]
-            if len(buffer) - offset - 4 < msg_len:
-                break
-            payload = buffer[offset + 4:offset + 4 + msg_len]
-            messages.append(payload)
-            offset += 4 + msg_len
-        return messages, buffer[offset:]
+        decoder = FrameDecoder(len(buffer))
+        decoder.feed(buffer)
+        messages = [bytes(payload) for payload in decoder.frames()]
+        return messages, decoder.pending()
 
     @staticmethod
-    def register(nick: str, udp_port: str) -> bytes:
+    def register(nick: str, udp_port: str, *caps: str) -> bytes:
+        if caps:
+            return Protocol.build_command("REGISTER", nick, udp_port, ",".join(caps))
         return Protocol.build_command("REGISTER", nick, udp_port)
 
     @staticmethod
-    def welcome(nick: str) -> bytes:
+    def welcome(nick: str, *caps: str) -> bytes:
+        if caps:
+            return Protocol.build_command("WELCOME", nick, ",".join(caps))
         return Protocol.build_command("WELCOME", nick)
 
     @staticmethod
@@ -49,6 +122,18 @@ class Protocol:
     def user_list(*entries: str) -> bytes:
         return Protocol.build_command("USERLIST", *entries)
 
+    @staticmethod
+    def user_list_page(epoch: int, version: int, more: bool, *entries: str) -> bytes:
+        return Protocol.build_command("USERLIST_PAGE", str(epoch), str(version), str(int(more)), *entries)
+
+    @staticmethod
+    def user_list_delta(epoch: int, base: int, version: int, *changes: str) -> bytes:
+        return Protocol.build_command("USERLIST_DELTA", str(epoch), str(base), str(version), *changes)
+
+    @staticmethod
+    def sync(epoch: int, version: int) -> bytes:
+        return Protocol.build_command("SYNC", str(epoch), str(version))
+
     @staticmethod
     def user_joined(nick: str, ip: str, udp: str) -> bytes:
         return Protocol.build_command("USER_JOINED", nick, ip, udp)
@@ -57,23 +142,92 @@ class Protocol:
     def user_left(nick: str) -> bytes:
         return Protocol.build_command("USER_LEFT", nick)
 
+    @staticmethod
+    def join(room: str) -> bytes:
+        return Protocol.build_command("JOIN", room)
+
+    @staticmethod
+    def part(room: str) -> bytes:
+        return Protocol.build_command("PART", room)
+
+    @staticmethod
+    def room_broadcast(room: str, nick: str, message: str) -> bytes:
+        return Protocol.build_command("ROOM_BROADCAST", room, nick, message)
+
+    @staticmethod
+    def room_members(room: str, *nicks: str) -> bytes:
+        return Protocol.build_command("ROOM_MEMBERS", room, *nicks)
+
+    @staticmethod
+    def room_joined(room: str, nick: str) -> bytes:
+        return Protocol.build_command("ROOM_JOINED", room, nick)
+
+    @staticmethod
+    def room_left(room: str, nick: str) -> bytes:
+        return Protocol.build_command("ROOM_LEFT", room, nick)
+
+    @staticmethod
+    def history(since: int, limit: int) -> bytes:
+        return Protocol.build_command("HISTORY", str(since), str(limit))
+
+    @staticmethod
+    def history_entry(seq: int, ts: int, nick: str, message: str) -> bytes:
+        return Protocol.build_command("HISTORY_ENTRY", str(seq), str(ts), nick, message)
+
+    @staticmethod
+    def history_end(more: bool) -> bytes:
+        return Protocol.build_command("HISTORY_END", str(int(more)))
+
+    @staticmethod
+    def resume(nick: str, token: str, seq: int, udp: str, *caps: str) -> bytes:
+        if caps:
+            return Protocol.build_command("RESUME", nick, token, str(seq), udp, ",".join(caps))
+        return Protocol.build_command("RESUME", nick, token, str(seq), udp)
+
+    @staticmethod
+    def session(token: str, seq: int, state: int) -> bytes:
+        return Protocol.build_command("SESSION", token, str(seq), str(state))
+
+    @staticmethod
+    def seq(seq: int) -> bytes:
+        return Protocol.build_command("SEQ", str(seq))
+
     @staticmethod
     def quit() -> bytes:
         return Protocol.build_command("QUIT")
 
+    # UDP-Signalisierung: CHAT_REQUEST und CHAT_REJECTED tragen optional eine
+    # Anfrage-ID; wer sie empfängt, bestätigt mit CHAT_ACK <id>
     @staticmethod
-    def chat_request(port: int) -> bytes:
-        return Protocol.build_command("CHAT_REQUEST", str(port))
+    def chat_request(port: int, request_id: int | None = None) -> bytes:
+        if request_id is None:
+            return Protocol.build_command("CHAT_REQUEST", str(port))
+        return Protocol.build_command("CHAT_REQUEST", str(port), str(request_id))
 
     @staticmethod
-    def chat_rejected() -> bytes:
-        return Protocol.build_command("CHAT_REJECTED")
+    def chat_rejected(request_id: int | None = None) -> bytes:
+        if request_id is None:
+            return Protocol.build_command("CHAT_REJECTED")
+        return Protocol.build_command("CHAT_REJECTED", str(request_id))
 
     @staticmethod
-    def read_register(args: list[str]) -> tuple[str, str]:
-        if len(args) != 2:
+    def chat_ack(request_id: int) -> bytes:
+        return Protocol.build_command("CHAT_ACK", str(request_id))
+
+    @staticmethod
+    def read_register(args: list[str]) -> tuple[str, str, list[str]]:
+        # Optionales drittes Argument: kommagetrennte Fähigkeiten (z. B. "v2")
+        if len(args) not in (2, 3):
             raise ValueError("REGISTER erwartet 2 Argumente: nickname, udp_port")
-        return args[0], args[1]
+        caps = args[2].split(",") if len(args) == 3 else []
+        return args[0], args[1], caps
+
+    @staticmethod
+    def read_welcome(args: list[str]) -> tuple[str, list[str]]:
+        if not args:
+            raise ValueError("WELCOME erwartet mindestens 1 Argument: nick")
+        caps = args[1].split(",") if len(args) > 1 else []
+        return args[0], caps
 
     @staticmethod
     def read_broadcast(args: list[str]) -> tuple[str, str]:
@@ -94,15 +248,26 @@ class Protocol:
         return args[0]
 
     @staticmethod
-    def read_chat_request(args: list[str]) -> int:
-        if len(args) != 1:
+    def read_chat_request(args: list[str]) -> tuple[int, int | None]:
+        # (tcp_port, anfrage_id); ältere Clients schicken keine ID
+        if len(args) not in (1, 2):
             raise ValueError("CHAT_REQUEST erwartet 1 Argument: port")
-        return int(args[0])
+        values = Protocol._read_ints("CHAT_REQUEST", args)
+        if values[0] > 0xFFFF:
+            raise ValueError(f"Ungültiger Port: {values[0]}")
+        return values[0], values[1] if len(values) == 2 else None
+
+    @staticmethod
+    def read_chat_rejected(args: list[str]) -> int | None:
+        if len(args) > 1:
+            raise ValueError("CHAT_REJECTED erwartet höchstens 1 Argument: anfrage_id")
+        return Protocol._read_ints("CHAT_REJECTED", args)[0] if args else None
 
     @staticmethod
-    def read_chat_rejected(args: list[str]) -> None:
-        if args:
-            raise ValueError("CHAT_REJECTED erwartet keine Argumente")
+    def read_chat_ack(args: list[str]) -> int:
+        if len(args) != 1:
+            raise ValueError("CHAT_ACK erwartet 1 Argument: anfrage_id")
+        return Protocol._read_ints("CHAT_ACK", args)[0]
 
     @staticmethod
     def read_user_list(args: list[str]) -> list[str]:
@@ -111,6 +276,106 @@ class Protocol:
                 raise ValueError(f"Ungültiger USERLIST-Eintrag: {entry}")
         return args
 
+    @staticmethod
+    def read_user_list_page(args: list[str]) -> tuple[int, int, bool, list[str]]:
+        if len(args) < 3:
+            raise ValueError("USERLIST_PAGE erwartet mindestens 3 Argumente: epoch, version, more")
+        epoch, version, more = Protocol._read_ints("USERLIST_PAGE", args[:3])
+        return epoch, version, bool(more), Protocol.read_user_list(args[3:])
+
+    @staticmethod
+    def read_user_list_delta(args: list[str]) -> tuple[int, int, int, list[str]]:
+        # Änderungen: "+nick:ip:udp" (beigetreten) oder "-nick" (verlassen)
+        if len(args) < 3:
+            raise ValueError("USERLIST_DELTA erwartet mindestens 3 Argumente: epoch, base, version")
+        epoch, base, version = Protocol._read_ints("USERLIST_DELTA", args[:3])
+        for change in args[3:]:
+            if change[:1] == "+":
+                Protocol.read_user_list([change[1:]])
+            elif change[:1] != "-" or ":" in change:
+                raise ValueError(f"Ungültige USERLIST_DELTA-Änderung: {change}")
+        return epoch, base, version, args[3:]
+
+    @staticmethod
+    def read_sync(args: list[str]) -> tuple[int, int]:
+        if len(args) != 2:
+            raise ValueError("SYNC erwartet 2 Argumente: epoch, version")
+        return Protocol._read_ints("SYNC", args)
+
+    @staticmethod
+    def _read_ints(command: str, args: list[str]) -> tuple[int, ...]:
+        if not all(arg.isdigit() for arg in args):
+            raise ValueError(f"{command} erwartet Zahlen: {' '.join(args)}")
+        return tuple(int(arg) for arg in args)
+
+    @staticmethod
+    def read_history(args: list[str]) -> tuple[int, int]:
+        # since = Zeitstempel in ms (0 = alles), limit = höchstens so viele der neuesten Einträge
+        if len(args) != 2:
+            raise ValueError("HISTORY erwartet 2 Argumente: since, limit")
+        return Protocol._read_ints("HISTORY", args)
+
+    @staticmethod
+    def read_history_entry(args: list[str]) -> tuple[int, int, str, str]:
+        if len(args) < 4:
+            raise ValueError("HISTORY_ENTRY erwartet mindestens 4 Argumente: seq, ts, sender, message")
+        seq, ts = Protocol._read_ints("HISTORY_ENTRY", args[:2])
+        return seq, ts, args[2], " ".join(args[3:])
+
+    @staticmethod
+    def read_history_end(args: list[str]) -> bool:
+        if len(args) != 1:
+            raise ValueError("HISTORY_END erwartet 1 Argument: more")
+        return bool(Protocol._read_ints("HISTORY_END", args)[0])
+
+    @staticmethod
+    def read_resume(args: list[str]) -> tuple[str, str, int, int, list[str]]:
+        if len(args) not in (4, 5):
+            raise ValueError("RESUME erwartet 4 Argumente: nickname, token, seq, udp_port")
+        seq, udp = Protocol._read_ints("RESUME", args[2:4])
+        if udp > 0xFFFF:
+            raise ValueError(f"Ungültiger UDP-Port: {udp}")
+        caps = args[4].split(",") if len(args) == 5 else []
+        return args[0], args[1], seq, udp, caps
+
+    @staticmethod
+    def read_session(args: list[str]) -> tuple[str, int, int]:
+        if len(args) != 3:
+            raise ValueError("SESSION erwartet 3 Argumente: token, seq, state")
+        return (args[0], *Protocol._read_ints("SESSION", args[1:]))
+
+    @staticmethod
+    def read_seq(args: list[str]) -> int:
+        if len(args) != 1:
+            raise ValueError("SEQ erwartet 1 Argument: seq")
+        return Protocol._read_ints("SEQ", args)[0]
+
+    @staticmethod
+    def read_room(args: list[str]) -> str:
+        # JOIN / PART
+        if len(args) != 1:
+            raise ValueError("JOIN/PART erwartet 1 Argument: raum")
+        return args[0]
+
+    @staticmethod
+    def read_room_broadcast(args: list[str]) -> tuple[str, str, str]:
+        if len(args) < 3:
+            raise ValueError("ROOM_BROADCAST erwartet mindestens 3 Argumente: raum, sender, message")
+        return args[0], args[1], " ".join(args[2:])
+
+    @staticmethod
+    def read_room_members(args: list[str]) -> tuple[str, list[str]]:
+        if not args:
+            raise ValueError("ROOM_MEMBERS erwartet mindestens 1 Argument: raum")
+        return args[0], args[1:]
+
+    @staticmethod
+    def read_room_event(args: list[str]) -> tuple[str, str]:
+        # ROOM_JOINED / ROOM_LEFT
+        if len(args) != 2:
+            raise ValueError("ROOM_JOINED/ROOM_LEFT erwartet 2 Argumente: raum, nick")
+        return args[0], args[1]
+
     @staticmethod
     def read_error(args: list[str]) -> str:
         return " ".join(args)
@@ -124,3 +389,680 @@ class Protocol:
         payload = data[4:4+length]
         return Protocol.extract_command(payload)
 
+
+
+# --- Protokoll v2 ---------------------------------------------------------
+# Wird beim REGISTER über die Fähigkeit "v2" ausgehandelt; danach laufen alle
+# Frames der Verbindung binär: 4-Byte-Länge, 1-Byte-Opcode, dann die Felder.
+# Für jeden Nachrichtentyp gibt es ein vorkompiliertes struct.Struct, das Opcode,
+# Ganzzahlen und die Längen aller Strings in einem Aufruf packt/entpackt.
+# Feldarten: s = String (u16-Länge), S = String (u32-Länge), H = u16, I = u32,
+#            Q = u64, L = Liste von Strings (u32-Anzahl, danach je eine u16-Länge)
+
+CAP_V2 = "v2"
+# Versioniertes Nutzerverzeichnis (USERLIST_PAGE/USERLIST_DELTA/SYNC statt USERLIST)
+CAP_DIR = "dir"
+# Sitzungen mit Token, SEQ-Nummern und RESUME nach Verbindungsabbruch
+CAP_RESUME = "resume"
+
+# SESSION-Zustände: neu angemeldet, fortgesetzt, fortgesetzt mit verlorenen Events
+SESSION_NEW, SESSION_RESUMED, SESSION_GAP = 0, 1, 2
+
+FIELD_CODES = {"s": "H", "S": "I", "H": "H", "I": "I", "Q": "Q", "L": "I"}
+INT_FIELDS = ("H", "I", "Q")
+
+MESSAGE_TYPES = {}
+OPCODES = {}
+
+
+class Message:
+    __slots__ = ()
+    command = None
+    opcode = None
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        codes = "".join(FIELD_CODES[kind] for _, kind in cls.fields)
+        cls.frame_struct = struct.Struct("!IB" + codes)
+        cls.head_struct = struct.Struct("!B" + codes)
+        MESSAGE_TYPES[cls.command] = cls
+        OPCODES[cls.opcode] = cls
+
+    def to_args(self) -> list[str]:
+        return [str(getattr(self, name)) for name, _ in self.fields]
+
+    @classmethod
+    def from_args(cls, args):
+        raise ValueError(f"{cls.command} ist im Textformat nicht erlaubt")
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name, _ in self.fields)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name, _ in self.fields)
+        return f"{type(self).__name__}({values})"
+
+
+class Register(Message):
+    __slots__ = ("nick", "udp_port", "caps")
+    command, opcode = "REGISTER", 0x01
+    fields = (("nick", "s"), ("udp_port", "H"), ("caps", "L"))
+
+    def __init__(self, nick, udp_port, caps=()):
+        self.nick = nick
+        self.udp_port = udp_port
+        self.caps = list(caps)
+
+    def to_args(self):
+        args = [self.nick, str(self.udp_port)]
+        if self.caps:
+            args.append(",".join(self.caps))
+        return args
+
+    @classmethod
+    def from_args(cls, args):
+        nick, udp, caps = Protocol.read_register(args)
+        if not udp.isdigit() or int(udp) > 0xFFFF:
+            raise ValueError(f"Ungültiger UDP-Port: {udp}")
+        return cls(nick, int(udp), caps)
+
+
+class Welcome(Message):
+    __slots__ = ("nick", "caps")
+    command, opcode = "WELCOME", 0x02
+    fields = (("nick", "s"), ("caps", "L"))
+
+    def __init__(self, nick, caps=()):
+        self.nick = nick
+        self.caps = list(caps)
+
+    def to_args(self):
+        return [self.nick, ",".join(self.caps)] if self.caps else [self.nick]
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_welcome(args))
+
+
+class Error(Message):
+    __slots__ = ("reason",)
+    command, opcode = "ERROR", 0x03
+    fields = (("reason", "S"),)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(Protocol.read_error(args))
+
+
+class Broadcast(Message):
+    __slots__ = ("sender", "text")
+    command, opcode = "BROADCAST", 0x04
+    fields = (("sender", "s"), ("text", "S"))
+
+    def __init__(self, sender, text):
+        self.sender = sender
+        self.text = text
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_broadcast(args))
+
+
+class UserList(Message):
+    __slots__ = ("entries",)
+    command, opcode = "USERLIST", 0x05
+    fields = (("entries", "L"),)
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+
+    def to_args(self):
+        return list(self.entries)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(Protocol.read_user_list(args))
+
+
+class UserJoined(Message):
+    __slots__ = ("nick", "ip", "udp_port")
+    command, opcode = "USER_JOINED", 0x06
+    fields = (("nick", "s"), ("ip", "s"), ("udp_port", "H"))
+
+    def __init__(self, nick, ip, udp_port):
+        self.nick = nick
+        self.ip = ip
+        self.udp_port = udp_port
+
+    @classmethod
+    def from_args(cls, args):
+        nick, ip, udp = Protocol.read_user_joined(args)
+        return cls(nick, ip, int(udp))
+
+
+class UserLeft(Message):
+    __slots__ = ("nick",)
+    command, opcode = "USER_LEFT", 0x07
+    fields = (("nick", "s"),)
+
+    def __init__(self, nick):
+        self.nick = nick
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(Protocol.read_user_left(args))
+
+
+class Quit(Message):
+    __slots__ = ()
+    command, opcode = "QUIT", 0x08
+    fields = ()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls()
+
+
+class UserListPage(Message):
+    __slots__ = ("epoch", "version", "more", "entries")
+    command, opcode = "USERLIST_PAGE", 0x09
+    fields = (("epoch", "Q"), ("version", "Q"), ("more", "H"), ("entries", "L"))
+
+    def __init__(self, epoch, version, more, entries):
+        self.epoch = epoch
+        self.version = version
+        self.more = int(more)
+        self.entries = list(entries)
+
+    def to_args(self):
+        return [str(self.epoch), str(self.version), str(self.more), *self.entries]
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_user_list_page(args))
+
+
+class UserListDelta(Message):
+    __slots__ = ("epoch", "base", "version", "changes")
+    command, opcode = "USERLIST_DELTA", 0x0A
+    fields = (("epoch", "Q"), ("base", "Q"), ("version", "Q"), ("changes", "L"))
+
+    def __init__(self, epoch, base, version, changes):
+        self.epoch = epoch
+        self.base = base
+        self.version = version
+        self.changes = list(changes)
+
+    def to_args(self):
+        return [str(self.epoch), str(self.base), str(self.version), *self.changes]
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_user_list_delta(args))
+
+
+class Sync(Message):
+    __slots__ = ("epoch", "version")
+    command, opcode = "SYNC", 0x0B
+    fields = (("epoch", "Q"), ("version", "Q"))
+
+    def __init__(self, epoch, version):
+        self.epoch = epoch
+        self.version = version
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_sync(args))
+
+
+class Join(Message):
+    __slots__ = ("room",)
+    command, opcode = "JOIN", 0x0C
+    fields = (("room", "s"),)
+
+    def __init__(self, room):
+        self.room = room
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(Protocol.read_room(args))
+
+
+class Part(Message):
+    __slots__ = ("room",)
+    command, opcode = "PART", 0x0D
+    fields = (("room", "s"),)
+
+    def __init__(self, room):
+        self.room = room
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(Protocol.read_room(args))
+
+
+class RoomBroadcast(Message):
+    __slots__ = ("room", "sender", "text")
+    command, opcode = "ROOM_BROADCAST", 0x0E
+    fields = (("room", "s"), ("sender", "s"), ("text", "S"))
+
+    def __init__(self, room, sender, text):
+        self.room = room
+        self.sender = sender
+        self.text = text
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_room_broadcast(args))
+
+
+class RoomMembers(Message):
+    __slots__ = ("room", "nicks")
+    command, opcode = "ROOM_MEMBERS", 0x0F
+    fields = (("room", "s"), ("nicks", "L"))
+
+    def __init__(self, room, nicks):
+        self.room = room
+        self.nicks = list(nicks)
+
+    def to_args(self):
+        return [self.room, *self.nicks]
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_room_members(args))
+
+
+class RoomJoined(Message):
+    __slots__ = ("room", "nick")
+    command, opcode = "ROOM_JOINED", 0x10
+    fields = (("room", "s"), ("nick", "s"))
+
+    def __init__(self, room, nick):
+        self.room = room
+        self.nick = nick
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_room_event(args))
+
+
+class RoomLeft(Message):
+    __slots__ = ("room", "nick")
+    command, opcode = "ROOM_LEFT", 0x11
+    fields = (("room", "s"), ("nick", "s"))
+
+    def __init__(self, room, nick):
+        self.room = room
+        self.nick = nick
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_room_event(args))
+
+
+class History(Message):
+    __slots__ = ("since", "limit")
+    command, opcode = "HISTORY", 0x12
+    fields = (("since", "Q"), ("limit", "I"))
+
+    def __init__(self, since, limit):
+        self.since = since
+        self.limit = limit
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_history(args))
+
+
+class HistoryEntry(Message):
+    __slots__ = ("seq", "ts", "sender", "text")
+    command, opcode = "HISTORY_ENTRY", 0x13
+    fields = (("seq", "Q"), ("ts", "Q"), ("sender", "s"), ("text", "S"))
+
+    def __init__(self, seq, ts, sender, text):
+        self.seq = seq
+        self.ts = ts
+        self.sender = sender
+        self.text = text
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_history_entry(args))
+
+
+class HistoryEnd(Message):
+    __slots__ = ("more",)
+    command, opcode = "HISTORY_END", 0x14
+    fields = (("more", "H"),)
+
+    def __init__(self, more):
+        self.more = int(more)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(Protocol.read_history_end(args))
+
+
+class Resume(Message):
+    __slots__ = ("nick", "token", "seq", "udp_port", "caps")
+    command, opcode = "RESUME", 0x15
+    fields = (("nick", "s"), ("token", "s"), ("seq", "Q"), ("udp_port", "H"), ("caps", "L"))
+
+    def __init__(self, nick, token, seq, udp_port, caps=()):
+        self.nick = nick
+        self.token = token
+        self.seq = seq
+        self.udp_port = udp_port
+        self.caps = list(caps)
+
+    def to_args(self):
+        args = [self.nick, self.token, str(self.seq), str(self.udp_port)]
+        if self.caps:
+            args.append(",".join(self.caps))
+        return args
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_resume(args))
+
+
+class Session(Message):
+    __slots__ = ("token", "seq", "state")
+    command, opcode = "SESSION", 0x16
+    fields = (("token", "s"), ("seq", "Q"), ("state", "H"))
+
+    def __init__(self, token, seq, state):
+        self.token = token
+        self.seq = seq
+        self.state = state
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(*Protocol.read_session(args))
+
+
+class Seq(Message):
+    # Steht vor jedem verteilten Event an Clients mit "resume"
+    __slots__ = ("seq",)
+    command, opcode = "SEQ", 0x17
+    fields = (("seq", "Q"),)
+
+    def __init__(self, seq):
+        self.seq = seq
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(Protocol.read_seq(args))
+
+
+# --- Private P2P-Verbindungen ----------------------------------------------
+# Zwischen zwei Clients immer im v2-Format. Beide Seiten schicken zuerst
+# P2P_HELLO. Auf FILE_CHUNK folgen direkt `length` rohe Dateibytes (kein Frame),
+# damit der Sender sie per sendfile aus der Datei schreiben kann.
+
+CAP_FILE = "file"
+# Beantwortet P2P_PING bzw. versteht P2P_TYPING; nur dann wird beides gesendet
+CAP_PING = "ping"
+CAP_TYPING = "typing"
+
+
+class P2PHello(Message):
+    __slots__ = ("nick", "caps")
+    command, opcode = "P2P_HELLO", 0x60
+    fields = (("nick", "s"), ("caps", "L"))
+
+    def __init__(self, nick, caps=()):
+        self.nick = nick
+        self.caps = list(caps)
+
+
+class P2PMessage(Message):
+    __slots__ = ("text",)
+    command, opcode = "P2P_MSG", 0x61
+    fields = (("text", "S"),)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class P2PBye(Message):
+    __slots__ = ()
+    command, opcode = "P2P_BYE", 0x62
+
+
+class FileOffer(Message):
+    __slots__ = ("file_id", "name", "size")
+    command, opcode = "FILE_OFFER", 0x63
+    fields = (("file_id", "I"), ("name", "s"), ("size", "Q"))
+
+    def __init__(self, file_id, name, size):
+        self.file_id = file_id
+        self.name = name
+        self.size = size
+
+
+class FileAccept(Message):
+    # offset = so viele Bytes hat der Empfänger schon (Fortsetzen)
+    __slots__ = ("file_id", "offset")
+    command, opcode = "FILE_ACCEPT", 0x64
+    fields = (("file_id", "I"), ("offset", "Q"))
+
+    def __init__(self, file_id, offset):
+        self.file_id = file_id
+        self.offset = offset
+
+
+class FileChunk(Message):
+    __slots__ = ("file_id", "offset", "length")
+    command, opcode = "FILE_CHUNK", 0x65
+    fields = (("file_id", "I"), ("offset", "Q"), ("length", "I"))
+
+    def __init__(self, file_id, offset, length):
+        self.file_id = file_id
+        self.offset = offset
+        self.length = length
+
+
+class FileProgress(Message):
+    # Empfänger -> Sender: bis offset geschrieben
+    __slots__ = ("file_id", "offset")
+    command, opcode = "FILE_PROGRESS", 0x66
+    fields = (("file_id", "I"), ("offset", "Q"))
+
+    def __init__(self, file_id, offset):
+        self.file_id = file_id
+        self.offset = offset
+
+
+class FileCancel(Message):
+    # outgoing = 1, wenn der Absender dieses Frames die Datei sendet
+    __slots__ = ("file_id", "outgoing", "reason")
+    command, opcode = "FILE_CANCEL", 0x67
+    fields = (("file_id", "I"), ("outgoing", "H"), ("reason", "s"))
+
+    def __init__(self, file_id, outgoing, reason):
+        self.file_id = file_id
+        self.outgoing = outgoing
+        self.reason = reason
+
+
+class P2PPing(Message):
+    # Lebenszeichen für ruhende Verbindungen; das Gegenüber antwortet mit P2P_PONG
+    __slots__ = ("nonce",)
+    command, opcode = "P2P_PING", 0x68
+    fields = (("nonce", "I"),)
+
+    def __init__(self, nonce):
+        self.nonce = nonce
+
+
+class P2PPong(Message):
+    __slots__ = ("nonce",)
+    command, opcode = "P2P_PONG", 0x69
+    fields = (("nonce", "I"),)
+
+    def __init__(self, nonce):
+        self.nonce = nonce
+
+
+class P2PTyping(Message):
+    __slots__ = ()
+    command, opcode = "P2P_TYPING", 0x6A
+
+
+# --- Raum-Mesh ---------------------------------------------------------------
+# Kleine Räume verteilen ROOM_BROADCAST ohne den Server: Der Server schickt nur
+# ROOM_MESH (Mitglieder mit UDP-Adresse, Epoche der Mitgliedschaft), die Clients
+# reichen MESH_DATA als v2-Datagramm (mit Längenpräfix) über einen Baum weiter.
+# Leere Mitgliederliste = Raum läuft wieder über den Server.
+
+CAP_MESH = "mesh"
+
+
+class RoomMesh(Message):
+    # members: "nick:ip:udp"
+    __slots__ = ("room", "epoch", "members")
+    command, opcode = "ROOM_MESH", 0x70
+    fields = (("room", "s"), ("epoch", "Q"), ("members", "L"))
+
+    def __init__(self, room, epoch, members):
+        self.room = room
+        self.epoch = epoch
+        self.members = list(members)
+
+
+class MeshData(Message):
+    # since = Epoche, ab der der Urheber im Raum nummeriert (seq 1); relay = 1:
+    # Empfänger reicht an seine Kinder im Baum weiter, 0 = Reparatur
+    __slots__ = ("room", "origin", "session", "since", "seq", "relay", "text")
+    command, opcode = "MESH_DATA", 0x71
+    fields = (("room", "s"), ("origin", "s"), ("session", "I"), ("since", "Q"), ("seq", "Q"),
+              ("relay", "H"), ("text", "S"))
+
+    def __init__(self, room, origin, session, since, seq, relay, text):
+        self.room = room
+        self.origin = origin
+        self.session = session
+        self.since = since
+        self.seq = seq
+        self.relay = relay
+        self.text = text
+
+
+class MeshNack(Message):
+    # An den Urheber: bitte first..last (einschließlich) noch einmal
+    __slots__ = ("room", "origin", "session", "first", "last")
+    command, opcode = "MESH_NACK", 0x72
+    fields = (("room", "s"), ("origin", "s"), ("session", "I"), ("first", "Q"), ("last", "Q"))
+
+    def __init__(self, room, origin, session, first, last):
+        self.room = room
+        self.origin = origin
+        self.session = session
+        self.first = first
+        self.last = last
+
+
+class MeshHead(Message):
+    # Letzte vergebene Nummer des Urhebers, damit auch verlorene letzte Nachrichten auffallen
+    __slots__ = ("room", "origin", "session", "since", "seq")
+    command, opcode = "MESH_HEAD", 0x73
+    fields = (("room", "s"), ("origin", "s"), ("session", "I"), ("since", "Q"), ("seq", "Q"))
+
+    def __init__(self, room, origin, session, since, seq):
+        self.room = room
+        self.origin = origin
+        self.session = session
+        self.since = since
+        self.seq = seq
+
+
+# Opcodes der Mesh-Datagramme; Text-Befehle beginnen mit einem Großbuchstaben
+MESH_OPCODES = frozenset((MeshData.opcode, MeshNack.opcode, MeshHead.opcode))
+
+
+# Nachrichten, die nur an die Mitglieder eines Raums gehen
+ROOM_EVENTS = (RoomBroadcast, RoomJoined, RoomLeft)
+
+
+class TextCodec:
+    # Bisheriges Textformat "KOMMANDO arg1 arg2 ..." für alte Gegenstellen
+    name = "v1"
+
+    @staticmethod
+    def encode(msg: Message) -> bytes:
+        return Protocol.build_command(msg.command, *msg.to_args())
+
+    @staticmethod
+    def decode(payload) -> Message | None:
+        cmd, args = Protocol.extract_command(payload)
+        cls = MESSAGE_TYPES.get(cmd)
+        if cls is None:
+            return None
+        return cls.from_args(args)
+
+
+class ProtocolV2:
+    name = CAP_V2
+
+    @staticmethod
+    def encode(msg: Message) -> bytes:
+        cls = type(msg)
+        values = []
+        blobs = []
+        for name, kind in cls.fields:
+            value = getattr(msg, name)
+            if kind in INT_FIELDS:
+                values.append(value)
+            elif kind == "L":
+                encoded = [entry.encode("utf-8") for entry in value]
+                values.append(len(encoded))
+                blobs.append(struct.pack(f"!{len(encoded)}H", *map(len, encoded)))
+                blobs.extend(encoded)
+            else:
+                data = value.encode("utf-8")
+                values.append(len(data))
+                blobs.append(data)
+        body = b"".join(blobs)
+        return cls.frame_struct.pack(cls.head_struct.size + len(body), cls.opcode, *values) + body
+
+    @staticmethod
+    def decode(payload) -> Message | None:
+        if not payload:
+            return None
+        cls = OPCODES.get(payload[0])
+        if cls is None:
+            return None
+        try:
+            values = list(cls.head_struct.unpack_from(payload))
+            pos = cls.head_struct.size
+            for i, (_, kind) in enumerate(cls.fields, 1):
+                if kind in INT_FIELDS:
+                    continue
+                if kind == "L":
+                    count = values[i]
+                    lengths = struct.unpack_from(f"!{count}H", payload, pos)
+                    pos += 2 * count
+                    entries = []
+                    for length in lengths:
+                        entries.append(str(payload[pos:pos + length], "utf-8"))
+                        pos += length
+                    values[i] = entries
+                else:
+                    length = values[i]
+                    values[i] = str(payload[pos:pos + length], "utf-8")
+                    pos += length
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f"Ungültiger {cls.command}-Frame: {e}")
+        if pos != len(payload):
+            raise ValueError(f"Ungültige Länge im {cls.command}-Frame")
+        return cls(*values[1:])
+
+
+CODECS = {TextCodec.name: TextCodec, ProtocolV2.name: ProtocolV2}
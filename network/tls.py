@@ -0,0 +1,206 @@
+import socket
+import ssl
+import threading
+
+# Optionales TLS für die Verbindung Client <-> Server. Verschlüsselt wird über
+# ssl.MemoryBIO (TLSChannel), damit der Handshake dort laufen kann, wo er den
+# Rest nicht aufhält: im Thread des Clients bzw. im Handshake-Pool der
+# asyncio-Engine. Der Server verschickt nach jedem Handshake Session-Tickets;
+# Clients geben beim nächsten Verbinden das letzte Ticket mit (TLSClient) und
+# sparen sich so Zertifikat und Signatur. Nach einem Neustart des Servers sind
+# die Tickets ungültig (die Ticket-Schlüssel lassen sich mit ssl nicht setzen),
+# dann gibt es wieder volle Handshakes.
+
+HANDSHAKE_TIMEOUT = 10.0
+RECV_SIZE = 65536
+
+
+def server_context(certfile, keyfile=None):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def client_context(cafile=None, verify=True):
+    # cafile: z. B. das selbstsignierte Zertifikat des Servers; sonst System-CAs
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    if cafile:
+        context.load_verify_locations(cafile)
+    else:
+        context.load_default_certs()
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class TLSClient:
+    # Kontext und letzte Sitzung eines Clients; der Aufrufer reicht ihn wie das
+    # Verzeichnis über Reconnects hinweg weiter
+    def __init__(self, context, server_hostname=None):
+        self.context = context
+        self.server_hostname = server_hostname
+        self.session = None
+        self.full = 0
+        self.resumed = 0
+
+    def channel(self, host):
+        return TLSChannel(self.context, False, self.server_hostname or host, self.session)
+
+    def remember(self, channel):
+        # Nach der ersten Antwort des Servers: die Tickets sind dann angekommen
+        session = channel.obj.session
+        if session is not None and session.has_ticket:
+            self.session = session
+
+
+class TLSChannel:
+    # TLS ohne eigenes I/O: verschlüsselte Bytes rein (step/decrypt), Klartext raus,
+    # ausgehende verschlüsselte Bytes über outgoing()
+    def __init__(self, context, server_side, server_hostname=None, session=None):
+        self.incoming = ssl.MemoryBIO()
+        self.out = ssl.MemoryBIO()
+        self.obj = context.wrap_bio(self.incoming, self.out, server_side, server_hostname, session=session)
+        self.established = False
+
+    def step(self, data=b""):
+        # Handshake fortsetzen; True, sobald er fertig ist. Gibt für OpenSSL den GIL frei,
+        # kann also in einem Pool-Thread laufen (nie zwei Schritte gleichzeitig)
+        if data:
+            self.incoming.write(data)
+        try:
+            self.obj.do_handshake()
+        except ssl.SSLWantReadError:
+            return False
+        self.established = True
+        return True
+
+    def decrypt(self, data, buffer=None):
+        # Klartext zu data; b"" bzw. 0 Bytes, solange ein Record unvollständig ist.
+        # Mit buffer wird hineingeschrieben und die Anzahl geliefert.
+        # SSLZeroReturnError = Gegenstelle hat die Verbindung geordnet beendet.
+        if data:
+            self.incoming.write(data)
+        if buffer is not None:
+            try:
+                return self.obj.read(len(buffer), buffer)
+            except ssl.SSLWantReadError:
+                return 0
+        chunks = []
+        while True:
+            try:
+                chunk = self.obj.read(RECV_SIZE)
+            except ssl.SSLWantReadError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def encrypt(self, data):
+        self.obj.write(data)
+        return self.out.read()
+
+    def outgoing(self):
+        return self.out.read()
+
+    @property
+    def resumed(self):
+        return self.obj.session_reused
+
+
+class TLSSocket:
+    # Blockierende, socket-ähnliche Hülle für Threads (Server-Engine "threaded",
+    # ChatCore). Lesen und Schreiben dürfen aus verschiedenen Threads kommen:
+    # SSL-Aufrufe laufen unter lock, ausgehende Bytes werden unter send_lock
+    # abgeholt und gesendet, damit ihre Reihenfolge erhalten bleibt.
+    def __init__(self, sock, channel):
+        self.sock = sock
+        self.channel = channel
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+
+    def handshake(self, timeout=HANDSHAKE_TIMEOUT):
+        channel = self.channel
+        self.sock.settimeout(timeout)
+        data = b""
+        while not channel.step(data):
+            self._flush()
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                raise OSError("Verbindung während des TLS-Handshakes beendet")
+        self._flush()
+        self.sock.settimeout(None)
+
+    def _flush(self):
+        with self.send_lock:
+            with self.lock:
+                data = self.channel.outgoing()
+            if data:
+                self.sock.sendall(data)
+
+    def recv_into(self, buffer):
+        while True:
+            with self.lock:
+                try:
+                    n = self.channel.decrypt(b"", buffer)
+                except ssl.SSLZeroReturnError:
+                    return 0
+                pending = self.channel.out.pending
+            if pending:
+                self._flush()
+            if n:
+                return n
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                return 0
+            with self.lock:
+                self.channel.incoming.write(data)
+
+    def recv(self, size):
+        buffer = bytearray(size)
+        n = self.recv_into(buffer)
+        return bytes(buffer[:n])
+
+    def sendall(self, data):
+        with self.send_lock:
+            with self.lock:
+                data = self.channel.encrypt(data)
+            self.sock.sendall(data)
+
+    def sendmsg(self, buffers):
+        # Für send_frames: alle Frames in einem TLS-Schreibvorgang
+        data = b"".join(buffers)
+        self.sendall(data)
+        return len(data)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def getpeername(self):
+        return self.sock.getpeername()
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+
+def connect(address, tls, timeout=None):
+    # TCP-Verbindung mit TLS-Handshake; tls ist ein TLSClient
+    sock = socket.create_connection(address, timeout=timeout)
+    try:
+        conn = TLSSocket(sock, tls.channel(address[0]))
+        conn.handshake(timeout or HANDSHAKE_TIMEOUT)
+        sock.settimeout(timeout)
+    except OSError:
+        sock.close()
+        raise
+    if conn.channel.resumed:
+        tls.resumed += 1
+    else:
+        tls.full += 1
+    return conn
@@ -0,0 +1,281 @@
+import asyncio
+import os
+import socket
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter_ns
+from ..network.protocol import FrameDecoder
+from ..network.tls import HANDSHAKE_TIMEOUT, RECV_SIZE, TLSChannel
+from .server import ChatServer, Client
+
+
+class StreamConn:
+    # Socket-ähnliche Hülle um einen asyncio-Transport, damit Client und die
+    # Befehlsverarbeitung von ChatServer unverändert weiterlaufen.
+    def __init__(self, transport):
+        self.transport = transport
+
+    def sendall(self, data):
+        if not self.transport.is_closing():
+            self.transport.write(data)
+
+    def send_frames(self, frames):
+        if not self.transport.is_closing():
+            self.transport.writelines(frames)
+
+    def getpeername(self):
+        return self.transport.get_extra_info("peername")
+
+    def shutdown(self, how):
+        self.transport.abort()
+
+    def close(self):
+        self.transport.close()
+
+
+class TLSStreamConn(StreamConn):
+    # Wie StreamConn, verschlüsselt aber über den TLSChannel der Verbindung
+    def __init__(self, transport, channel):
+        super().__init__(transport)
+        self.channel = channel
+
+    def sendall(self, data):
+        if not self.transport.is_closing():
+            self.transport.write(self.channel.encrypt(data))
+
+    def send_frames(self, frames):
+        if not self.transport.is_closing():
+            self.transport.write(self.channel.encrypt(b"".join(frames)))
+
+
+class ChatConnection(asyncio.BufferedProtocol):
+    # BufferedProtocol: asyncio liest per recv_into direkt in den Puffer des FrameDecoders.
+    def __init__(self, server):
+        self.server = server
+        self.client = None
+        self.decoder = FrameDecoder()
+        self.paused = False
+        self.closed = False
+        # Nur mit TLS: verschlüsselte Bytes landen erst in raw, Handshake-Schritte
+        # laufen ggf. im Pool des Servers, was währenddessen ankommt, wartet in backlog
+        self.tls = None
+        self.raw = None
+        self.stepping = False
+        self.backlog = []
+        self.timer = None
+
+    def connection_made(self, transport):
+        peer = transport.get_extra_info("peername")
+        self.transport = transport
+        if self.server.tls is not None:
+            self.tls = TLSChannel(self.server.tls, True)
+            self.raw = memoryview(bytearray(RECV_SIZE))
+            self.timer = asyncio.get_running_loop().call_later(HANDSHAKE_TIMEOUT, self.handshake_timeout)
+            conn = TLSStreamConn(transport, self.tls)
+        else:
+            conn = StreamConn(transport)
+        self.client = Client(conn, peer[0], self.server.policy, self.server.metrics)
+        self.server.metrics.accepted.inc()
+        # Writer: Frames bleiben in der Client-Queue, solange der Transport
+        # Backpressure meldet (pause_writing), und werden danach gesammelt geschrieben.
+        self.client.queue.listener = self.flush
+        if self.server.verbose:
+            print(f"[NEW CONNECTION] {peer}")
+
+    def flush(self):
+        if self.paused:
+            return
+        frames = self.client.queue.take(block=False)
+        if frames:
+            if self.server.span_hooks:
+                started = perf_counter_ns()
+                self.client.conn.send_frames(frames)
+                self.server.span("send", started)
+            else:
+                self.client.conn.send_frames(frames)
+        if self.client.queue.closed:
+            self.client.conn.close()
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.flush()
+
+    def get_buffer(self, sizehint):
+        if self.tls is not None:
+            return self.raw
+        return self.decoder.writable()
+
+    def buffer_updated(self, nbytes):
+        if self.closed:
+            return
+        if self.tls is None:
+            self.decoder.advance(nbytes)
+        elif not self.tls.established or self.stepping:
+            self.backlog.append(bytes(self.raw[:nbytes]))
+            if not self.stepping:
+                self.handshake_step()
+            return
+        elif not self.decrypt(self.raw[:nbytes]):
+            return
+        self.process()
+
+    def decrypt(self, data):
+        try:
+            plain = self.tls.decrypt(data)
+        except ssl.SSLZeroReturnError:
+            self.transport.close()
+            return False
+        except ssl.SSLError:
+            self.server.metrics.dropped.inc()
+            self.client.kick()
+            return False
+        out = self.tls.outgoing()
+        if out:
+            self.transport.write(out)
+        if not plain:
+            return False
+        self.decoder.feed(plain)
+        return True
+
+    def handshake_step(self):
+        # Die teuren Handshake-Schritte (Signatur, Schlüsseltausch) laufen im Pool;
+        # die Eventloop bedient solange die übrigen Verbindungen
+        data = b"".join(self.backlog)
+        self.backlog.clear()
+        pool = self.server.handshake_pool
+        if pool is None:
+            try:
+                done = self.tls.step(data)
+            except OSError:
+                self.transport.abort()
+                return
+            self.handshake_progress(done)
+            return
+        self.stepping = True
+        future = asyncio.get_running_loop().run_in_executor(pool, self.tls.step, data)
+        future.add_done_callback(self.handshake_stepped)
+
+    def handshake_stepped(self, future):
+        self.stepping = False
+        if self.closed:
+            return
+        try:
+            done = future.result()
+        except OSError:
+            self.transport.abort()
+            return
+        self.handshake_progress(done)
+
+    def handshake_progress(self, done):
+        out = self.tls.outgoing()
+        if out:
+            self.transport.write(out)
+        if not done:
+            if self.backlog:
+                self.handshake_step()
+            return
+        self.timer.cancel()
+        self.server.metrics.tls_handshakes.inc("resumed" if self.tls.resumed else "full")
+        # Der letzte Schritt kann schon Anwendungsdaten mitgebracht haben
+        data = b"".join(self.backlog)
+        self.backlog.clear()
+        if self.decrypt(data):
+            self.process()
+
+    def handshake_timeout(self):
+        if not self.tls.established and not self.closed:
+            self.transport.abort()
+
+    def process(self):
+        try:
+            for raw in self.decoder.frames():
+                if not self.server.handle_frame(self.client, raw):
+                    self.connection_lost(None)
+                    return
+        except ValueError:
+            self.server.metrics.dropped.inc()
+            self.client.kick()
+
+    def connection_lost(self, exc):
+        if self.closed:
+            return
+        self.closed = True
+        if self.tls is not None and not self.tls.established:
+            self.timer.cancel()
+            self.server.metrics.tls_handshakes.inc("failed")
+        self.server.metrics.closed.inc()
+        self.server.drop_client(self.client)
+        self.flush()
+
+
+class AsyncChatServer(ChatServer):
+    # Alle Client-Verbindungen laufen auf einer einzigen asyncio-Eventloop
+    # statt auf einem Thread pro Verbindung.
+    def __init__(self, host='0.0.0.0', port=9000, policy=None):
+        super().__init__(host, port, policy)
+        self._loop = None
+        self._server = None
+        self._stopped = None
+        self.handshake_pool = None
+
+    def start(self):
+        self.running = True
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        self._sock = self.make_listener()
+        self._server = await self._loop.create_server(
+            lambda: ChatConnection(self), sock=self._sock, backlog=socket.SOMAXCONN)
+
+        print(f"[SERVER] Listening on {self.host}:{self.port} (asyncio)")
+        if not self.running:
+            self._stopped.set()
+        await self._stopped.wait()
+        self._server.close()
+        self.cleanup()
+        await asyncio.sleep(0)
+
+    def enable_tls(self, certfile, keyfile=None, workers=None):
+        # Handshakes laufen in einem Thread-Pool neben der Eventloop; OpenSSL gibt
+        # dabei den GIL frei. Mit nur einem Kern bringt das nichts, dann (oder mit
+        # workers=0) laufen sie direkt auf der Eventloop.
+        super().enable_tls(certfile, keyfile)
+        if workers is None:
+            workers = (os.cpu_count() or 1) - 1
+        if workers > 0:
+            self.handshake_pool = ThreadPoolExecutor(workers, thread_name_prefix="tls-handshake")
+
+    def call_soon(self, func, *args):
+        # Alles, was Clients berührt, muss auf der Eventloop laufen
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def make_listener(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
+        return sock
+
+    def shutdown(self):
+        self.running = False
+        if self._loop is not None and self._stopped is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass
+
+
+ENGINES = {
+    "threaded": ChatServer,
+    "async": AsyncChatServer,
+}
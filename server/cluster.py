@@ -0,0 +1,266 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+from ..network.protocol import (
+    ROOM_EVENTS, Broadcast, Error, FrameDecoder, Message, ProtocolV2, UserJoined, UserLeft,
+)
+from .async_server import AsyncChatServer
+
+# Mehrkern-Modus: N Worker-Prozesse teilen sich den Port per SO_REUSEPORT.
+# Der Elternprozess betreibt einen Bus (Unix-Domain-Socket), über den die Worker
+# Nicknames reservieren und BROADCAST/USER_JOINED/USER_LEFT sowie Raum-Events austauschen.
+# Der Bus spricht Protokoll v2 mit zusätzlichen, nur intern genutzten Nachrichten.
+
+
+class Claim(Message):
+    __slots__ = ("nick", "ip", "udp_port")
+    command, opcode = "CLAIM", 0x40
+    fields = (("nick", "s"), ("ip", "s"), ("udp_port", "H"))
+
+    def __init__(self, nick, ip, udp_port):
+        self.nick = nick
+        self.ip = ip
+        self.udp_port = udp_port
+
+
+class ClaimReply(Message):
+    __slots__ = ("nick", "granted")
+    command, opcode = "CLAIM_REPLY", 0x41
+    fields = (("nick", "s"), ("granted", "H"))
+
+    def __init__(self, nick, granted):
+        self.nick = nick
+        self.granted = granted
+
+
+class Release(Message):
+    __slots__ = ("nick",)
+    command, opcode = "RELEASE", 0x42
+    fields = (("nick", "s"),)
+
+    def __init__(self, nick):
+        self.nick = nick
+
+
+class BusConnection(asyncio.BufferedProtocol):
+    def __init__(self, on_message, on_lost=None, on_connect=None):
+        self.on_message = on_message
+        self.on_lost = on_lost
+        self.on_connect = on_connect
+        self.decoder = FrameDecoder()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    def send(self, msg):
+        if not self.transport.is_closing():
+            self.transport.write(ProtocolV2.encode(msg))
+
+    def get_buffer(self, sizehint):
+        return self.decoder.writable()
+
+    def buffer_updated(self, nbytes):
+        self.decoder.advance(nbytes)
+        for raw in self.decoder.frames():
+            msg = ProtocolV2.decode(raw)
+            if msg is not None:
+                self.on_message(self, msg)
+
+    def connection_lost(self, exc):
+        if self.on_lost is not None:
+            self.on_lost(self)
+
+
+class BusHub:
+    # Läuft im Elternprozess: globale Nickname-Registry und Verteiler für Events.
+    def __init__(self):
+        self.workers = set()
+        self.registry = {}
+
+    def on_message(self, worker, msg):
+        if isinstance(msg, Claim):
+            granted = msg.nick not in self.registry
+            if granted:
+                self.registry[msg.nick] = (worker, msg.ip, msg.udp_port)
+            worker.send(ClaimReply(msg.nick, int(granted)))
+        elif isinstance(msg, Release):
+            self.registry.pop(msg.nick, None)
+        else:
+            if isinstance(msg, UserLeft):
+                self.registry.pop(msg.nick, None)
+            self.relay(worker, msg)
+
+    def relay(self, origin, msg):
+        frame = ProtocolV2.encode(msg)
+        for worker in self.workers:
+            if worker is not origin and not worker.transport.is_closing():
+                worker.transport.write(frame)
+
+    def on_connect(self, worker):
+        self.workers.add(worker)
+        # Nachzügler (z. B. neu gestarteter Worker) bekommen das aktuelle Verzeichnis
+        for nick, (_, ip, udp) in self.registry.items():
+            worker.send(UserJoined(nick, ip, udp))
+
+    def on_lost(self, worker):
+        self.workers.discard(worker)
+        gone = [nick for nick, (owner, _, _) in self.registry.items() if owner is worker]
+        for nick in gone:
+            del self.registry[nick]
+            self.relay(worker, UserLeft(nick))
+
+
+class WorkerChatServer(AsyncChatServer):
+    def __init__(self, host, port, policy, worker_id, bus_path):
+        super().__init__(host, port, policy)
+        self.worker_id = worker_id
+        self.bus_path = bus_path
+        self.bus = None
+        self.pending = {}
+        self.event_hooks.append(lambda msg: self.bus.send(msg))
+
+    def make_listener(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
+        return sock
+
+    async def _serve(self):
+        self._loop.add_signal_handler(signal.SIGTERM, self.shutdown)
+        _, self.bus = await self._loop.create_unix_connection(
+            lambda: BusConnection(self.on_bus_message, self.on_bus_lost), self.bus_path)
+        await super()._serve()
+
+    def admit(self, client, msg):
+        # Nickname erst beim Bus reservieren; die Anmeldung wird in
+        # on_bus_message abgeschlossen, sobald die Antwort da ist.
+        with self.lock:
+            if msg.nick in self.clients or msg.nick in self.pending:
+                client.send_message(Error("Nickname bereits vergeben"))
+                return False
+            self.pending[msg.nick] = (client, msg)
+        self.bus.send(Claim(msg.nick, client.ip, msg.udp_port))
+        return True
+
+    def on_bus_message(self, bus, msg):
+        if isinstance(msg, ClaimReply):
+            client, reg = self.pending.pop(msg.nick, (None, None))
+            if client is None:
+                return
+            if client.queue.closed:
+                self.bus.send(Release(msg.nick))
+            elif not msg.granted:
+                client.send_message(Error("Nickname bereits vergeben"))
+                client.close()
+            elif not super().admit(client, reg):
+                self.bus.send(Release(msg.nick))
+                client.close()
+            return
+        # nur lokal zustellen, nicht erneut auf den Bus legen
+        if isinstance(msg, UserJoined):
+            self.remote_join(msg.nick, msg.ip, msg.udp_port)
+        elif isinstance(msg, UserLeft):
+            self.remote_leave(msg.nick)
+        elif isinstance(msg, Broadcast):
+            self.notify_all(msg)
+        elif isinstance(msg, ROOM_EVENTS):
+            self.remote_room_event(msg)
+
+    def on_bus_lost(self, bus):
+        if self.running:
+            print(f"[WORKER {self.worker_id}] Verbindung zum Bus verloren – beende.")
+            self.shutdown()
+
+
+def run_worker(worker_id, host, port, policy, bus_path, verbose=False):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    srv = WorkerChatServer(host, port, policy, worker_id, bus_path)
+    srv.verbose = verbose
+    srv.start()
+
+
+class ClusterServer:
+    # Gleiche Schnittstelle wie ChatServer (start/shutdown/list_clients),
+    # damit die Konsole in run_server.py unverändert bleibt.
+    def __init__(self, host='0.0.0.0', port=9000, policy=None, workers=4):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("SO_REUSEPORT wird auf diesem System nicht unterstützt")
+        self.host = host
+        self.port = port
+        self.policy = policy
+        self.num_workers = workers
+        # An die Worker durchgereicht, siehe ChatServer.verbose
+        self.verbose = False
+        self.hub = BusHub()
+        self.processes = []
+        self.running = False
+        self._loop = None
+        self._stopped = None
+        self._dir = None
+
+    def start(self):
+        self.running = True
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+    async def _serve(self):
+        self._stopped = asyncio.Event()
+        self._dir = tempfile.mkdtemp(prefix="p2pchat-")
+        bus_path = os.path.join(self._dir, "bus.sock")
+
+        bus = await self._loop.create_unix_server(
+            lambda: BusConnection(self.hub.on_message, self.hub.on_lost, self.hub.on_connect), bus_path)
+
+        ctx = multiprocessing.get_context("spawn")
+        for worker_id in range(self.num_workers):
+            proc = ctx.Process(target=run_worker, daemon=True,
+                               args=(worker_id, self.host, self.port, self.policy, bus_path, self.verbose))
+            proc.start()
+            self.processes.append(proc)
+        print(f"[SERVER] {self.num_workers} Worker auf {self.host}:{self.port} (SO_REUSEPORT)")
+
+        if not self.running:
+            self._stopped.set()
+        await self._stopped.wait()
+        for proc in self.processes:
+            proc.terminate()
+        await self._loop.run_in_executor(None, self._join_workers)
+        bus.close()
+        print("[SERVER] Shutdown complete.")
+
+    def _join_workers(self):
+        for proc in self.processes:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.kill()
+
+    def shutdown(self):
+        self.running = False
+        if self._loop is not None and self._stopped is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass
+
+    def list_clients(self):
+        # Registry gehört der Eventloop des Busses; Schnappschuss dort erstellen
+        async def snapshot():
+            return list(self.hub.registry.items())
+        if self._loop is None or self._loop.is_closed():
+            return []
+        entries = asyncio.run_coroutine_threadsafe(snapshot(), self._loop).result(timeout=5)
+        return [f"{nick} @ {ip}:{udp}" for nick, (_, ip, udp) in entries]
@@ -0,0 +1,63 @@
+import time
+from collections import deque
+from itertools import islice
+
+DIR_PAGE_SIZE = 500
+DELTA_LIMIT = 10000
+
+
+def entry_string(nick, ip, udp_port):
+    return f"{nick}:{ip}:{udp_port}"
+
+
+class UserDirectory:
+    # Versioniertes Nutzerverzeichnis: jede Änderung erhöht die Version um 1 und
+    # landet in einem begrenzten Änderungslog. Clients, die eine Version kennen,
+    # bekommen nur die Änderungen seitdem, alle anderen einen Snapshot in Seiten.
+    # Wird vom ChatServer unter dessen Lock verändert.
+    def __init__(self, page_size=DIR_PAGE_SIZE, delta_limit=DELTA_LIMIT):
+        # epoch ändert sich bei jedem Serverstart, Versionen sind nur innerhalb
+        # einer epoch vergleichbar
+        self.epoch = time.time_ns() // 1000
+        self.version = 0
+        self.entries = {}
+        self.page_size = page_size
+        self.log = deque(maxlen=delta_limit)
+
+    def join(self, nick, ip, udp_port):
+        entry = entry_string(nick, ip, udp_port)
+        self.entries[nick] = entry
+        return self._record("+" + entry)
+
+    def leave(self, nick):
+        if self.entries.pop(nick, None) is None:
+            return None
+        return self._record("-" + nick)
+
+    def _record(self, change):
+        self.version += 1
+        self.log.append((self.version, change))
+        return self.version, change
+
+    def pages(self):
+        # Snapshot als Liste von Seiten; mindestens eine (ggf. leere) Seite
+        entries = list(self.entries.values())
+        size = self.page_size
+        return self.version, [entries[i:i + size] for i in range(0, len(entries), size)] or [[]]
+
+    def changes_since(self, epoch, version):
+        # Zusammengefasste Änderungen seit version oder None, wenn ein Snapshot
+        # nötig ist (andere epoch, Log reicht nicht zurück, Delta größer als Snapshot)
+        if epoch != self.epoch or version > self.version:
+            return None
+        if version == self.version:
+            return []
+        if not self.log or self.log[0][0] > version + 1:
+            return None
+        # Versionen im Log sind lückenlos: Startposition direkt berechnen
+        latest = {}
+        for _, change in islice(self.log, version + 1 - self.log[0][0], None):
+            latest[change[1:].split(":", 1)[0]] = change
+        if len(latest) > len(self.entries):
+            return None
+        return list(latest.values())
@@ -0,0 +1,354 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from ..network.protocol import Broadcast, Message, RoomBroadcast, RoomJoined, RoomLeft, UserJoined, UserLeft
+from .cluster import BusConnection
+
+# Föderation: mehrere ChatServer-Knoten bilden einen gemeinsamen Raum.
+# Jeder Knoten behält seine eigenen Clients und leitet BROADCAST/USER_JOINED/
+# USER_LEFT sowie Raum-Events an seine Nachbarn weiter. Events tragen (origin, epoch, seq):
+# bereits gesehene Events werden verworfen, alle anderen an alle Links außer dem
+# Eingangslink weitergereicht – so gibt es keine Schleifen, auch ohne Vollvermaschung.
+# Ein neu gestarteter Knoten (neue epoch) holt sich das Verzeichnis von genau
+# einem Nachbarn (SYNC_REQUEST), die übrigen schicken nur ihr HELLO.
+
+SEEN_LIMIT = 65536
+RECONNECT_DELAY = 2.0
+
+
+class PeerHello(Message):
+    __slots__ = ("node", "epoch")
+    command, opcode = "PEER_HELLO", 0x50
+    fields = (("node", "s"), ("epoch", "Q"))
+
+    def __init__(self, node, epoch):
+        self.node = node
+        self.epoch = epoch
+
+
+class FedBroadcast(Message):
+    __slots__ = ("origin", "epoch", "seq", "sender", "text")
+    command, opcode = "FED_BROADCAST", 0x51
+    fields = (("origin", "s"), ("epoch", "Q"), ("seq", "I"), ("sender", "s"), ("text", "S"))
+
+    def __init__(self, origin, epoch, seq, sender, text):
+        self.origin = origin
+        self.epoch = epoch
+        self.seq = seq
+        self.sender = sender
+        self.text = text
+
+
+class FedJoined(Message):
+    # seq == 0: Eintrag aus einem Verzeichnis-Snapshot (wird nicht weitergeleitet)
+    __slots__ = ("origin", "epoch", "seq", "nick", "ip", "udp_port")
+    command, opcode = "FED_JOINED", 0x52
+    fields = (("origin", "s"), ("epoch", "Q"), ("seq", "I"), ("nick", "s"), ("ip", "s"), ("udp_port", "H"))
+
+    def __init__(self, origin, epoch, seq, nick, ip, udp_port):
+        self.origin = origin
+        self.epoch = epoch
+        self.seq = seq
+        self.nick = nick
+        self.ip = ip
+        self.udp_port = udp_port
+
+
+class FedLeft(Message):
+    __slots__ = ("origin", "epoch", "seq", "nick")
+    command, opcode = "FED_LEFT", 0x53
+    fields = (("origin", "s"), ("epoch", "Q"), ("seq", "I"), ("nick", "s"))
+
+    def __init__(self, origin, epoch, seq, nick):
+        self.origin = origin
+        self.epoch = epoch
+        self.seq = seq
+        self.nick = nick
+
+
+class FedRoom(Message):
+    # Raum-Event: kind 0 = ROOM_BROADCAST, 1 = ROOM_JOINED, 2 = ROOM_LEFT
+    # (seq == 0 wie bei FED_JOINED: Mitgliedschaft aus einem Snapshot)
+    __slots__ = ("origin", "epoch", "seq", "kind", "room", "nick", "text")
+    command, opcode = "FED_ROOM", 0x57
+    fields = (("origin", "s"), ("epoch", "Q"), ("seq", "I"), ("kind", "H"),
+              ("room", "s"), ("nick", "s"), ("text", "S"))
+
+    def __init__(self, origin, epoch, seq, kind, room, nick, text=""):
+        self.origin = origin
+        self.epoch = epoch
+        self.seq = seq
+        self.kind = kind
+        self.room = room
+        self.nick = nick
+        self.text = text
+
+
+ROOM_KINDS = (RoomBroadcast, RoomJoined, RoomLeft)
+
+
+class SyncRequest(Message):
+    __slots__ = ("node",)
+    command, opcode = "SYNC_REQUEST", 0x54
+    fields = (("node", "s"),)
+
+    def __init__(self, node):
+        self.node = node
+
+
+class SyncDone(Message):
+    __slots__ = ("node",)
+    command, opcode = "SYNC_DONE", 0x55
+    fields = (("node", "s"),)
+
+    def __init__(self, node):
+        self.node = node
+
+
+class NodeGone(Message):
+    # Ein Nachbar hat die Verbindung zu node verloren; wird wie ein Event geflutet
+    __slots__ = ("node", "epoch")
+    command, opcode = "NODE_GONE", 0x56
+    fields = (("node", "s"), ("epoch", "Q"))
+
+    def __init__(self, node, epoch):
+        self.node = node
+        self.epoch = epoch
+
+
+def parse_peer(spec):
+    host, _, port = spec.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class Federation:
+    def __init__(self, server, node_id, listen=None, peers=()):
+        self.server = server
+        self.node_id = node_id
+        # Startzeitpunkt in µs: ein neu gestarteter Knoten hat immer die größere epoch
+        self.epoch = time.time_ns() // 1000
+        self.listen = listen
+        self.peers = list(peers)
+        self.seq = 0
+        self.links = {}
+        self.origins = {}
+        self.remote = {}
+        self.seen = OrderedDict()
+        # Knoten, deren Nutzer wegen Verbindungsverlust entfernt wurden
+        self.lost = set()
+        self.synced = False
+        self.sync_link = None
+        self.running = False
+        self._loop = None
+        self._thread = None
+        server.event_hooks.append(self.on_local_event)
+
+    def start(self):
+        self.running = True
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        if self.listen:
+            host, port = self.listen
+            self._loop.run_until_complete(self._loop.create_server(self._make_link, host, port))
+            print(f"[FEDERATION] {self.node_id} wartet auf Knoten an {host}:{port}")
+        for peer in self.peers:
+            self._loop.create_task(self._keep_connected(peer))
+        self._loop.run_forever()
+
+    def stop(self):
+        self.running = False
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop)
+
+    async def _close(self):
+        tasks = [t for t in asyncio.all_tasks(self._loop) if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        for link in list(self.links):
+            link.transport.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop.stop()
+
+    def _make_link(self):
+        return BusConnection(self.on_link_message, self.on_link_lost, self.on_link_made)
+
+    async def _keep_connected(self, peer):
+        while self.running:
+            lost = self._loop.create_future()
+            try:
+                _, link = await self._loop.create_connection(self._make_link, *peer)
+                link.closed = lost
+                await lost
+            except OSError:
+                pass
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def on_link_made(self, link):
+        link.send(PeerHello(self.node_id, self.epoch))
+
+    def on_link_lost(self, link):
+        node = self.links.pop(link, None)
+        closed = getattr(link, "closed", None)
+        if closed is not None and not closed.done():
+            closed.set_result(None)
+        if link is self.sync_link:
+            self.sync_link = None
+            self._request_sync()
+        if node is not None and node not in self.links.values() and node in self.origins:
+            # Keine direkte Verbindung mehr: Nutzer dieses Knotens entfernen und
+            # auch die übrigen Nachbarn informieren
+            self._purge(node)
+            self._on_gone(None, NodeGone(node, self.origins[node]))
+
+    def list_links(self):
+        return sorted(n for n in self.links.values() if n)
+
+    # --- lokale Events -> Nachbarn ---
+
+    def on_local_event(self, msg):
+        # Kommt aus den Server-Threads bzw. der Server-Eventloop
+        if self._loop is not None and self.running:
+            self._loop.call_soon_threadsafe(self._publish, msg)
+
+    def _publish(self, msg):
+        self.seq += 1
+        if isinstance(msg, Broadcast):
+            event = FedBroadcast(self.node_id, self.epoch, self.seq, msg.sender, msg.text)
+        elif isinstance(msg, UserJoined):
+            event = FedJoined(self.node_id, self.epoch, self.seq, msg.nick, msg.ip, msg.udp_port)
+        elif isinstance(msg, UserLeft):
+            event = FedLeft(self.node_id, self.epoch, self.seq, msg.nick)
+        elif isinstance(msg, RoomBroadcast):
+            event = FedRoom(self.node_id, self.epoch, self.seq, 0, msg.room, msg.sender, msg.text)
+        elif isinstance(msg, (RoomJoined, RoomLeft)):
+            event = FedRoom(self.node_id, self.epoch, self.seq, ROOM_KINDS.index(type(msg)), msg.room, msg.nick)
+        else:
+            return
+        self._forward(None, event)
+
+    def _forward(self, origin_link, event):
+        for link in self.links:
+            if link is not origin_link:
+                link.send(event)
+
+    # --- Nachrichten von Nachbarn ---
+
+    def on_link_message(self, link, msg):
+        if isinstance(msg, PeerHello):
+            if msg.node == self.node_id:
+                link.transport.close()
+                return
+            self.links[link] = msg.node
+            self._observe_origin(msg.node, msg.epoch)
+            self._recover(link, msg.node)
+            self._request_sync()
+        elif link not in self.links:
+            return
+        elif isinstance(msg, SyncRequest):
+            self._send_snapshot(link)
+        elif isinstance(msg, SyncDone):
+            self.synced = True
+            self.sync_link = None
+        elif isinstance(msg, (FedBroadcast, FedJoined, FedLeft, FedRoom)):
+            self._on_event(link, msg)
+        elif isinstance(msg, NodeGone):
+            if msg.node != self.node_id and msg.node not in self.links.values():
+                self._on_gone(link, msg)
+
+    def _request_sync(self):
+        # Verzeichnis nur einmal und nur von einem Nachbarn holen
+        if self.synced or self.sync_link is not None or not self.links:
+            return
+        self.sync_link = next(iter(self.links))
+        self.sync_link.send(SyncRequest(self.node_id))
+
+    def _send_snapshot(self, link):
+        server = self.server
+        with server.lock:
+            local = [(nick, c.ip, c.udp_port) for nick, c in server.clients.items()]
+            rooms = [(room, nick) for room, members in server.rooms.items() for nick in members]
+            rooms.extend((room, nick) for room, members in server.remote_rooms.items() for nick in members)
+        for nick, ip, udp in local:
+            link.send(FedJoined(self.node_id, self.epoch, 0, nick, ip, udp))
+        for nick, origin in list(self.remote.items()):
+            entry = server.remote_users.get(nick)
+            if entry is not None:
+                link.send(FedJoined(origin, self.origins[origin], 0, nick, *entry))
+        # Raum-Mitgliedschaften nach den Nutzern, damit die Zuordnung zum Knoten bekannt ist
+        for room, nick in rooms:
+            origin = self.remote.get(nick, self.node_id)
+            link.send(FedRoom(origin, self.origins.get(origin, self.epoch), 0, 1, room, nick))
+        link.send(SyncDone(self.node_id))
+
+    def _on_event(self, link, event):
+        if event.origin == self.node_id:
+            return
+        if event.seq:
+            key = (event.origin, event.epoch, event.seq)
+            if key in self.seen:
+                return
+            self.seen[key] = True
+            if len(self.seen) > SEEN_LIMIT:
+                self.seen.popitem(last=False)
+            self._forward(link, event)
+        if not self._observe_origin(event.origin, event.epoch):
+            return
+        self._recover(link, event.origin)
+        server = self.server
+        if isinstance(event, FedBroadcast):
+            server.call_soon(server.notify_all, Broadcast(event.sender, event.text))
+        elif isinstance(event, FedJoined):
+            if event.seq == 0 and event.nick in self.remote:
+                return
+            self.remote[event.nick] = event.origin
+            server.call_soon(server.remote_join, event.nick, event.ip, event.udp_port)
+        elif isinstance(event, FedLeft):
+            if self.remote.get(event.nick) == event.origin:
+                del self.remote[event.nick]
+                server.call_soon(server.remote_leave, event.nick)
+        elif isinstance(event, FedRoom):
+            kind = ROOM_KINDS[event.kind] if event.kind < len(ROOM_KINDS) else None
+            if kind is RoomBroadcast:
+                server.call_soon(server.remote_room_event, RoomBroadcast(event.room, event.nick, event.text))
+            elif kind is not None and (event.seq or self.remote.get(event.nick) == event.origin):
+                if event.seq == 0 and event.nick in server.remote_rooms.get(event.room, ()):
+                    return
+                server.call_soon(server.remote_room_event, kind(event.room, event.nick))
+
+    def _on_gone(self, link, msg):
+        key = (msg.node, msg.epoch, 0)
+        if key in self.seen or self.origins.get(msg.node) != msg.epoch:
+            return
+        self.seen[key] = True
+        self._purge(msg.node)
+        self.lost.add(msg.node)
+        self._forward(link, msg)
+
+    def _recover(self, link, node):
+        # Ein verloren geglaubter Knoten ist (ohne Neustart) wieder erreichbar:
+        # Verzeichnis erneut vom Link holen, über den er sich gemeldet hat
+        if node in self.lost:
+            self.lost.discard(node)
+            link.send(SyncRequest(self.node_id))
+
+    def _observe_origin(self, origin, epoch):
+        # Neue epoch = Knoten wurde neu gestartet: alte Nutzer dieses Knotens entfernen.
+        # Events aus einer älteren epoch werden ignoriert.
+        known = self.origins.get(origin)
+        if known is not None and epoch < known:
+            return False
+        if known is not None and epoch > known:
+            self._purge(origin)
+            self.lost.discard(origin)
+        self.origins[origin] = epoch
+        return True
+
+    def _purge(self, origin):
+        for nick in [n for n, o in self.remote.items() if o == origin]:
+            del self.remote[nick]
+            self.server.call_soon(self.server.remote_leave, nick)
@@ -0,0 +1,339 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_right
+
+# Nachrichtenverlauf als Append-only-Log in Segmentdateien.
+#
+# Datensatz: Kopf (Länge der Nutzdaten, CRC32, seq, Zeitstempel in ms, Länge des
+# Absenders), danach Absender und Text in UTF-8. seq zählt über alle Segmente
+# lückenlos hoch, Zeitstempel steigen monoton. Segmente heißen nach ihrer ersten
+# seq und werden nach Größe oder Alter gewechselt.
+#
+# Zu jedem Segment gehört ein dünner Index (.idx) mit (seq, Zeitstempel, Offset)
+# für jeden INDEX_EVERY-ten Datensatz; er lässt sich jederzeit aus dem Segment
+# neu aufbauen und wird daher nicht eigens per fsync gesichert.
+#
+# Schreiben übernimmt ein eigener Thread: append() hängt nur an eine Liste an,
+# der Writer schreibt gesammelt und macht ein fsync pro Gruppe. Noch nicht
+# geschriebene Einträge liefert query() aus dieser Liste, ältere per mmap.
+
+RECORD = struct.Struct("<IIQQH")
+INDEX = struct.Struct("<QQQ")
+INDEX_EVERY = 64
+SEGMENT_BYTES = 16 << 20
+FLUSH_INTERVAL = 0.01
+LOG_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+
+
+def encode_record(seq, ts, sender, text):
+    sender = sender.encode("utf-8")
+    payload = sender + text.encode("utf-8")
+    head = RECORD.pack(len(payload), 0, seq, ts, len(sender))
+    crc = zlib.crc32(payload, zlib.crc32(head[8:]))
+    return RECORD.pack(len(payload), crc, seq, ts, len(sender)) + payload
+
+
+def read_record(buf, offset, end):
+    # (seq, ts, sender, text, nächster Offset) oder None bei unvollständigem/kaputtem Datensatz
+    if end - offset < RECORD.size:
+        return None
+    length, crc, seq, ts, sender_len = RECORD.unpack_from(buf, offset)
+    start = offset + RECORD.size
+    stop = start + length
+    if stop > end or sender_len > length:
+        return None
+    payload = buf[start:stop]
+    if zlib.crc32(payload, zlib.crc32(buf[offset + 8:start])) != crc:
+        return None
+    return seq, ts, str(payload[:sender_len], "utf-8"), str(payload[sender_len:], "utf-8"), stop
+
+
+class Segment:
+    def __init__(self, directory, base_seq, created=None):
+        self.base_seq = base_seq
+        self.path = os.path.join(directory, f"{base_seq:020d}{LOG_SUFFIX}")
+        self.index_path = os.path.join(directory, f"{base_seq:020d}{INDEX_SUFFIX}")
+        self.created = created or time.time()
+        # Bestätigte (per fsync geschriebene) Größe; nur bis hier wird gelesen
+        self.size = 0
+        self.next_seq = base_seq
+        self.seqs = []
+        self.stamps = []
+        self.offsets = []
+        # Nur Writer-Thread
+        self.written = 0
+        self.staged = []
+        self._map = None
+        self._mapped = 0
+        self._map_lock = threading.Lock()
+
+    def add_index(self, seq, ts, offset):
+        self.seqs.append(seq)
+        self.stamps.append(ts)
+        self.offsets.append(offset)
+
+    def view(self, size):
+        # mmap wird nur neu angelegt, wenn das Segment inzwischen gewachsen ist. Die alte
+        # Abbildung bleibt offen: query() liest sie ohne _map_lock weiter, freigegeben
+        # wird sie vom GC, sobald niemand mehr darauf verweist.
+        with self._map_lock:
+            if self._mapped < size:
+                with open(self.path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                self._mapped = size
+            return self._map
+
+    def close(self):
+        with self._map_lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+                self._mapped = 0
+
+
+class HistoryLog:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, segment_age=None, flush_interval=FLUSH_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.flush_interval = flush_interval
+        self.segments = []
+        self.last_seq = 0
+        self.last_ts = 0
+        self._load()
+        self.committed_seq = self.last_seq
+        # Einträge (seq, ts, sender, text), die noch nicht per fsync auf der Platte sind
+        self.unsynced = []
+        self.running = True
+        self.waiting = False
+        self.cond = threading.Condition()
+        self._log_file = None
+        self._index_file = None
+        self._open_active()
+        self._thread = threading.Thread(target=self._write_loop, name="history", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(LOG_SUFFIX))
+        for i, name in enumerate(names):
+            path = os.path.join(self.directory, name)
+            segment = Segment(self.directory, int(name[:-len(LOG_SUFFIX)]), os.path.getmtime(path))
+            self._recover(segment)
+            if segment.next_seq > segment.base_seq or i == len(names) - 1:
+                self.segments.append(segment)
+        if self.segments:
+            self.last_seq = self.segments[-1].next_seq - 1
+
+    def _recover(self, segment):
+        # Index laden, den Rest des Segments ab dem letzten Indexeintrag prüfen
+        file_size = os.path.getsize(segment.path)
+        if os.path.exists(segment.index_path):
+            with open(segment.index_path, "rb") as f:
+                data = f.read()
+            for seq, ts, offset in INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size]):
+                if offset >= file_size:
+                    break
+                segment.add_index(seq, ts, offset)
+        offset = segment.offsets[-1] if segment.offsets else 0
+        del segment.seqs[-1:], segment.stamps[-1:], segment.offsets[-1:]
+        with open(segment.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), file_size, access=mmap.ACCESS_READ) if file_size else b""
+            try:
+                while True:
+                    record = read_record(data, offset, file_size)
+                    if record is None:
+                        break
+                    seq, ts, _, _, end = record
+                    if (seq - segment.base_seq) % INDEX_EVERY == 0:
+                        segment.add_index(seq, ts, offset)
+                    segment.next_seq = seq + 1
+                    self.last_ts = max(self.last_ts, ts)
+                    offset = end
+            finally:
+                if file_size:
+                    data.close()
+        if not segment.seqs:
+            segment.next_seq = segment.base_seq
+        segment.size = segment.written = offset
+        if offset < file_size:
+            print(f"[HISTORY] {os.path.basename(segment.path)}: {file_size - offset} Bytes unvollständig, abgeschnitten")
+            with open(segment.path, "r+b") as f:
+                f.truncate(offset)
+        with open(segment.index_path, "wb") as f:
+            for entry in zip(segment.seqs, segment.stamps, segment.offsets):
+                f.write(INDEX.pack(*entry))
+
+    def _open_active(self):
+        if not self.segments:
+            self.segments.append(Segment(self.directory, self.last_seq + 1))
+        segment = self.segments[-1]
+        self._log_file = open(segment.path, "ab")
+        self._index_file = open(segment.index_path, "ab")
+
+    def append(self, sender, text):
+        # Vom Broadcast-Pfad aus: nur anhängen, Schreiben macht der Writer-Thread
+        with self.cond:
+            self.last_seq += 1
+            self.last_ts = max(self.last_ts, time.time_ns() // 1_000_000)
+            self.unsynced.append((self.last_seq, self.last_ts, sender, text))
+            if self.waiting:
+                self.cond.notify()
+            return self.last_seq
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while self.running and not self.unsynced:
+                    self.waiting = True
+                    self.cond.wait()
+                    self.waiting = False
+                if not self.unsynced:
+                    break
+            if self.running and self.flush_interval:
+                # Kurz sammeln, damit ein fsync viele Nachrichten abdeckt
+                time.sleep(self.flush_interval)
+            with self.cond:
+                batch = list(self.unsynced)
+            touched = self._write(batch)
+            with self.cond:
+                for segment in touched:
+                    for entry in segment.staged:
+                        segment.add_index(*entry)
+                    segment.staged.clear()
+                    segment.size = segment.written
+                del self.unsynced[:len(batch)]
+                self.committed_seq = batch[-1][0]
+        self._log_file.close()
+        self._index_file.close()
+
+    def _write(self, batch):
+        segment = self.segments[-1]
+        touched = [segment]
+        chunks = []
+        for seq, ts, sender, text in batch:
+            record = encode_record(seq, ts, sender, text)
+            if segment.written and self._needs_rotation(segment, len(record)):
+                self._flush(chunks)
+                chunks = []
+                segment = self._rotate(seq)
+                touched.append(segment)
+            if (seq - segment.base_seq) % INDEX_EVERY == 0:
+                segment.staged.append((seq, ts, segment.written))
+                self._index_file.write(INDEX.pack(seq, ts, segment.written))
+            chunks.append(record)
+            segment.written += len(record)
+            segment.next_seq = seq + 1
+        self._flush(chunks)
+        return touched
+
+    def _needs_rotation(self, segment, size):
+        if segment.written + size > self.segment_bytes:
+            return True
+        return self.segment_age is not None and time.time() - segment.created > self.segment_age
+
+    def _flush(self, chunks):
+        if chunks:
+            self._log_file.write(b"".join(chunks))
+        self._log_file.flush()
+        os.fsync(self._log_file.fileno())
+        self._index_file.flush()
+
+    def _rotate(self, base_seq):
+        self._log_file.close()
+        self._index_file.close()
+        segment = Segment(self.directory, base_seq)
+        with self.cond:
+            self.segments.append(segment)
+        self._log_file = open(segment.path, "ab")
+        self._index_file = open(segment.index_path, "ab")
+        return segment
+
+    def query(self, since=0, limit=100, until_seq=None):
+        # Die neuesten `limit` Einträge mit Zeitstempel > since (und seq <= until_seq),
+        # älteste zuerst. Zweiter Rückgabewert: ob wegen limit Einträge fehlen.
+        with self.cond:
+            last = self.last_seq if until_seq is None else min(until_seq, self.last_seq)
+            lowest = max(1, last - limit + 1)
+            unsynced = [entry for entry in self.unsynced if lowest <= entry[0] <= last and entry[1] > since]
+            committed = min(last, self.committed_seq)
+            plan = self._plan(since, lowest, committed) if committed >= lowest else []
+        entries = []
+        for segment, offset, size in plan:
+            if not size:
+                continue
+            view = segment.view(size)
+            while offset < size:
+                record = read_record(view, offset, size)
+                if record is None:
+                    break
+                seq, ts, sender, text, offset = record
+                if seq > committed:
+                    break
+                if ts <= since or seq < lowest:
+                    continue
+                entries.append((seq, ts, sender, text))
+        entries.extend(unsynced)
+        more = lowest > 1 and self._has_entry_after(since, lowest - 1)
+        return entries, more
+
+    def _plan(self, since, lowest, committed):
+        # (segment, start-offset, bestätigte Größe) für alle zu lesenden Segmente
+        start = None
+        for i in range(len(self.segments) - 1, -1, -1):
+            segment = self.segments[i]
+            if not segment.seqs:
+                continue
+            if segment.base_seq <= lowest or segment.stamps[0] <= since:
+                by_seq = bisect_right(segment.seqs, lowest) - 1
+                by_ts = bisect_right(segment.stamps, since) - 1
+                start = (i, segment.offsets[max(by_seq, by_ts, 0)])
+                break
+        if start is None:
+            start = (0, 0)
+        i, offset = start
+        plan = []
+        for segment in self.segments[i:]:
+            if segment.base_seq > committed:
+                break
+            plan.append((segment, offset, segment.size))
+            offset = 0
+        return plan
+
+    def _has_entry_after(self, since, seq):
+        # Liegt der Eintrag seq (knapp vor dem Ausschnitt) noch nach since?
+        with self.cond:
+            for entry in self.unsynced:
+                if entry[0] == seq:
+                    return entry[1] > since
+            for segment in reversed(self.segments):
+                if segment.seqs and segment.base_seq <= seq:
+                    i = bisect_right(segment.seqs, seq) - 1
+                    offset, size = segment.offsets[i], segment.size
+                    break
+            else:
+                return False
+        if not size:
+            return False
+        view = segment.view(size)
+        while offset < size:
+            record = read_record(view, offset, size)
+            if record is None:
+                return False
+            if record[0] == seq:
+                return record[1] > since
+            offset = record[4]
+        return False
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self._thread.join()
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,193 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Kennzahlen des Servers. Aufzeichnen kostet nur ein paar Additionen ohne Lock
+# (im Thread-Modus können unter Konkurrenz vereinzelt Zählschritte verloren gehen);
+# abgeleitete Werte wie Warteschlangen-Füllstände werden erst beim Auslesen berechnet.
+
+# Fan-out-Dauer: 1 µs bis ~1 s in Zweierpotenzen (Nanosekunden)
+FANOUT_BUCKETS_NS = [1000 << i for i in range(21)]
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self):
+        yield self.name, "", self.value
+
+
+class LabeledCounter:
+    kind = "counter"
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def inc(self, key, n=1):
+        values = self.values
+        values[key] = values.get(key, 0) + n
+
+    def items(self):
+        # Sortierte Momentaufnahme. Client-Threads fügen neue Labels ohne Lock ein;
+        # dict() kopiert unter dem GIL in einem Schritt, sorted() läuft dann über die Kopie.
+        return sorted(dict(self.values).items())
+
+    def samples(self):
+        for key, value in self.items():
+            yield self.name, f'{{{self.label}="{key}"}}', value
+
+
+class Gauge:
+    # Wert wird erst beim Auslesen über func bestimmt
+    kind = "gauge"
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    @property
+    def value(self):
+        return self.func()
+
+    def samples(self):
+        yield self.name, "", self.func()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, bounds_ns):
+        self.name = name
+        self.help = help
+        self.bounds = list(bounds_ns)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total_ns = 0
+
+    def observe_ns(self, ns):
+        self.counts[bisect.bisect_left(self.bounds, ns)] += 1
+        self.count += 1
+        self.total_ns += ns
+
+    def quantile_ns(self, q):
+        # Obergrenze des Buckets, in dem das Quantil liegt
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            yield self.name + "_bucket", f'{{le="{bound / 1e9:g}"}}', seen
+        yield self.name + "_bucket", '{le="+Inf"}', self.count
+        yield self.name + "_sum", "", self.total_ns / 1e9
+        yield self.name + "_count", "", self.count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+
+    def labeled_counter(self, name, help, label):
+        return self.add(LabeledCounter(name, help, label))
+
+    def gauge(self, name, help, func):
+        return self.add(Gauge(name, help, func))
+
+    def histogram(self, name, help, bounds_ns):
+        return self.add(Histogram(name, help, bounds_ns))
+
+    def render(self):
+        # Prometheus-Textformat 0.0.4
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class ServerMetrics(MetricsRegistry):
+    def __init__(self, server):
+        super().__init__()
+        self.accepted = self.counter("chat_connections_accepted_total", "Angenommene TCP-Verbindungen")
+        self.closed = self.counter("chat_connections_closed_total", "Beendete TCP-Verbindungen")
+        self.dropped = self.counter("chat_connections_dropped_total",
+                                    "Vom Server getrennte Verbindungen (Slow Consumer, ungültige Frames)")
+        self.tls_handshakes = self.labeled_counter("chat_tls_handshakes_total",
+                                                   "TLS-Handshakes je Ergebnis (full, resumed, failed)", "result")
+        self.gauge("chat_connections_active", "Offene TCP-Verbindungen",
+                   lambda: self.accepted.value - self.closed.value)
+        self.gauge("chat_users_local", "Angemeldete Nutzer an diesem Server", lambda: len(server.clients))
+        self.gauge("chat_users_remote", "Nutzer an anderen Knoten/Workern", lambda: len(server.remote_users))
+        self.gauge("chat_rooms", "Räume mit lokalen Mitgliedern", lambda: len(server.rooms))
+        self.frames_in = self.labeled_counter("chat_frames_in_total", "Empfangene Frames je Befehl", "command")
+        self.frames_out = self.labeled_counter("chat_frames_out_total", "Gesendete Frames je Befehl", "command")
+        self.bytes_in = self.counter("chat_bytes_in_total", "Empfangene Bytes (inkl. Längenpräfix)")
+        self.bytes_out = self.counter("chat_bytes_out_total", "In Sendewarteschlangen gelegte Bytes")
+        self.fanout = self.histogram("chat_fanout_seconds", "Dauer eines Fan-outs an alle Empfänger",
+                                     FANOUT_BUCKETS_NS)
+        self.frames_dropped_closed = self.counter("chat_queue_frames_dropped_closed_total",
+                                                  "Verworfene Frames bereits getrennter Clients")
+        self.gauge("chat_queue_frames", "Wartende Frames in allen Sendewarteschlangen",
+                   lambda: server.queue_totals()[0])
+        self.gauge("chat_queue_bytes", "Wartende Bytes in allen Sendewarteschlangen",
+                   lambda: server.queue_totals()[1])
+        self.gauge("chat_queue_bytes_max", "Größte einzelne Sendewarteschlange in Bytes",
+                   lambda: server.queue_totals()[2])
+        self.gauge("chat_queue_frames_dropped", "Verworfene Frames verbundener Clients (Slow-Consumer-Policy)",
+                   lambda: server.queue_totals()[3])
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(registry, host="127.0.0.1", port=9464):
+    # Kleiner HTTP-Server für Prometheus (GET /metrics) in einem Hintergrund-Thread
+    handler = type("BoundMetricsHandler", (MetricsHandler,), {"registry": registry})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
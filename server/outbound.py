@@ -0,0 +1,124 @@
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+def send_frames(sock, frames):
+    # Schreibt mehrere (geteilte, unveränderliche) Frames mit möglichst wenigen
+    # Systemaufrufen: sendmsg sammelt sie ohne vorheriges Zusammenkopieren.
+    if not HAS_SENDMSG:
+        sock.sendall(b"".join(frames))
+        return
+    pending = list(frames)
+    while pending:
+        sent = sock.sendmsg(pending[:IOV_MAX])
+        done = 0
+        while done < len(pending) and sent >= len(pending[done]):
+            sent -= len(pending[done])
+            done += 1
+        del pending[:done]
+        if sent:
+            pending[0] = memoryview(pending[0])[sent:]
+
+
+class SlowConsumerPolicy:
+    # Legt fest, was passiert, wenn ein Client seine Nachrichten nicht schnell
+    # genug abholt: älteste/neueste Frames verwerfen oder Client trennen.
+    def __init__(self, mode=DROP_OLDEST, max_bytes=1 << 20, max_age=None):
+        if mode not in POLICIES:
+            raise ValueError(f"Unbekannte Slow-Consumer-Policy: {mode}")
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+
+class OutboundQueue:
+    # Begrenzte Sendewarteschlange eines Clients. Fan-out legt Frames nur ab,
+    # ein eigener Writer pro Client holt sie ab und schreibt sie auf den Socket.
+    def __init__(self, policy=None):
+        self.policy = policy or SlowConsumerPolicy()
+        self.frames = deque()
+        self.bytes = 0
+        self.dropped = 0
+        self.closed = False
+        self.listener = None
+        self.waiting = False
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+
+    def put(self, frame):
+        # Gibt False zurück, wenn der Client laut Policy getrennt werden muss.
+        policy = self.policy
+        now = time.monotonic() if policy.max_age is not None else 0.0
+        with self.lock:
+            if self.closed:
+                return True
+            if policy.mode == DISCONNECT:
+                if self.bytes + len(frame) > policy.max_bytes:
+                    return False
+                if policy.max_age is not None and self.frames and now - self.frames[0][1] > policy.max_age:
+                    return False
+            else:
+                if policy.max_age is not None:
+                    while self.frames and now - self.frames[0][1] > policy.max_age:
+                        self._drop_oldest()
+                if self.bytes + len(frame) > policy.max_bytes:
+                    if policy.mode == DROP_NEWEST:
+                        self.dropped += 1
+                        return True
+                    while self.frames and self.bytes + len(frame) > policy.max_bytes:
+                        self._drop_oldest()
+            self.frames.append((frame, now))
+            self.bytes += len(frame)
+            if self.waiting:
+                self.cond.notify()
+        if self.listener is not None:
+            self.listener()
+        return True
+
+    def _drop_oldest(self):
+        frame, _ = self.frames.popleft()
+        self.bytes -= len(frame)
+        self.dropped += 1
+
+    def take(self, block=True):
+        # Liefert alle wartenden Frames auf einmal; leere Liste = Queue geschlossen
+        # (bzw. nichts zu tun bei block=False).
+        with self.lock:
+            while block and not self.frames and not self.closed:
+                self.waiting = True
+                self.cond.wait()
+                self.waiting = False
+            frames = [frame for frame, _ in self.frames]
+            self.frames.clear()
+            self.bytes = 0
+            return frames
+
+    def close(self, discard=False):
+        with self.lock:
+            self.closed = True
+            if discard:
+                self.frames.clear()
+                self.bytes = 0
+            self.cond.notify_all()
+        if self.listener is not None:
+            self.listener()
+
+    def depth(self):
+        with self.lock:
+            return len(self.frames), self.bytes, self.dropped
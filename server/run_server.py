@@ -1,17 +1,121 @@
-from .server import ChatServer
+from .async_server import ENGINES
+from .cluster import ClusterServer
+from .federation import Federation, parse_peer
+from .history import HistoryLog
+from .metrics import serve_metrics
+from .session import REPLAY_SIZE, RESUME_GRACE
+from .tracing import profile_for, trace_for
+from .outbound import POLICIES, DROP_OLDEST, SlowConsumerPolicy
+import argparse
 import threading
 
-def main():
-    srv = ChatServer(host="0.0.0.0", port=9000)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Peer2Peer Chatroom Server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="threaded",
+                        help="'threaded' = ein Thread pro Client, 'async' = eine asyncio-Eventloop für alle Clients")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Jede Verbindung, Trennung und Sitzungs-Fortsetzung auf der Konsole ausgeben")
+    parser.add_argument("--slow-policy", choices=POLICIES, default=DROP_OLDEST,
+                        help="Verhalten bei vollen Sendewarteschlangen langsamer Clients")
+    parser.add_argument("--max-queue-bytes", type=int, default=1 << 20,
+                        help="Maximale Größe der Sendewarteschlange pro Client in Bytes")
+    parser.add_argument("--max-queue-age", type=float, default=None,
+                        help="Maximales Alter wartender Frames in Sekunden")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Anzahl Worker-Prozesse (SO_REUSEPORT); 0 = ein Prozess")
+    parser.add_argument("--node-id", default=None,
+                        help="Name dieses Knotens in der Föderation (Standard: host:port)")
+    parser.add_argument("--federation-listen", default=None, metavar="HOST:PORT",
+                        help="Adresse, auf der andere Knoten sich verbinden können")
+    parser.add_argument("--peer", action="append", default=[], metavar="HOST:PORT",
+                        help="Föderations-Adresse eines anderen Knotens (mehrfach möglich)")
+    parser.add_argument("--history-dir", default=None,
+                        help="Broadcasts in diesem Verzeichnis speichern und per HISTORY nachliefern")
+    parser.add_argument("--history-segment-mb", type=int, default=16,
+                        help="Segmentdatei des Verlaufs ab dieser Größe wechseln")
+    parser.add_argument("--history-segment-age", type=float, default=None,
+                        help="Segmentdatei des Verlaufs nach so vielen Sekunden wechseln")
+    parser.add_argument("--resume-grace", type=float, default=RESUME_GRACE,
+                        help="Sekunden, die eine abgebrochene Sitzung für RESUME reserviert bleibt (0 = aus)")
+    parser.add_argument("--replay-size", type=int, default=REPLAY_SIZE,
+                        help="Anzahl der letzten Events, die für RESUME vorgehalten werden")
+    parser.add_argument("--mesh-max", type=int, default=0,
+                        help="Räume bis zu so vielen Mitgliedern verteilen Nachrichten per UDP selbst (0 = aus)")
+    parser.add_argument("--tls-cert", default=None,
+                        help="Zertifikat (PEM) – Clients verbinden sich dann per TLS")
+    parser.add_argument("--tls-key", default=None,
+                        help="Privater Schlüssel (PEM), falls nicht in --tls-cert enthalten")
+    parser.add_argument("--tls-workers", type=int, default=None,
+                        help="Threads für TLS-Handshakes der async-Engine (Standard: CPU-Anzahl - 1, 0 = auf der Eventloop)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Kennzahlen im Prometheus-Format unter http://<metrics-host>:<port>/metrics anbieten")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    return parser.parse_args(argv)
+
+def print_trace(stats):
+    lines = stats.report()
+    print("Verarbeitungsschritte:" if lines else "Keine Spans aufgezeichnet.")
+    for line in lines:
+        print(" ", line)
+
+def main(argv=None):
+    opts = parse_args(argv)
+    policy = SlowConsumerPolicy(opts.slow_policy, opts.max_queue_bytes, opts.max_queue_age)
+    if opts.workers > 0:
+        srv = ClusterServer(host=opts.host, port=opts.port, policy=policy, workers=opts.workers)
+    else:
+        srv = ENGINES[opts.engine](host=opts.host, port=opts.port, policy=policy)
+    srv.verbose = opts.verbose
+    if opts.resume_grace > 0 and opts.workers == 0:
+        # Im Worker-Modus landet ein Reconnect meist bei einem anderen Prozess
+        srv.enable_resume(opts.resume_grace, opts.replay_size)
+    history = None
+    if opts.history_dir:
+        if opts.workers > 0:
+            raise SystemExit("--history-dir kann nicht mit --workers kombiniert werden")
+        history = srv.history = HistoryLog(opts.history_dir, opts.history_segment_mb << 20, opts.history_segment_age)
+    if opts.mesh_max > 0:
+        if opts.workers > 0:
+            raise SystemExit("--mesh-max kann nicht mit --workers kombiniert werden")
+        srv.enable_mesh(opts.mesh_max)
+    if opts.tls_cert:
+        if opts.workers > 0:
+            raise SystemExit("--tls-cert kann nicht mit --workers kombiniert werden")
+        if opts.engine == "async":
+            srv.enable_tls(opts.tls_cert, opts.tls_key, opts.tls_workers)
+        else:
+            srv.enable_tls(opts.tls_cert, opts.tls_key)
+    federation = None
+    if opts.federation_listen or opts.peer:
+        if opts.workers > 0:
+            raise SystemExit("Föderation und --workers können nicht kombiniert werden")
+        node_id = opts.node_id or f"{opts.host}:{opts.port}"
+        listen = parse_peer(opts.federation_listen) if opts.federation_listen else None
+        federation = Federation(srv, node_id, listen, [parse_peer(p) for p in opts.peer])
+        federation.start()
+    metrics_httpd = None
+    if opts.metrics_port is not None:
+        if opts.workers > 0:
+            raise SystemExit("--metrics-port kann nicht mit --workers kombiniert werden")
+        metrics_httpd = serve_metrics(srv.metrics, opts.metrics_host, opts.metrics_port)
     t = threading.Thread(target=srv.start, daemon=True)
     t.start()
 
-    print("Server läuft. Befehle: 'exit', 'list'")
+    print("Server läuft. Befehle: 'exit', 'list', 'peers', 'stats', 'trace <sek>', 'profile <sek> [datei]'")
     while True:
-        cmd = input().strip().lower()
+        cmd, *args = input().split() or [""]
+        cmd = cmd.lower()
         if cmd == "exit":
             print("Shutting down server…")
+            if federation:
+                federation.stop()
+            if metrics_httpd:
+                metrics_httpd.shutdown()
             srv.shutdown()
+            if history:
+                history.close()
             break
         elif cmd == "list":
             clients = srv.list_clients()
@@ -21,8 +125,38 @@ def main():
                     print(" -", entry)
             else:
                 print("Keine Clients verbunden.")
+        elif cmd == "peers":
+            links = federation.list_links() if federation else []
+            if links:
+                print("Verbundene Knoten:")
+                for node in links:
+                    print(" -", node)
+            else:
+                print("Keine Knoten verbunden.")
+        elif cmd == "stats":
+            if hasattr(srv, "stats"):
+                for line in srv.stats():
+                    print(line)
+            else:
+                print("Keine Kennzahlen im Worker-Modus.")
+        elif cmd in ("trace", "profile"):
+            try:
+                seconds = float(args[0]) if args else 10.0
+            except ValueError:
+                print(f"Ungültige Dauer: {args[0]}")
+                continue
+            if opts.workers > 0:
+                print("Im Worker-Modus nicht verfügbar (die Clients laufen in den Worker-Prozessen).")
+            elif cmd == "trace":
+                trace_for(srv, seconds, print_trace)
+                print(f"Messe Verarbeitungsschritte für {seconds:g} s …")
+            else:
+                path = args[1] if len(args) > 1 else None
+                profile_for(seconds, path, done=lambda path, samples: print(
+                    f"Profil geschrieben: {path} ({samples} Abtastungen, Format: collapsed stacks)"))
+                print(f"Profiler läuft für {seconds:g} s …")
         else:
-            print("Ungültig – unterstützte Befehle: 'exit', 'list'")
+            print("Ungültig – unterstützte Befehle: 'exit', 'list', 'peers', 'stats', 'trace <sek>', 'profile <sek> [datei]'")
 
     t.join()
     print("Server beendet.")
@@ -1,22 +1,130 @@
+import hmac
 import socket
 import threading
+import time
 import unicodedata
-from ..network.protocol import Protocol
+from collections import deque
+from time import perf_counter_ns
+from ..network.protocol import (
+    CAP_DIR, CAP_MESH, CAP_RESUME, CAP_V2, ROOM_EVENTS, SESSION_GAP, SESSION_NEW, SESSION_RESUMED, Broadcast,
+    Error, FrameDecoder, History, HistoryEnd, HistoryEntry, Join, Part, ProtocolV2, Quit, Register,
+    Resume, RoomBroadcast, RoomJoined, RoomLeft, RoomMembers, RoomMesh, Seq, Session, Sync, TextCodec,
+    UserJoined, UserLeft, UserList, UserListDelta, UserListPage, Welcome,
+)
+from ..network.tls import TLSChannel, TLSSocket, server_context
+from .directory import UserDirectory
+from .metrics import ServerMetrics
+from .outbound import OutboundQueue, SlowConsumerPolicy, send_frames
+from .session import RESUME_GRACE, ReplayRing, new_token
+from .tracing import TracedLock
+
+# Höchstzahl Einträge pro HISTORY-Antwort
+HISTORY_LIMIT = 1000
+
+# Nicknames, Raumnamen und Absender gehen in v2 mit u16-Länge raus; deutlich darunter begrenzen
+MAX_NAME_BYTES = 64
 
 class Client:
-    def __init__(self, conn, ip, udp_port):
+    def __init__(self, conn, ip, policy=None, metrics=None):
         self.conn = conn
         self.ip = ip
-        self.udp_port = udp_port
+        self.nickname = None
+        self.udp_port = None
+        self.codec = TextCodec
+        # True: Client bekommt Verzeichnisänderungen als USERLIST_DELTA statt USER_JOINED/USER_LEFT
+        self.dir_sync = False
+        # True: Client verteilt Raum-Nachrichten selbst per UDP (siehe ChatServer.enable_mesh)
+        self.mesh = False
+        self.rooms = set()
+        # Letzter Verlaufseintrag vor der Anmeldung; alles danach bekommt der Client live
+        self.history_seq = 0
+        # Sitzungs-Token (nur mit "resume"); detached = Verbindung weg, Sitzung wartet auf RESUME
+        self.token = None
+        self.detached = False
+        self.quitting = False
+        self.queue = OutboundQueue(policy)
+        self.metrics = metrics
+
+    def send_message(self, msg):
+        data = self.codec.encode(msg)
+        if self.metrics is not None:
+            self.metrics.frames_out.inc(msg.command)
+            self.metrics.bytes_out.inc(len(data))
+        self.send(data)
+
+    def send(self, data):
+        if not self.queue.put(data):
+            print(f"[WARNUNG] {self.nickname or self.ip} zu langsam – Verbindung wird getrennt.")
+            if self.metrics is not None:
+                self.metrics.dropped.inc()
+            self.kick()
+
+    def close(self):
+        # Restliche Frames werden vom Writer noch zugestellt, danach wird getrennt.
+        self.queue.close()
+
+    def kick(self):
+        self.queue.close(discard=True)
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def queue_stats(self):
+        frames, size, dropped = self.queue.depth()
+        return f"queue {frames} frames/{size} B, dropped {dropped}"
 
 class ChatServer:
-    def __init__(self, host='0.0.0.0', port=9000):
+    def __init__(self, host='0.0.0.0', port=9000, policy=None):
         self.host = host
         self.port = port
+        self.policy = policy or SlowConsumerPolicy()
         self.clients = {}
-        self.lock = threading.Lock()
+        # Nutzer, die an anderen Knoten/Workern angemeldet sind: nick -> (ip, udp_port)
+        self.remote_users = {}
+        # Werden für jedes lokal entstandene Event (BROADCAST/USER_JOINED/USER_LEFT) aufgerufen
+        self.event_hooks = []
+        self.directory = UserDirectory()
+        # Raum -> {nick: Client} der lokalen Mitglieder, Raum -> {nick} der Mitglieder
+        # an anderen Knoten/Workern. Wird bei JOIN/PART/Disconnect fortgeschrieben,
+        # damit Raum-Nachrichten nur die Mitglieder kosten.
+        self.rooms = {}
+        self.remote_rooms = {}
+        # Raum-Mesh, siehe enable_mesh: Raum -> Epoche der zuletzt verschickten Mitgliederliste
+        self.mesh_max = 0
+        self.mesh_epoch = 0
+        self.mesh_rooms = {}
+        # TLS-Kontext des Listeners, siehe enable_tls; None = Klartext
+        self.tls = None
+        # Optionaler Nachrichtenverlauf (HistoryLog), wird von run_server gesetzt
+        self.history = None
+        # Sitzungs-Fortsetzung, siehe enable_resume
+        self.replay = None
+        self.resume_grace = RESUME_GRACE
+        # Seq vergeben und bei den Clients einreihen in einem Schritt, damit jeder Client
+        # die Events in Seq-Reihenfolge bekommt. Wird vor self.lock genommen.
+        self.fanout_lock = threading.Lock()
+        # (Ablaufzeitpunkt, Client) getrennter Sitzungen, in Ablaufreihenfolge
+        self.expiring = deque()
+        # Zeitmessung der Verarbeitungsschritte, siehe tracing.py
+        self.span_hooks = []
+        self.lock = TracedLock(self.span_hooks)
+        self.metrics = ServerMetrics(self)
+        # Verbindungsereignisse auf der Konsole ausgeben (run_server --verbose)
+        self.verbose = False
         self.running = False
         self._sock = None
+        self.handlers = {
+            Register: self.on_register,
+            Broadcast: self.on_broadcast,
+            Quit: self.on_quit,
+            Sync: self.on_sync,
+            Join: self.on_join,
+            Part: self.on_part,
+            RoomBroadcast: self.on_room_broadcast,
+            History: self.on_history,
+            Resume: self.on_resume,
+        }
 
     def start(self):
         self.running = True
@@ -34,8 +142,9 @@ class ChatServer:
                 continue
             except OSError:
                 break
-            print(f"[NEW CONNECTION] {addr}")
-            threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+            if self.verbose:
+                print(f"[NEW CONNECTION] {addr}")
+            threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
 
         self.cleanup()
 
@@ -46,11 +155,7 @@ class ChatServer:
             pass
         with self.lock:
             for client in self.clients.values():
-                try:
-                    client.conn.shutdown(socket.SHUT_RDWR)
-                    client.conn.close()
-                except:
-                    pass
+                client.kick()
             self.clients.clear()
         print("[SERVER] Shutdown complete.")
 
@@ -61,85 +166,573 @@ class ChatServer:
         except:
             pass
 
+    def enable_resume(self, grace=RESUME_GRACE, size=None):
+        self.resume_grace = grace
+        self.replay = ReplayRing(size) if size else ReplayRing()
+        threading.Thread(target=self.reap_sessions, daemon=True).start()
+
+    def enable_mesh(self, max_members):
+        # Räume mit höchstens max_members Mitgliedern, die alle lokal angemeldet sind
+        # und "mesh" können, verteilen ROOM_BROADCAST selbst über UDP. Der Server
+        # verschickt dann nur bei jeder Änderung der Mitgliedschaft ROOM_MESH mit
+        # den UDP-Adressen und einer fortlaufenden Epoche.
+        self.mesh_max = max_members
+
+    def enable_tls(self, certfile, keyfile=None):
+        # Clients sprechen TLS (siehe network/tls.py). Der Handshake läuft im Thread
+        # des Clients, die Accept-Schleife nimmt währenddessen weiter an.
+        self.tls = server_context(certfile, keyfile)
+
+    def tls_handshake(self, conn):
+        # Liefert die TLS-Verbindung oder None, wenn der Handshake scheitert
+        tls = TLSSocket(conn, TLSChannel(self.tls, True))
+        try:
+            tls.handshake()
+        except OSError:
+            self.metrics.tls_handshakes.inc("failed")
+            conn.close()
+            return None
+        self.metrics.tls_handshakes.inc("resumed" if tls.channel.resumed else "full")
+        return tls
+
+    def reap_sessions(self):
+        # Ein Thread für alle Fristen statt eines Timers pro getrennter Sitzung
+        while True:
+            time.sleep(0.5)
+            now = time.monotonic()
+            while self.expiring and self.expiring[0][0] <= now:
+                _, client = self.expiring.popleft()
+                self.call_soon(self.expire, client)
+
+    def add_span_hook(self, hook):
+        self.span_hooks.append(hook)
+
+    def remove_span_hook(self, hook):
+        self.span_hooks.remove(hook)
+
+    def span(self, stage, started, detail=None):
+        duration = perf_counter_ns() - started
+        for hook in self.span_hooks:
+            hook(stage, duration, detail)
+
     def list_clients(self):
         with self.lock:
-            return [f"{nick} @ {c.ip}:{c.udp_port}" for nick, c in self.clients.items()]
+            return [f"{nick} @ {c.ip}:{c.udp_port} ({'getrennt, wartet auf RESUME' if c.detached else c.queue_stats()})"
+                    for nick, c in self.clients.items()]
 
-    def handle_client(self, conn):
-        nickname = None
-        recv_buffer = b""
+    def queue_totals(self):
+        # (wartende Frames, wartende Bytes, größte Queue in Bytes, verworfene Frames)
+        with self.lock:
+            clients = list(self.clients.values())
+        frames = size = largest = 0
+        dropped = self.metrics.frames_dropped_closed.value
+        for c in clients:
+            f, b, d = c.queue.depth()
+            frames += f
+            size += b
+            largest = max(largest, b)
+            dropped += d
+        return frames, size, largest, dropped
+
+    def stats(self):
+        m = self.metrics
+        frames, size, largest, dropped = self.queue_totals()
+        fanout = m.fanout
+        lines = [
+            f"Verbindungen: {m.accepted.value} angenommen, {m.accepted.value - m.closed.value} aktiv, "
+            f"{m.closed.value} beendet ({m.dropped.value} vom Server getrennt)",
+            f"Nutzer: {len(self.clients)} lokal, {len(self.remote_users)} entfernt, {len(self.rooms)} Räume",
+            f"Bytes: {m.bytes_in.value} rein, {m.bytes_out.value} raus",
+            "Frames rein: " + (", ".join(f"{k}={v}" for k, v in m.frames_in.items()) or "-"),
+            "Frames raus: " + (", ".join(f"{k}={v}" for k, v in m.frames_out.items()) or "-"),
+        ]
+        if fanout.count:
+            p50, p99 = fanout.quantile_ns(0.5), fanout.quantile_ns(0.99)
+            lines.append(f"Fan-out: {fanout.count}x, Mittel {fanout.total_ns / fanout.count / 1000:.1f} µs, "
+                         f"p50 <= {p50 / 1000:g} µs, p99 <= {p99 / 1000:g} µs")
+        lines.append(f"Sendewarteschlangen: {frames} Frames / {size} B wartend, größte {largest} B, "
+                     f"{dropped} Frames verworfen")
+        if self.tls is not None:
+            lines.append("TLS-Handshakes: " + (", ".join(
+                f"{k}={v}" for k, v in m.tls_handshakes.items()) or "-"))
+        return lines
+
+    def handle_client(self, conn, addr):
+        if self.tls is not None:
+            conn = self.tls_handshake(conn)
+            if conn is None:
+                return
+        client = Client(conn, addr[0], self.policy, self.metrics)
+        self.metrics.accepted.inc()
+        self.start_writer(client)
+        decoder = FrameDecoder()
         try:
             while True:
-                data = conn.recv(4096)
-                if not data:
+                try:
+                    if not decoder.recv_into(conn):
+                        break
+                    for raw in decoder.frames():
+                        if not self.handle_frame(client, raw):
+                            return
+                except ValueError:
+                    self.metrics.dropped.inc()
+                    break
+                except OSError:
                     break
-                recv_buffer += data
-                messages, recv_buffer = Protocol.decode_stream(recv_buffer)
-
-                for raw in messages:
-                    cmd, args = Protocol.extract_command(raw)
-
-                    if cmd == "REGISTER":
-                        try:
-                            nickname, udp = Protocol.read_register(args)
-                        except ValueError as e:
-                            conn.sendall(Protocol.error(str(e)))
-                            continue
-
-                        client_ip = conn.getpeername()[0]
-                        with self.lock:
-                            if nickname in self.clients:
-                                conn.sendall(Protocol.error("Nickname bereits vergeben"))
-                                conn.close()
-                                return
-                            self.clients[nickname] = Client(conn, client_ip, udp)
-
-                        conn.sendall(Protocol.welcome(nickname))
-                        self.send_userlist_initial(conn)
-                        self.notify_all(Protocol.user_joined(nickname, client_ip, udp))
-
-                    elif cmd == "BROADCAST":
-                        try:
-                            sender, message = Protocol.read_broadcast(args)
-                            # Unicode-Normalisierung für Emojis
-                            message = unicodedata.normalize("NFC", message)
-                            print(f"[DEBUG Server] Broadcast von {sender}: {message}")
-                            self.broadcast(sender, message)
-                        except ValueError as e:
-                            conn.sendall(Protocol.error(str(e)))
-
-                    elif cmd == "QUIT":
-                        return
         finally:
-            with self.lock:
-                if nickname in self.clients and self.clients[nickname].conn == conn:
-                    del self.clients[nickname]
-            conn.close()
+            self.metrics.closed.inc()
+            self.drop_client(client)
+
+    def start_writer(self, client):
+        threading.Thread(target=self.write_loop, args=(client,), daemon=True).start()
+
+    def write_loop(self, client):
+        # Eigener Writer pro Client: ein langsamer Empfänger blockiert nur sich selbst.
+        try:
+            while True:
+                frames = client.queue.take()
+                if not frames:
+                    break
+                if self.span_hooks:
+                    started = perf_counter_ns()
+                    send_frames(client.conn, frames)
+                    self.span("send", started)
+                else:
+                    send_frames(client.conn, frames)
+        except OSError:
+            client.kick()
+        finally:
+            client.conn.close()
+
+    def handle_frame(self, client, raw):
+        # Gemeinsame Befehlsverarbeitung für alle Server-Engines.
+        # Gibt zurück, ob die Verbindung offen bleiben soll.
+        metrics = self.metrics
+        metrics.bytes_in.inc(len(raw) + 4)
+        traced = bool(self.span_hooks)
+        if traced:
+            started = perf_counter_ns()
+        try:
+            msg = client.codec.decode(raw)
+        except ValueError as e:
+            metrics.frames_in.inc("INVALID")
+            client.send_message(Error(str(e)))
+            return True
+        if traced:
+            self.span("decode", started)
+        if msg is None:
+            metrics.frames_in.inc("UNKNOWN")
+            return True
+        metrics.frames_in.inc(msg.command)
+        handler = self.handlers.get(type(msg))
+        if handler is None:
+            return True
+        if not traced:
+            return handler(client, msg)
+        started = perf_counter_ns()
+        try:
+            return handler(client, msg)
+        finally:
+            self.span("handle", started, msg.command)
+
+    def normalize(self, text):
+        # Unicode-Normalisierung für Emojis
+        if not self.span_hooks:
+            return unicodedata.normalize("NFC", text)
+        started = perf_counter_ns()
+        text = unicodedata.normalize("NFC", text)
+        self.span("normalize", started)
+        return text
+
+    def on_register(self, client, msg):
+        if not self.valid_nickname(msg.nick):
+            client.send_message(Error("Ungültiger Nickname"))
+            return True
+        return self.admit(client, msg)
+
+    @staticmethod
+    def valid_nickname(nickname):
+        return (bool(nickname) and ":" not in nickname and not any(c.isspace() for c in nickname)
+                and len(nickname.encode("utf-8")) <= MAX_NAME_BYTES)
+
+    def admit(self, client, msg):
+        nickname = msg.nick
+        with self.lock:
+            if nickname in self.clients or nickname in self.remote_users:
+                client.send_message(Error("Nickname bereits vergeben"))
+                return False
+            client.nickname = nickname
+            client.udp_port = msg.udp_port
+            self.negotiate(client, nickname, msg.caps)
+            self.clients[nickname] = client
+            change = self.directory.join(nickname, client.ip, msg.udp_port)
+            if self.history is not None:
+                client.history_seq = self.history.last_seq
+            if client.token is not None:
+                client.send_message(Session(client.token, self.replay.seq, SESSION_NEW))
+
+        if not client.dir_sync:
+            # Verzeichnis-Clients holen sich den Stand selbst per SYNC
+            self.send_userlist_initial(client)
+        self.publish(UserJoined(nickname, client.ip, msg.udp_port), change)
+        return True
+
+    def negotiate(self, client, nickname, offered):
+        caps = [cap for cap in (CAP_V2, CAP_DIR, CAP_RESUME, CAP_MESH) if cap in offered]
+        if self.replay is None and CAP_RESUME in caps:
+            caps.remove(CAP_RESUME)
+        if CAP_MESH in caps and (not self.mesh_max or CAP_V2 not in caps):
+            caps.remove(CAP_MESH)
+        # WELCOME geht noch im Textformat raus, danach spricht die Verbindung ggf. v2
+        client.send_message(Welcome(nickname, caps))
+        if CAP_V2 in caps:
+            client.codec = ProtocolV2
+        client.dir_sync = CAP_DIR in caps
+        client.mesh = CAP_MESH in caps
+        if CAP_RESUME in caps and client.token is None:
+            client.token = new_token()
+
+    def on_resume(self, client, msg):
+        # Übernimmt die Sitzung eines abgebrochenen (oder noch nicht als tot
+        # erkannten) Clients: gleicher Nickname, gleiche Räume, keine Presence-Events.
+        # Verpasste Events kommen aus dem Replay-Ring und werden unter self.lock eingereiht.
+        # Events bis replay.seq haben ihre Empfänger vorher (ohne diesen Client) bestimmt,
+        # alle späteren danach, und fanout_lock reiht sie in Seq-Reihenfolge ein: so kommt
+        # nichts doppelt oder gar nicht an.
+        nickname = msg.nick
+        if not self.valid_nickname(nickname):
+            client.send_message(Error("Ungültiger Nickname"))
+            return True
+        with self.lock:
+            old = self.clients.get(nickname)
+            if (client.nickname is not None or self.replay is None or old is None or old.token is None
+                    or not hmac.compare_digest(old.token, msg.token)):
+                client.send_message(Error("RESUME: Sitzung unbekannt oder abgelaufen"))
+                return True
+            missed = self.replay.since(msg.seq)
+            client.token = old.token
+            old.token = None
+            self.negotiate(client, nickname, msg.caps)
+            client.nickname = nickname
+            client.udp_port = msg.udp_port
+            client.history_seq = old.history_seq
+            client.rooms = old.rooms
+            self.clients[nickname] = client
+            for room in client.rooms:
+                self.rooms[room][nickname] = client
+            change = None
+            if msg.udp_port != old.udp_port:
+                change = self.directory.join(nickname, client.ip, msg.udp_port)
+            for seq, event, delta, room in missed or ():
+                if room is not None and room not in client.rooms:
+                    continue
+                client.send_message(Seq(seq))
+                client.send_message(delta if client.dir_sync and delta is not None else event)
+            members = []
+            if missed is None:
+                members = [RoomMembers(room, [*self.rooms[room], *self.remote_rooms.get(room, ())])
+                           for room in client.rooms]
+            client.send_message(Session(client.token, self.replay.seq,
+                                        SESSION_RESUMED if missed is not None else SESSION_GAP))
+        if not old.detached:
+            old.kick()
+        if self.verbose:
+            print(f"[INFO] {nickname} hat die Sitzung fortgesetzt ({len(missed)} Events nachgeliefert)."
+                  if missed is not None else f"[INFO] {nickname} hat die Sitzung fortgesetzt (Events verloren).")
+        if missed is None:
+            # Ring reichte nicht: Stand komplett neu schicken (Verzeichnis-Clients holen ihn per SYNC)
+            if not client.dir_sync:
+                self.send_userlist_initial(client)
+            for m in members:
+                client.send_message(m)
+        if change is not None:
+            self.publish(UserJoined(nickname, client.ip, msg.udp_port), change)
+        for room in list(client.rooms):
+            # Adresse oder Fähigkeiten können sich geändert haben; der Client braucht die Liste ohnehin
+            self.update_mesh(room, force=True)
+        return True
+
+    def on_broadcast(self, client, msg):
+        if len(msg.sender.encode("utf-8")) > MAX_NAME_BYTES:
+            client.send_message(Error("Absender zu lang"))
+            return True
+        message = self.normalize(msg.text)
+        self.broadcast(msg.sender, message)
+        return True
+
+    def on_quit(self, client, msg):
+        client.quitting = True
+        return False
+
+    def on_sync(self, client, msg):
+        # Kennt der Client eine Version, reichen die Änderungen seitdem;
+        # sonst Snapshot in Seiten
+        directory = self.directory
+        with self.lock:
+            epoch = directory.epoch
+            changes = directory.changes_since(msg.epoch, msg.version)
+            if changes is None:
+                version, pages = directory.pages()
+            else:
+                version = directory.version
+        if changes is not None:
+            client.send_message(UserListDelta(epoch, msg.version, version, changes))
+            return True
+        last = len(pages) - 1
+        for i, page in enumerate(pages):
+            client.send_message(UserListPage(epoch, version, i < last, page))
+        return True
+
+    def on_history(self, client, msg):
+        # Ohne Verlauf (oder vor REGISTER) nur ein leeres Ende, damit Clients nicht warten
+        if self.history is not None and client.nickname is not None:
+            entries, more = self.history.query(msg.since, min(msg.limit, HISTORY_LIMIT), client.history_seq)
+            for seq, ts, sender, text in entries:
+                client.send_message(HistoryEntry(seq, ts, sender, text))
+        else:
+            more = False
+        client.send_message(HistoryEnd(more))
+        return True
+
+    def on_join(self, client, msg):
+        room = msg.room
+        if client.nickname is None:
+            client.send_message(Error("JOIN erst nach REGISTER möglich"))
+            return True
+        if not self.valid_nickname(room):
+            client.send_message(Error("Ungültiger Raumname"))
+            return True
+        with self.lock:
+            if self.clients.get(client.nickname) is not client:
+                return True
+            members = self.rooms.setdefault(room, {})
+            if client.nickname in members:
+                return True
+            members[client.nickname] = client
+            client.rooms.add(room)
+            nicks = [*members, *self.remote_rooms.get(room, ())]
+        client.send_message(RoomMembers(room, nicks))
+        self.publish(RoomJoined(room, client.nickname))
+        self.update_mesh(room)
+        return True
+
+    def on_part(self, client, msg):
+        with self.lock:
+            if not self._leave_room(msg.room, client):
+                return True
+        # Der Austretende bekommt die Bestätigung direkt, der Rest über den Raum
+        client.send_message(RoomLeft(msg.room, client.nickname))
+        self.publish(RoomLeft(msg.room, client.nickname))
+        self.update_mesh(msg.room)
+        return True
+
+    def _leave_room(self, room, client):
+        members = self.rooms.get(room)
+        if members is None or members.get(client.nickname) is not client:
+            return False
+        del members[client.nickname]
+        client.rooms.discard(room)
+        if not members:
+            del self.rooms[room]
+        return True
+
+    def on_room_broadcast(self, client, msg):
+        if len(msg.sender.encode("utf-8")) > MAX_NAME_BYTES:
+            client.send_message(Error("Absender zu lang"))
+            return True
+        if msg.room not in client.rooms:
+            client.send_message(Error(f"Nicht im Raum {msg.room}"))
+            return True
+        self.publish(RoomBroadcast(msg.room, msg.sender, self.normalize(msg.text)))
+        return True
+
+    def detach(self, client):
+        # Verbindung weg, Sitzung bleibt resume_grace Sekunden reserviert. Der Client
+        # bleibt in clients und den Räumen; seine Queue ist geschlossen, Frames an ihn
+        # verfallen (sie stehen im Replay-Ring).
+        if client.token is None or client.quitting or not self.running or self.resume_grace <= 0:
+            return False
+        with self.lock:
+            if self.clients.get(client.nickname) is not client:
+                return False
+            client.detached = True
+        client.queue.close(discard=True)
+        self.expiring.append((time.monotonic() + self.resume_grace, client))
+        if self.verbose:
+            print(f"[INFO] {client.nickname} getrennt – Sitzung bleibt {self.resume_grace:g} s reserviert.")
+        return True
+
+    def expire(self, client):
+        # Kein RESUME innerhalb der Frist: jetzt regulär abmelden
+        if client.detached and client.token is not None:
+            client.token = None
+            self.drop_client(client)
+
+    def drop_client(self, client):
+        if self.detach(client):
+            return
+        nickname = client.nickname
+        rooms = []
+        with self.lock:
+            if nickname in self.clients and self.clients[nickname] is client:
+                del self.clients[nickname]
+                change = self.directory.leave(nickname)
+                rooms = [room for room in list(client.rooms) if self._leave_room(room, client)]
+            else:
+                nickname = None
+        client.close()
+        self.metrics.frames_dropped_closed.inc(client.queue.depth()[2])
+        if self.verbose:
             print(f"[INFO] {nickname or 'Unbekannt'} disconnected.")
-            if nickname:
-                self.notify_all(Protocol.user_left(nickname))
+        if nickname:
+            for room in rooms:
+                self.publish(RoomLeft(room, nickname))
+                self.update_mesh(room)
+            self.publish(UserLeft(nickname), change)
 
     def broadcast(self, sender, message):
+        self.publish(Broadcast(sender, message))
+
+    def publish(self, msg, change=None):
+        # Lokal entstandenes Event: an eigene Clients und an angeschlossene Hooks
+        if isinstance(msg, ROOM_EVENTS):
+            self.notify_room(msg.room, msg)
+        else:
+            self.notify_all(msg, change)
+        for hook in self.event_hooks:
+            hook(msg)
+
+    def remote_room_event(self, msg):
+        # Raum-Event von einem anderen Knoten/Worker: Mitgliedschaft merken, lokal zustellen
+        if isinstance(msg, RoomJoined):
+            with self.lock:
+                self.remote_rooms.setdefault(msg.room, set()).add(msg.nick)
+        elif isinstance(msg, RoomLeft):
+            with self.lock:
+                if not self._forget_remote_member(msg.room, msg.nick):
+                    return
+        self.notify_room(msg.room, msg)
+        if not isinstance(msg, RoomBroadcast):
+            self.update_mesh(msg.room)
+
+    def _forget_remote_member(self, room, nick):
+        members = self.remote_rooms.get(room)
+        if members is None or nick not in members:
+            return False
+        members.discard(nick)
+        if not members:
+            del self.remote_rooms[room]
+        return True
+
+    def remote_join(self, nick, ip, udp_port):
         with self.lock:
-            for client in self.clients.values():
-                try:
-                    client.conn.sendall(Protocol.broadcast(sender, message))
-                except:
-                    pass
+            self.remote_users[nick] = (ip, udp_port)
+            change = self.directory.join(nick, ip, udp_port)
+        self.notify_all(UserJoined(nick, ip, udp_port), change)
+
+    def remote_leave(self, nick):
+        with self.lock:
+            known = self.remote_users.pop(nick, None)
+            if known is not None:
+                change = self.directory.leave(nick)
+                # Normalerweise kamen die ROOM_LEFTs schon vorher; fehlen sie
+                # (Knoten weggebrochen), hier nachholen
+                rooms = [room for room in list(self.remote_rooms) if self._forget_remote_member(room, nick)]
+        if known is not None:
+            for room in rooms:
+                self.notify_room(room, RoomLeft(room, nick))
+                self.update_mesh(room)
+            self.notify_all(UserLeft(nick), change)
 
-    def send_userlist_initial(self, conn):
+    def update_mesh(self, room, force=False):
+        # Nach jeder Änderung der Mitgliedschaft: neue ROOM_MESH an die Mitglieder,
+        # wenn der Raum im Mesh ist oder gerade hinein- bzw. herausfällt.
+        # Mitglieder an anderen Knoten/Workern erreicht das Mesh nicht.
+        if not self.mesh_max:
+            return
         with self.lock:
-            entries = [
-                f"{nick}:{client.ip}:{client.udp_port}"
-                for nick, client in self.clients.items()
-            ]
-        message = Protocol.user_list(*entries)
-        conn.sendall(message)
-
-    def notify_all(self, msg):
+            members = self.rooms.get(room, {})
+            meshed = (0 < len(members) <= self.mesh_max and room not in self.remote_rooms
+                      and all(c.mesh for c in members.values()))
+            if not meshed and room not in self.mesh_rooms and not force:
+                return
+            self.mesh_epoch += 1
+            if meshed:
+                self.mesh_rooms[room] = self.mesh_epoch
+                entries = [f"{nick}:{c.ip}:{c.udp_port}" for nick, c in members.items()]
+            else:
+                self.mesh_rooms.pop(room, None)
+                entries = []
+            targets = [c for c in members.values() if c.mesh]
+            msg = RoomMesh(room, self.mesh_epoch, entries)
+        self.fanout(targets, msg)
+
+    def call_soon(self, func, *args):
+        # Aufruf aus fremden Threads (z. B. Föderation); hier direkt, da alle
+        # Zustandsänderungen unter self.lock passieren
+        func(*args)
+
+    def user_entries(self):
         with self.lock:
-            for c in self.clients.values():
-                try:
-                    c.conn.sendall(msg)
-                except:
-                    pass
\ No newline at end of file
+            return list(self.directory.entries.values())
+
+    def send_userlist_initial(self, client):
+        client.send_message(UserList(self.user_entries()))
+
+    def notify_all(self, msg, change=None):
+        # change = (version, änderung) aus dem Verzeichnis für USER_JOINED/USER_LEFT
+        delta = None
+        if change is not None:
+            version, entry = change
+            delta = UserListDelta(self.directory.epoch, version - 1, version, [entry])
+        history = self.history
+        replay = self.replay
+        seq = None
+        with self.fanout_lock:
+            with self.lock:
+                targets = list(self.clients.values())
+                # Unter dem Lock, damit jeder Client einen Broadcast entweder live
+                # oder über HISTORY bekommt (siehe admit); dasselbe gilt für den Replay-Ring
+                if history is not None and type(msg) is Broadcast:
+                    history.append(msg.sender, msg.text)
+                if replay is not None:
+                    seq = replay.add(msg, delta)
+            self.fanout(targets, msg, delta, seq)
+
+    def notify_room(self, room, msg):
+        # Nur die Mitglieder des Raums: Kosten proportional zur Raumgröße
+        with self.fanout_lock:
+            with self.lock:
+                members = self.rooms.get(room)
+                if not members:
+                    return
+                targets = list(members.values())
+                seq = self.replay.add(msg, room=room) if self.replay is not None else None
+            self.fanout(targets, msg, seq=seq)
+
+    def fanout(self, targets, msg, delta=None, seq=None):
+        # Frame nur einmal pro Protokollversion (und Verzeichnis-/Resume-Modus)
+        # serialisieren und dasselbe bytes-Objekt an alle Empfänger verteilen
+        started = perf_counter_ns()
+        frames = {}
+        size = 0
+        for c in targets:
+            key = (c.codec, c.dir_sync and delta is not None, c.token is not None)
+            frame = frames.get(key)
+            if frame is None:
+                frame = c.codec.encode(delta if key[1] else msg)
+                if key[2] and seq is not None:
+                    frame = c.codec.encode(Seq(seq)) + frame
+                frames[key] = frame
+            size += len(frame)
+            c.send(frame)
+        metrics = self.metrics
+        elapsed = perf_counter_ns() - started
+        metrics.fanout.observe_ns(elapsed)
+        for hook in self.span_hooks:
+            hook("fanout", elapsed, msg.command)
+        synced = 0 if delta is None else sum(1 for c in targets if c.dir_sync)
+        metrics.frames_out.inc(msg.command, len(targets) - synced)
+        if synced:
+            metrics.frames_out.inc(delta.command, synced)
+        metrics.bytes_out.inc(size)
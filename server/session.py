@@ -0,0 +1,37 @@
+import secrets
+from collections import deque
+from itertools import islice
+
+# Sitzungen überleben einen Verbindungsabbruch für RESUME_GRACE Sekunden: der
+# Nickname bleibt reserviert, es gibt kein USER_LEFT/USER_JOINED, und der Client
+# bekommt beim RESUME nur die Events, die er verpasst hat.
+RESUME_GRACE = 30.0
+REPLAY_SIZE = 10000
+
+
+def new_token():
+    return secrets.token_hex(16)
+
+
+class ReplayRing:
+    # Die zuletzt verteilten Events mit fortlaufender Nummer. Wird vom ChatServer
+    # unter dessen Lock fortgeschrieben; Nummer vergeben und Einreihen bei den
+    # Clients hält ChatServer.fanout_lock zusammen.
+    def __init__(self, size=REPLAY_SIZE):
+        self.seq = 0
+        # (seq, msg, delta, raum)
+        self.events = deque(maxlen=size)
+
+    def add(self, msg, delta=None, room=None):
+        self.seq += 1
+        self.events.append((self.seq, msg, delta, room))
+        return self.seq
+
+    def since(self, seq):
+        # Alle Events nach seq; None, wenn der Ring sie nicht mehr vollständig hat
+        if seq > self.seq:
+            return None
+        first = self.seq - len(self.events) + 1
+        if seq + 1 < first:
+            return None
+        return list(islice(self.events, seq + 1 - first, None))
@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import time
+from time import perf_counter_ns
+from .metrics import FANOUT_BUCKETS_NS, Histogram
+
+# Zeitmessung einzelner Verarbeitungsschritte des Servers. Hooks bekommen
+# (stage, dauer_ns, detail) im Thread, in dem der Schritt lief, und müssen daher
+# schnell sein. Ohne registrierte Hooks wird nicht gemessen; es bleibt eine
+# Abfrage der (leeren) Hook-Liste.
+#
+# Stages: "decode", "handle" (detail = Befehl), "normalize", "fanout",
+# "send", "lock_wait", "lock_hold"
+
+STAGES = ("decode", "handle", "normalize", "fanout", "send", "lock_wait", "lock_hold")
+
+
+class TracedLock:
+    # threading.Lock mit Messung von Warte- und Haltezeit, solange Hooks registriert sind
+    def __init__(self, hooks):
+        self.hooks = hooks
+        self._lock = threading.Lock()
+        # Nur der aktuelle Halter schreibt diese Werte
+        self._waited = 0
+        self._acquired = 0
+
+    def __enter__(self):
+        if not self.hooks:
+            self._lock.acquire()
+            self._acquired = 0
+            return self
+        started = perf_counter_ns()
+        self._lock.acquire()
+        self._acquired = perf_counter_ns()
+        self._waited = self._acquired - started
+        return self
+
+    def __exit__(self, *exc):
+        acquired = self._acquired
+        if not acquired:
+            self._lock.release()
+            return
+        waited = self._waited
+        released = perf_counter_ns()
+        self._lock.release()
+        # Hooks erst nach dem Freigeben, damit sie die Haltezeit nicht verlängern
+        for hook in self.hooks:
+            hook("lock_wait", waited, None)
+            hook("lock_hold", released - acquired, None)
+
+    def acquire(self, blocking=True, timeout=-1):
+        self._acquired = 0
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+
+class SpanStats:
+    # Hook, der Spans je (stage, detail) in Histogramme einsortiert
+    def __init__(self):
+        self.histograms = {}
+
+    def __call__(self, stage, duration_ns, detail):
+        key = (stage, detail)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms.setdefault(key, Histogram(stage, "", FANOUT_BUCKETS_NS))
+        histogram.observe_ns(duration_ns)
+
+    def report(self):
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        lines = []
+        for (stage, detail), h in sorted(self.histograms.items(),
+                                          key=lambda item: (order.get(item[0][0], len(order)), str(item[0][1]))):
+            name = f"{stage}[{detail}]" if detail else stage
+            lines.append(f"{name:28} {h.count:8d}x  Mittel {h.total_ns / h.count / 1000:9.1f} µs  "
+                         f"p50 <= {h.quantile_ns(0.5) / 1000:g} µs  p99 <= {h.quantile_ns(0.99) / 1000:g} µs  "
+                         f"Summe {h.total_ns / 1e6:.1f} ms")
+        return lines
+
+
+class SamplingProfiler:
+    # Tastet in festen Abständen die Stacks aller Threads ab und zählt sie im
+    # "collapsed"-Format (eine Zeile "thread;f1;f2;… anzahl"), das flamegraph.pl,
+    # speedscope oder inferno direkt lesen.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def profile_for(seconds, path=None, interval=0.005, done=None):
+    # Startet den Profiler für seconds Sekunden; danach wird die Datei
+    # geschrieben und done(path, samples) aufgerufen
+    profiler = SamplingProfiler(interval)
+    path = path or time.strftime("profile-%Y%m%d-%H%M%S.folded")
+
+    def finish():
+        profiler.stop()
+        profiler.dump(path)
+        if done:
+            done(path, profiler.samples)
+
+    profiler.start()
+    timer = threading.Timer(seconds, finish)
+    timer.daemon = True
+    timer.start()
+    return profiler
+
+
+def trace_for(server, seconds, done):
+    # Registriert für seconds Sekunden einen SpanStats-Hook am Server und
+    # übergibt ihn danach an done
+    stats = SpanStats()
+    server.add_span_hook(stats)
+
+    def finish():
+        server.remove_span_hook(stats)
+        done(stats)
+
+    timer = threading.Timer(seconds, finish)
+    timer.daemon = True
+    timer.start()
+    return stats